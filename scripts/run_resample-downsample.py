@@ -0,0 +1,174 @@
+import click
+import pandas as pd
+from nomadic.lib.generic import print_header, print_footer, produce_dir
+from nomadic.lib.parsing import build_parameter_dict
+from nomadic.pipeline.cli import experiment_options
+from nomadic.pipeline.calling.resample import (
+    MIN_DEPTH,
+    MIN_WSAF,
+    load_vcf_sites,
+    AlleleMatrix,
+    AlleleResampler,
+    summarise_curves,
+)
+
+
+AMPLICON_PATH = "configs/beds/nomads8.amplicons.bed"
+N_REPLICATES = 1000
+
+
+@click.command(short_help="Estimate calling performance by resampling reads.")
+@experiment_options
+@click.option(
+    "-b",
+    "--barcode",
+    type=int,
+    required=True,
+    help="Barcode to resample.",
+)
+@click.option(
+    "-t",
+    "--truth_vcf",
+    type=click.Path(exists=True),
+    required=True,
+    help="VCF containing the true variants of the barcode's sample.",
+)
+@click.option(
+    "-s",
+    "--truth_sample",
+    type=str,
+    required=True,
+    help="Name of the barcode's sample in --truth_vcf.",
+)
+@click.option(
+    "-q",
+    "--candidate_vcf",
+    type=click.Path(exists=True),
+    default=None,
+    help="VCF of candidate sites; by default, the calls of `nomadic call` on all reads.",
+)
+@click.option(
+    "-m",
+    "--method",
+    type=str,
+    default="bcftools",
+    show_default=True,
+    help="If --candidate_vcf not given, calling method used to find candidate sites.",
+)
+@click.option(
+    "-r",
+    "--reads",
+    type=int,
+    multiple=True,
+    required=True,
+    help="Number of reads to resample to. Can be passed multiple times, e.g. -r 10 -r 50 -r 100.",
+)
+@click.option(
+    "-i",
+    "--iterations",
+    type=int,
+    default=N_REPLICATES,
+    show_default=True,
+    help="Number of replicates for each number of reads.",
+)
+@click.option(
+    "--min_depth",
+    type=int,
+    default=MIN_DEPTH,
+    show_default=True,
+    help="Minimum depth to call an allele in a replicate.",
+)
+@click.option(
+    "--min_wsaf",
+    type=float,
+    default=MIN_WSAF,
+    show_default=True,
+    help="Minimum within-sample allele frequency to call an allele in a replicate.",
+)
+@click.option("--seed", type=int, default=None, help="Random seed.")
+def main(
+    expt_dir,
+    config,
+    barcode,
+    truth_vcf,
+    truth_sample,
+    candidate_vcf,
+    method,
+    reads,
+    iterations,
+    min_depth,
+    min_wsaf,
+    seed,
+):
+    """
+    Estimate sensitivity and precision versus read depth for a barcode,
+    by resampling reads at candidate and true variant sites, rather
+    than re-running a variant caller on downsampled .bam files
+
+    """
+
+    # PARSE INPUTS
+    script_descrip = "NOMADIC: Resample reads to estimate calling performance"
+    t0 = print_header(script_descrip)
+    params = build_parameter_dict(expt_dir, config, barcode)
+    barcode = params["focus_barcode"]
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    input_dir = f"{barcode_dir}/target-extraction"
+    output_dir = produce_dir(barcode_dir, "calling", "resample")
+    if candidate_vcf is None:
+        candidate_vcf = f"{barcode_dir}/calling/{method}/reads.all_targets.sorted.vcf.gz"
+
+    # Target amplicons
+    amplicon_df = pd.read_csv(AMPLICON_PATH, sep="\t", header=None)
+    amplicon_df.columns = ["chrom", "start", "end", "gene_name"]
+    amplicon_df.index = amplicon_df["gene_name"]
+
+    # Load sites
+    print("Loading sites...")
+    truth_df = load_vcf_sites(truth_vcf, sample_name=truth_sample)
+    sites_df = pd.concat([load_vcf_sites(candidate_vcf), truth_df])
+    sites_df = sites_df.drop_duplicates().sort_values(["chrom", "pos"])
+    print(f"  True variants: {truth_df.shape[0]}")
+    print(f"  Total sites: {sites_df.shape[0]}")
+    print("Done.")
+    print("")
+
+    # Extract alleles for each target, once
+    print("Extracting alleles...")
+    matrices = {}
+    for target_gene in params["target_names"]:
+        amplicon_info = amplicon_df.loc[target_gene].squeeze()
+        target_sites_df = sites_df.query(
+            "chrom == @amplicon_info.chrom"
+            " and pos >= @amplicon_info.start"
+            " and pos <= @amplicon_info.end"
+        )
+        if target_sites_df.shape[0] == 0:
+            continue
+        bam_path = f"{input_dir}/reads.target.{target_gene}.bam"
+        matrices[target_gene] = AlleleMatrix.from_bam(bam_path, target_sites_df)
+        print(
+            f"  {target_gene}: {matrices[target_gene].n_reads} reads,"
+            f" {target_sites_df.shape[0]} sites"
+        )
+    print("Done.")
+    print("")
+
+    # Resample
+    print("Resampling...")
+    resampler = AlleleResampler(matrices, truth_df, seed=seed)
+    replicate_df = resampler.run(
+        reads, iterations, min_depth=min_depth, min_wsaf=min_wsaf
+    )
+    summary_df = summarise_curves(replicate_df)
+    replicate_df.to_csv(f"{output_dir}/resample.replicates.csv", index=False)
+    summary_df.to_csv(f"{output_dir}/resample.summary.csv", index=False)
+    print(summary_df)
+    print("Done.")
+    print("")
+
+    print_footer(t0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+import os
+import pysam
+import numpy as np
+import pandas as pd
+from nomadic.lib.process_beds import load_bed
+
+
+# ================================================================
+# Parameters
+#
+# ================================================================
+
+
+# Reads skipped by `samtools depth` and `samtools bedcov` by default;
+# unmapped, secondary, QC fail and duplicate
+EXCLUDE_FLAGS = 0x704
+
+# Bin size of the genome-wide coverage track
+GENOME_BIN_SIZE = 10_000
+
+
+# ================================================================
+# Compute per-base coverage from a .bam file with pysam
+#
+# ================================================================
+
+
+def sum_intervals(starts, ends, offset, length):
+    """
+    Count the number of intervals covering each of `length` positions
+    from `offset`, given their 0-based `starts` and exclusive `ends`
+
+    """
+
+    diff = np.zeros(length + 1, dtype="int64")
+    np.add.at(diff, np.clip(np.asarray(starts, dtype="int64") - offset, 0, length), 1)
+    np.add.at(diff, np.clip(np.asarray(ends, dtype="int64") - offset, 0, length), -1)
+
+    return np.cumsum(diff[:-1])
+
+
+def count_coverage(bam, chrom, start=None, end=None):
+    """
+    Count the reads of an opened `bam` file with an aligned base, and with
+    a deletion or reference skip, at each position of a region
+
+    returns
+        aligned: ndarray, int, shape (n_positions, )
+            As `samtools depth`.
+        deleted: ndarray, int, shape (n_positions, )
+            Added to `aligned`, as `samtools bedcov`.
+        n_reads: int
+            Number of reads overlapping the region.
+
+    """
+
+    if start is None:
+        start, end = 0, bam.get_reference_length(chrom)
+
+    aligned_starts, aligned_ends = [], []
+    deleted_starts, deleted_ends = [], []
+    n_reads = 0
+    for read in bam.fetch(chrom, start, end):
+        if read.flag & EXCLUDE_FLAGS:
+            continue
+        n_reads += 1
+
+        # Gaps between aligned blocks are deletions or reference skips
+        blocks = read.get_blocks()
+        for block_start, block_end in blocks:
+            aligned_starts.append(block_start)
+            aligned_ends.append(block_end)
+        for (_, gap_start), (gap_end, _) in zip(blocks[:-1], blocks[1:]):
+            if gap_end > gap_start:
+                deleted_starts.append(gap_start)
+                deleted_ends.append(gap_end)
+
+    aligned = sum_intervals(aligned_starts, aligned_ends, start, end - start)
+    deleted = sum_intervals(deleted_starts, deleted_ends, start, end - start)
+
+    return aligned, deleted, n_reads
+
+
+# ================================================================
+# Cache of per-base coverage over a set of regions
+#
+# ================================================================
+
+
+class CoverageCache:
+    """
+    Per-base coverage of a .bam file over the regions of a .bed file,
+    computed once with pysam and cached next to the .bam file as a
+    compressed .npz, from which coverage summaries are computed as
+    array reductions
+
+    The cache is keyed on the .bed file name, and rebuilt if the
+    .bam file is modified or the regions change.
+
+    """
+
+    def __init__(self, bam_path: str, bed_path: str):
+        self.bam_path = bam_path
+        self.bed_path = bed_path
+        bed_name = os.path.basename(bed_path).replace(".bed", "")
+        self.cache_path = f"{bam_path[:-4]}.{bed_name}.coverage.npz"
+        self.genome_cache_path = f"{bam_path[:-4]}.genome_coverage.npz"
+
+        self.regions_df = load_bed(bed_path, with_name=True)
+        self.offsets = None
+        self.aligned = None
+        self.deleted = None
+        self.n_reads = None
+
+    @classmethod
+    def from_bam(cls, bam_path: str, bed_path: str):
+        """
+        Load the coverage of `bam_path` over `bed_path` from its
+        cache, building and caching it first if necessary
+
+        """
+
+        cache = cls(bam_path, bed_path)
+        if not cache.load():
+            cache.build()
+            cache.save()
+
+        return cache
+
+    def _get_bam_key(self):
+        return np.array(
+            [os.path.getmtime(self.bam_path), os.path.getsize(self.bam_path)]
+        )
+
+    def _get_region_arrays(self):
+        """Regions as string arrays, to check the cache against"""
+
+        return {
+            column: self.regions_df[column].astype(str).to_numpy(dtype=str)
+            for column in ["chrom", "start", "end", "name"]
+        }
+
+    def build(self):
+        """Count per-base coverage of every region"""
+
+        lengths = (self.regions_df["end"] - self.regions_df["start"]).values
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.aligned = np.zeros(self.offsets[-1], dtype="int32")
+        self.deleted = np.zeros(self.offsets[-1], dtype="int32")
+        self.n_reads = np.zeros(len(lengths), dtype="int64")
+
+        with pysam.AlignmentFile(self.bam_path, "rb") as bam:
+            for i, (chrom, start, end, _) in enumerate(
+                self.regions_df.itertuples(index=False)
+            ):
+                if chrom not in bam.references:
+                    continue
+                aligned, deleted, n_reads = count_coverage(bam, chrom, start, end)
+                self.aligned[self.offsets[i] : self.offsets[i + 1]] = aligned
+                self.deleted[self.offsets[i] : self.offsets[i + 1]] = deleted
+                self.n_reads[i] = n_reads
+
+        return self
+
+    def load(self):
+        """
+        Load coverage from the cache, if it exists and is up-to-date
+
+        returns
+            _ : bool
+                Whether coverage was loaded.
+
+        """
+
+        if not os.path.exists(self.cache_path):
+            return False
+
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as npz:
+                cached = {key: npz[key] for key in npz.files}
+        except Exception:
+            return False
+
+        regions = self._get_region_arrays()
+        is_current = np.array_equal(cached["bam_key"], self._get_bam_key()) and all(
+            np.array_equal(cached[column], values) for column, values in regions.items()
+        )
+        if not is_current:
+            return False
+
+        self.offsets = cached["offsets"]
+        self.aligned = cached["aligned"]
+        self.deleted = cached["deleted"]
+        self.n_reads = cached["n_reads"]
+
+        return True
+
+    def save(self):
+        """Save coverage to the cache"""
+
+        try:
+            np.savez_compressed(
+                self.cache_path,
+                bam_key=self._get_bam_key(),
+                offsets=self.offsets,
+                aligned=self.aligned,
+                deleted=self.deleted,
+                n_reads=self.n_reads,
+                **self._get_region_arrays(),
+            )
+        except OSError:
+            pass
+
+    def get_depth(self, i: int, include_deletions: bool = False) -> np.ndarray:
+        """Get the per-base depth of the `i`th region"""
+
+        depth = self.aligned[self.offsets[i] : self.offsets[i + 1]]
+        if include_deletions:
+            depth = depth + self.deleted[self.offsets[i] : self.offsets[i + 1]]
+
+        return depth
+
+    def summarise_bedcov(self, cov_threshold: int = 100) -> pd.DataFrame:
+        """
+        Summarise coverage of each region, as `samtools_bedcov()`; depths
+        include deletions, as in `samtools bedcov`
+
+        """
+
+        depth = self.aligned.astype("int64") + self.deleted
+        starts = self.offsets[:-1]
+        lengths = np.diff(self.offsets)
+
+        # Sums over each region; `reduceat` needs non-empty regions
+        def sum_regions(values):
+            sums = np.zeros(len(lengths), dtype="int64")
+            is_nonempty = lengths > 0
+            if is_nonempty.any():
+                sums[is_nonempty] = np.add.reduceat(values, starts[is_nonempty])
+            return sums
+
+        breadth_col = f"breadth_{cov_threshold}X"
+        df = self.regions_df.copy()
+        df.insert(3, "length_bp", lengths)
+        df["mean_cov"] = sum_regions(depth) / lengths
+        df["total_cov"] = sum_regions(depth)
+        df[f"{breadth_col}_per"] = 100 * sum_regions(depth >= cov_threshold) / lengths
+        df[f"{breadth_col}_bp"] = sum_regions(depth >= cov_threshold)
+        df["n_reads"] = self.n_reads
+
+        return df
+
+    def get_depth_df(self) -> pd.DataFrame:
+        """
+        Get the depth at every position of the regions, as `samtools
+        depth -aa -b`; positions are 1-based, and depths exclude deletions
+
+        """
+
+        chroms = np.repeat(self.regions_df["chrom"].values, np.diff(self.offsets))
+        positions = np.concatenate(
+            [
+                np.arange(start + 1, end + 1)
+                for start, end in self.regions_df[["start", "end"]].values
+            ]
+            or [np.array([], dtype="int64")]
+        )
+        depth_df = pd.DataFrame(
+            {"chrom": chroms, "start": positions, "depth": self.aligned}
+        )
+
+        # Each position once, in .bam order
+        with pysam.AlignmentFile(self.bam_path, "rb") as bam:
+            chrom_order = {chrom: i for i, chrom in enumerate(bam.references)}
+        depth_df.drop_duplicates(["chrom", "start"], inplace=True)
+        depth_df["order"] = depth_df["chrom"].map(chrom_order)
+        depth_df.sort_values(["order", "start"], inplace=True)
+
+        return depth_df.drop(columns="order").reset_index(drop=True)
+
+    def get_genome_track(self, bin_size: int = GENOME_BIN_SIZE) -> pd.DataFrame:
+        """
+        Get the mean depth, excluding deletions, in bins of `bin_size`
+        across every chromosome; cached separately from the regions
+
+        """
+
+        if os.path.exists(self.genome_cache_path):
+            with np.load(self.genome_cache_path, allow_pickle=False) as npz:
+                if np.array_equal(npz["bam_key"], self._get_bam_key()) and int(
+                    npz["bin_size"]
+                ) == bin_size:
+                    return pd.DataFrame(
+                        {
+                            "chrom": npz["chrom"],
+                            "start": npz["start"],
+                            "end": npz["end"],
+                            "mean_depth": npz["mean_depth"],
+                        }
+                    )
+
+        dfs = []
+        with pysam.AlignmentFile(self.bam_path, "rb") as bam:
+            for chrom, length in zip(bam.references, bam.lengths):
+                aligned, _, _ = count_coverage(bam, chrom)
+                bin_starts = np.arange(0, length, bin_size)
+                bin_ends = np.minimum(bin_starts + bin_size, length)
+                dfs.append(
+                    pd.DataFrame(
+                        {
+                            "chrom": chrom,
+                            "start": bin_starts,
+                            "end": bin_ends,
+                            "mean_depth": np.add.reduceat(aligned, bin_starts)
+                            / (bin_ends - bin_starts),
+                        }
+                    )
+                )
+        track_df = pd.concat(dfs, ignore_index=True)
+
+        try:
+            np.savez_compressed(
+                self.genome_cache_path,
+                bam_key=self._get_bam_key(),
+                bin_size=bin_size,
+                chrom=track_df["chrom"].to_numpy(dtype=str),
+                start=track_df["start"].values,
+                end=track_df["end"].values,
+                mean_depth=track_df["mean_depth"].values,
+            )
+        except OSError:
+            pass
+
+        return track_df
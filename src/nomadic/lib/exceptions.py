@@ -1,3 +1,8 @@
 class MetadataError(Exception):
     """ Metadata file contains an error """
-    pass
\ No newline at end of file
+    pass
+
+
+class BarcodeError(Exception):
+    """ Processing failed for one or more barcodes """
+    pass
@@ -96,4 +96,13 @@ def default(obj):
             return obj.tolist()
         else:
             return obj.item()
-    raise TypeError('Unknown type:', type(obj))
\ No newline at end of file
+    raise TypeError('Unknown type:', type(obj))
+
+def get_file_signature(file_path):
+    """
+    Modification time and size of a file, used to
+    invalidate caches built from it
+
+    """
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+
+# ================================================================
+# Index genomic intervals for position queries
+#
+# ================================================================
+
+
+class IntervalIndex:
+    """
+    Index a set of genomic intervals, such as the features of a .gff
+    or the regions of a .bed, to find the intervals containing
+    a batch of (chromosome, position) queries
+
+    Intervals are stored as 1-based, closed coordinates (as in .gff
+    files). For each chromosome, intervals are sorted by start and the
+    running maximum of their ends is kept, so that the candidate
+    intervals for any position are found with two binary searches.
+
+    """
+
+    def __init__(self, chroms, starts, ends):
+        """
+        params
+            chroms : array-like, str, shape (n_intervals, )
+            starts : array-like, int, shape (n_intervals, )
+                1-based start position of each interval, inclusive.
+            ends : array-like, int, shape (n_intervals, )
+                1-based end position of each interval, inclusive.
+
+        """
+
+        chroms = np.asarray(chroms, dtype=object)
+        starts = np.asarray(starts, dtype="int64")
+        ends = np.asarray(ends, dtype="int64")
+
+        self.n_intervals = len(starts)
+        self.chroms = {}
+        for chrom in pd.unique(chroms):
+            ixs = np.flatnonzero(chroms == chrom)
+            ixs = ixs[np.argsort(starts[ixs], kind="stable")]
+            self.chroms[chrom] = {
+                "ixs": ixs,
+                "starts": starts[ixs],
+                "ends": ends[ixs],
+                "max_ends": np.maximum.accumulate(ends[ixs]),
+            }
+
+    @classmethod
+    def from_dataframe(
+        cls, df, chrom_col="seqid", start_col="start", end_col="end", zero_based=False
+    ):
+        """
+        Build from the rows of a data frame `df`, e.g. a .gff loaded with
+        `load_gff()`; set `zero_based` for 0-based, half-open intervals,
+        e.g. from a .bed
+
+        Query results index rows of `df` by position.
+
+        """
+
+        starts = df[start_col].values.astype("int64")
+        if zero_based:
+            starts = starts + 1
+
+        return cls(df[chrom_col].values, starts, df[end_col].values)
+
+    @classmethod
+    def from_bed(cls, bed_path):
+        """Build from the regions of a .bed file"""
+
+        bed_df = pd.read_csv(
+            bed_path, sep="\t", header=None, usecols=[0, 1, 2], comment="#"
+        )
+
+        return cls.from_dataframe(bed_df, 0, 1, 2, zero_based=True)
+
+    def query(self, chroms, positions):
+        """
+        Find all intervals containing each of a set of 1-based `positions`,
+        on chromosomes `chroms`
+
+        returns
+            query_ixs : ndarray, int, shape (n_hits, )
+                Index of the query for each hit.
+            interval_ixs : ndarray, int, shape (n_hits, )
+                Index of the interval, in input order, for each hit.
+
+        """
+
+        chroms = np.asarray(chroms, dtype=object)
+        positions = np.asarray(positions, dtype="int64")
+
+        query_ixs = []
+        interval_ixs = []
+        for chrom in pd.unique(chroms):
+            if chrom not in self.chroms:
+                continue
+            intervals = self.chroms[chrom]
+            qixs = np.flatnonzero(chroms == chrom)
+            pos = positions[qixs]
+
+            # Candidates: start <= pos, and not followed only by ends < pos
+            lo = np.searchsorted(intervals["max_ends"], pos, side="left")
+            hi = np.searchsorted(intervals["starts"], pos, side="right")
+            n_candidates = np.maximum(hi - lo, 0)
+
+            # Expand to one row per (query, candidate)
+            qrep = np.repeat(np.arange(len(qixs)), n_candidates)
+            offsets = np.arange(n_candidates.sum()) - np.repeat(
+                np.cumsum(n_candidates) - n_candidates, n_candidates
+            )
+            cixs = lo[qrep] + offsets
+            keep = intervals["ends"][cixs] >= pos[qrep]
+
+            query_ixs.append(qixs[qrep[keep]])
+            interval_ixs.append(intervals["ixs"][cixs[keep]])
+
+        if not query_ixs:
+            return np.array([], "int64"), np.array([], "int64")
+
+        query_ixs = np.concatenate(query_ixs)
+        interval_ixs = np.concatenate(interval_ixs)
+        order = np.lexsort((interval_ixs, query_ixs))
+
+        return query_ixs[order], interval_ixs[order]
+
+    def count(self, chroms, positions):
+        """Count the intervals containing each query"""
+
+        query_ixs, _ = self.query(chroms, positions)
+
+        return np.bincount(query_ixs, minlength=len(positions))
+
+    def find_first(self, chroms, positions):
+        """
+        Find the first interval, in input order, containing each query,
+        or -1 if there is none
+
+        """
+
+        query_ixs, interval_ixs = self.query(chroms, positions)
+        first = np.full(len(positions), -1, "int64")
+        if len(query_ixs) == 0:
+            return first
+        is_first = np.r_[True, query_ixs[1:] != query_ixs[:-1]]
+        first[query_ixs[is_first]] = interval_ixs[is_first]
+
+        return first
@@ -0,0 +1,159 @@
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List
+from nomadic.lib.exceptions import BarcodeError
+
+
+# ================================================================
+# Capture the output of a single barcode
+#
+# ================================================================
+
+
+@contextmanager
+def capture_output(log_path):
+    """
+    Redirect stdout and stderr to `log_path` at the level of file
+    descriptors, such that the output of subprocesses (e.g. `samtools`,
+    `minimap2`) is captured along with that of Python
+
+    """
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    try:
+        with open(log_path, "w") as log:
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+            try:
+                yield log_path
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+    finally:
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds:
+            os.close(fd)
+
+
+def print_barcode_banner(barcode):
+    print("." * 80)
+    print(f"Barcode: {barcode}")
+    print("." * 80)
+
+
+def run_barcode(func, barcode, args, log_path=None):
+    """
+    Run `func(barcode, *args)`, catching any exception, and capturing
+    output to `log_path` if given
+
+    returns
+        result: any
+            Returned by `func`, or None if it failed.
+        error: str
+            Traceback of the exception raised by `func`, or None.
+
+    """
+
+    def _run():
+        try:
+            return func(barcode, *args), None
+        except Exception:
+            error = traceback.format_exc()
+            print(error, file=sys.stderr)
+            return None, error
+
+    if log_path is None:
+        return _run()
+
+    with capture_output(log_path):
+        print_barcode_banner(barcode)
+        return _run()
+
+
+# ================================================================
+# Run barcodes concurrently
+#
+# ================================================================
+
+
+def run_barcodes(
+    func: Callable, barcodes: List[str], args: tuple = (), jobs: int = 1, log_dir: str = None
+) -> list:
+    """
+    Run `func(barcode, *args)` for every barcode, with at most `jobs`
+    running at once in separate processes, and return results in
+    the order of `barcodes`
+
+    A failing barcode does not stop the others; failures are reported
+    once all barcodes have finished, and a `BarcodeError` is raised.
+
+    When run in parallel, the output of each barcode, including that of
+    subprocesses, is written to `{log_dir}/{barcode}.log` and printed
+    in order of `barcodes` as each completes. `func` and `args` must
+    then be picklable, i.e. `func` defined at the top level of a module.
+
+    params
+        func: Callable
+            Function processing a single barcode, taking it
+            as its first argument.
+        barcodes: list of str
+            Barcodes to process.
+        args: tuple
+            Additional arguments passed to `func`.
+        jobs: int
+            Maximum number of barcodes to process at once.
+        log_dir: str
+            Directory for the log of each barcode, when run in parallel.
+    returns
+        results: list
+            Returned by `func` for each barcode.
+
+    """
+
+    results = []
+    errors = {}
+    if jobs <= 1 or len(barcodes) <= 1:
+        for barcode in barcodes:
+            print_barcode_banner(barcode)
+            result, error = run_barcode(func, barcode, args)
+            results.append(result)
+            if error is not None:
+                errors[barcode] = error
+    else:
+        if log_dir is None:
+            raise ValueError("A `log_dir` is required to run barcodes in parallel.")
+        os.makedirs(log_dir, exist_ok=True)
+        log_paths = [f"{log_dir}/{barcode}.log" for barcode in barcodes]
+
+        print(f"Processing {len(barcodes)} barcodes, {jobs} at a time...")
+        print(f"  Logs written to: {log_dir}")
+        sys.stdout.flush()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(run_barcode, func, barcode, args, log_path)
+                for barcode, log_path in zip(barcodes, log_paths)
+            ]
+            for barcode, log_path, future in zip(barcodes, log_paths, futures):
+                result, error = future.result()
+                with open(log_path, "r") as log:
+                    print(log.read(), end="")
+                sys.stdout.flush()
+                results.append(result)
+                if error is not None:
+                    errors[barcode] = error
+
+    if errors:
+        print("=" * 80)
+        print(f"Failed for {len(errors)} of {len(barcodes)} barcodes:")
+        for barcode, error in errors.items():
+            print(f"  {barcode}: {error.strip().splitlines()[-1]}")
+        print("=" * 80)
+        raise BarcodeError(f"Failed for barcodes: {', '.join(errors)}")
+
+    return results
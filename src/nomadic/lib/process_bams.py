@@ -9,6 +9,7 @@ import os
 import re
 import uuid
 import subprocess
+import pysam
 import pandas as pd
 import numpy as np
 
@@ -330,10 +331,8 @@ def extract_bam_MAPQ(input_bam):
     
     """
     
-    cmd = "samtools view %s | cut -f 5" % input_bam
-    result = subprocess.run(cmd, shell=True, capture_output=True)
-    stdout = result.stdout.decode("utf-8")
-    mapqs = np.array(stdout.split(), "int8")
+    mapqs = extract_bam_fields(input_bam, fields=["mapq"], as_dict=True)["mapq"]
+    mapqs = mapqs.astype("int8")
     
     return mapqs
 
@@ -359,10 +358,8 @@ def extract_bam_FLAG(input_bam):
     
     """
     
-    cmd = "samtools view %s | cut -f 2" % input_bam
-    result = subprocess.run(cmd, shell=True, capture_output=True)
-    stdout = result.stdout.decode("utf-8")
-    flags = np.array(stdout.split(), "int16")
+    flags = extract_bam_fields(input_bam, fields=["flag"], as_dict=True)["flag"]
+    flags = flags.astype("int16")
     
     return flags
 
@@ -495,6 +492,242 @@ def summarise_bam_stats(input_file, view_args=None):
 
 
 
+# ================================================================================ #
+# Functions computing statistics in a single pass over a bam file with pysam
+#
+# ================================================================================ #
+
+
+# Number of possible values of the FLAG and MAPQ fields
+N_FLAGS = 2**12
+N_MAPQS = 2**8
+
+# Statistics defined by the FLAG bits that must be set (as with `samtools view -f`)
+# and the bits that must not be set (as with `samtools view -F`)
+MAPPING_STATISTIC_FLAGS = {
+    "Alignments": (0x000, 0x000),
+    "Reads": (0x000, 0x900),  # Do not count secondary or supplementary
+    "Mapped": (0x000, 0x904),
+    "Unmapped": (0x004, 0x000),
+    "Multi-mapped": (0x100, 0x000),
+    "Chimera-mapped": (0x800, 0x000),
+}
+
+
+def get_flag_and_mapq_histograms(bam, chunk_size=2**16):
+    """
+    Compute histograms of the FLAG and MAPQ fields for every
+    record in a `bam` file, reading the file only once
+
+    FLAG and MAPQ values are buffered into fixed-size arrays
+    and counted a chunk at a time with `np.bincount`, so memory
+    use does not grow with the number of records.
+
+    params
+        bam : str
+            Path to target bam file.
+        chunk_size : int
+            Number of records to buffer before counting.
+
+    returns
+        flag_hist : ndarray, int64, shape (N_FLAGS, )
+            Number of records carrying each FLAG value.
+        mapq_hist : ndarray, int64, shape (N_MAPQS, )
+            Number of records carrying each MAPQ value.
+
+    """
+
+    flag_hist = np.zeros(N_FLAGS, "int64")
+    mapq_hist = np.zeros(N_MAPQS, "int64")
+
+    flags = np.zeros(chunk_size, "int64")
+    mapqs = np.zeros(chunk_size, "int64")
+
+    def count_chunk(n):
+        flag_hist[:] += np.bincount(flags[:n], minlength=N_FLAGS)
+        mapq_hist[:] += np.bincount(mapqs[:n], minlength=N_MAPQS)
+
+    # Iterate over *all* records, including unmapped records without coordinates
+    ix = 0
+    with pysam.AlignmentFile(bam, "rb") as bam_file:
+        for segment in bam_file.fetch(until_eof=True):
+            flags[ix] = segment.flag
+            mapqs[ix] = segment.mapping_quality
+            ix += 1
+            if ix == chunk_size:
+                count_chunk(ix)
+                ix = 0
+    count_chunk(ix)
+
+    return flag_hist, mapq_hist
+
+
+def count_flag_histogram(flag_hist, require=0x000, exclude=0x000):
+    """
+    Count the records in a FLAG histogram that have all of the bits in
+    `require` set and none of the bits in `exclude` set
+
+    This is equivalent to `samtools view -c -f <require> -F <exclude>`.
+
+    params
+        flag_hist : ndarray, int, shape (N_FLAGS, )
+            FLAG histogram, as returned by `get_flag_and_mapq_histograms`.
+        require : int
+            Bits that must be set.
+        exclude : int
+            Bits that must not be set.
+
+    returns
+        _ : int
+            Number of records passing the filter.
+
+    """
+
+    flag_values = np.arange(flag_hist.shape[0])
+    keep = ((flag_values & require) == require) & ((flag_values & exclude) == 0)
+
+    return int(flag_hist[keep].sum())
+
+
+def summarise_flag_histogram(flag_hist):
+    """
+    Compute the mapping statistics defined in `MAPPING_STATISTIC_FLAGS`
+    from a FLAG histogram
+
+    params
+        flag_hist : ndarray, int, shape (N_FLAGS, )
+            FLAG histogram, as returned by `get_flag_and_mapq_histograms`.
+
+    returns
+        stat_dt : dict
+            Dictionary mapping the name of each statistic to its count.
+
+    """
+
+    return {
+        stat: count_flag_histogram(flag_hist, require, exclude)
+        for stat, (require, exclude) in MAPPING_STATISTIC_FLAGS.items()
+    }
+
+
+def _get_mean_qscore(segment):
+    """Mean base quality of an aligned segment, read from the raw quality buffer"""
+    qualities = segment.query_qualities
+    if not qualities:
+        return np.nan
+    return np.frombuffer(qualities, dtype="uint8").mean()
+
+
+def _get_per_gc(segment):
+    """GC percentage of the query sequence of an aligned segment"""
+    seq = segment.query_sequence
+    if not seq:
+        return np.nan
+    return 100 * (seq.count("G") + seq.count("C")) / len(seq)
+
+
+# Fields that can be extracted by `extract_bam_fields`, with their
+# data type, the value used when it is missing, and how to get them
+BAM_FIELDS = {
+    "flag": ("uint16", 0, lambda s: s.flag),
+    "mapq": ("uint8", 0, lambda s: s.mapping_quality),
+    "ref_id": ("int32", -1, lambda s: s.reference_id),
+    "start": ("int64", -1, lambda s: s.reference_start),
+    "end": ("int64", -1, lambda s: s.reference_end),
+    "query_length": ("int32", 0, lambda s: s.query_length),
+    "aligned_length": ("int32", 0, lambda s: s.query_alignment_length),
+    "mean_qscore": ("float32", np.nan, _get_mean_qscore),
+    "per_gc": ("float32", np.nan, _get_per_gc),
+}
+
+
+def extract_bam_fields(
+    input_bam, fields=None, region=None, as_dict=False, chunk_size=2**16
+):
+    """
+    Extract a set of `fields` for every record in an `input_bam`,
+    reading the file only once
+
+    Values are written into preallocated NumPy arrays, which grow
+    by `chunk_size` records as needed; no SAM text is produced.
+    If the .bam is indexed, its record count is used to size the
+    arrays up-front.
+
+    params
+        input_bam : str
+            Path to target bam file.
+        fields : list of str [optional]
+            Fields to extract, from the keys of `BAM_FIELDS`. By
+            default, all fields are extracted.
+        region : str [optional]
+            Only extract records overlapping this region, e.g.
+            'Pf3D7_07_v3:403000-405000'. Requires an index.
+        as_dict : bool
+            Return a dictionary of arrays, rather than a
+            structured array.
+        chunk_size : int
+            Number of records by which arrays are grown.
+
+    returns
+        _ : ndarray, structured, shape (n, ) or dict of ndarray
+            Extracted fields for each of the `n` records.
+
+    """
+
+    if fields is None:
+        fields = list(BAM_FIELDS)
+    for field in fields:
+        if field not in BAM_FIELDS:
+            raise ValueError(
+                f"Unknown field '{field}'. Choose from: {', '.join(BAM_FIELDS)}."
+            )
+
+    with pysam.AlignmentFile(input_bam, "rb") as bam:
+
+        # Size arrays from the index, if it exists
+        capacity = chunk_size
+        if region is None and bam.has_index():
+            capacity = max(bam.mapped + bam.unmapped, 1)
+
+        arrays = {
+            field: np.full(capacity, BAM_FIELDS[field][1], BAM_FIELDS[field][0])
+            for field in fields
+        }
+
+        def prepare_getters():
+            return [(arrays[field],) + BAM_FIELDS[field][1:] for field in fields]
+
+        getters = prepare_getters()
+
+        if region is None:
+            segments = bam.fetch(until_eof=True)
+        else:
+            segments = bam.fetch(region=region)
+
+        n = 0
+        for segment in segments:
+            if n == capacity:
+                capacity += chunk_size
+                for field in fields:
+                    arrays[field] = np.resize(arrays[field], capacity)
+                getters = prepare_getters()
+            for array, missing, getter in getters:
+                value = getter(segment)
+                array[n] = missing if value is None else value
+            n += 1
+
+    arrays = {field: array[:n] for field, array in arrays.items()}
+
+    if as_dict:
+        return arrays
+
+    records = np.zeros(n, dtype=[(field, BAM_FIELDS[field][0]) for field in fields])
+    for field, array in arrays.items():
+        records[field] = array
+
+    return records
+
+
 # ================================================================================ #
 # Functions running samtools utilities and doing some processing
 #
@@ -503,10 +736,10 @@ def summarise_bam_stats(input_file, view_args=None):
 
 
 
-def get_mapping_statistics(bam, verbose=True):
+def get_mapping_statistics(bam, verbose=True, barcode=None):
     """
     Get mapping statistics for a given `bam` file
-    using samtools
+    in a single pass with pysam
     
     Statistics are computed using the bit-wise flag (second
     field in a SAM record). Relevant bits are include...
@@ -545,11 +778,19 @@ def get_mapping_statistics(bam, verbose=True):
     have a *supplementary* flag set.
 
     
+    The counts match running `samtools view -c` with the
+    flags in `MAPPING_STATISTIC_FLAGS`, but the .bam is only
+    decompressed once. Use `get_flag_and_mapq_histograms` directly
+    if the FLAG or MAPQ histograms are also needed.
+
     params
         bam : str
             Path to target bam file.
         verbose : bool
             Print the mapping statistics to screen.
+        barcode : str [optional]
+            If given, stored under "Barcode", such that a list of
+            results can be passed to `combine_mapping_statistics`.
     returns
         stat_dt : dict
             A dictionary containing information on
@@ -557,21 +798,8 @@ def get_mapping_statistics(bam, verbose=True):
     
     """
     
-    samtools = "samtools view -c"  # return number of records
-    
-    flag_dt = {
-        "Alignments": "",
-        "Reads": "-F 0x900",  # Do not count supplementary
-        "Mapped": "-F 0x904",
-        "Unmapped": "-f 0x004",
-        "Multi-mapped": "-f 0x100",
-        "Chimera-mapped": "-f 0x800"
-    }
-    
-    stat_dt = {}
-    for stat, flag in flag_dt.items():
-        result = subprocess.check_output(" ".join([samtools, flag, bam]), shell=True)
-        stat_dt[stat] = int(result)
+    flag_hist, _ = get_flag_and_mapq_histograms(bam)
+    stat_dt = summarise_flag_histogram(flag_hist)
         
     if verbose:
         print("Mapping Statistics")
@@ -579,6 +807,9 @@ def get_mapping_statistics(bam, verbose=True):
         n_reads = stat_dt["Reads"]
         for stat, value in stat_dt.items():
             print("  %s: %d (%.02f%%)" % (stat, value, 100*value/n_reads))
+
+    if barcode is not None:
+        stat_dt["Barcode"] = barcode
         
     return stat_dt
 
@@ -591,14 +822,12 @@ def combine_mapping_statistics(mapping_statistics, rescale=10**3):
     
     df = pd.DataFrame(mapping_statistics)
     
-    df = df[["Barcode", "Alignments", "Reads", 
-             "Mapped", "Unmapped",
-             "Multi-mapped", "Chimera-mapped"]]
+    df = df[["Barcode"] + list(MAPPING_STATISTIC_FLAGS)]
     
     df.sort_values("Barcode", inplace=True)
     df.reset_index(drop=True, inplace=True)
     df.index = df["Barcode"]
-    df.drop("Barcode", 1, inplace=True)
+    df.drop("Barcode", axis=1, inplace=True)
     df = df / rescale
     
     return df
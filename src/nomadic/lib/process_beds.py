@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+BED_COLUMNS = ["chrom", "start", "end"]
+
+
+def load_bed(bed_path, with_name=False):
+    """
+    Load the first three columns of a .bed file, and the
+    fourth `name` column if `with_name`
+
+    """
+
+    columns = BED_COLUMNS + ["name"] if with_name else BED_COLUMNS
+
+    return pd.read_csv(
+        bed_path,
+        sep="\t",
+        header=None,
+        usecols=list(range(len(columns))),
+        names=columns,
+        comment="#",
+    )
+
+
+def write_bed(bed_df, output_bed):
+    """
+    Write the `chrom`, `start` and `end` columns of `bed_df`
+    to a .bed file at `output_bed`
+
+    """
+
+    bed_df[BED_COLUMNS].to_csv(output_bed, sep="\t", header=False, index=False)
+
+
+def merge_bed_intervals(bed_df, padding=0):
+    """
+    Pad every interval of `bed_df` by `padding` on either side
+    and merge those that then overlap or abut
+
+    params
+        bed_df: DataFrame
+            With columns `chrom`, `start` and `end`.
+        padding: int
+            Number of bases to add to either side of each interval;
+            starts are not padded below zero.
+    returns
+        merged_df: DataFrame
+            Merged intervals, sorted by chromosome and start.
+
+    """
+
+    df = bed_df[BED_COLUMNS].copy()
+    df["start"] = np.maximum(df["start"] - padding, 0)
+    df["end"] = df["end"] + padding
+    df.sort_values(["chrom", "start"], inplace=True)
+
+    # A new interval begins when the chromosome changes, or the start
+    # lies beyond all preceding ends on the chromosome
+    max_ends = df.groupby("chrom", sort=False)["end"].cummax()
+    previous_max_ends = max_ends.groupby(df["chrom"], sort=False).shift()
+    is_first = previous_max_ends.isna() | (df["start"] > previous_max_ends)
+    group = is_first.cumsum()
+
+    merged_df = (
+        df.groupby(group)
+        .agg(chrom=("chrom", "first"), start=("start", "min"), end=("end", "max"))
+        .reset_index(drop=True)
+    )
+
+    return merged_df
+
+
+def write_padded_bed(bed_path, output_bed, padding=0):
+    """
+    Write a .bed file to `output_bed` with the intervals of
+    `bed_path` padded by `padding` and merged
+
+    """
+
+    merged_df = merge_bed_intervals(load_bed(bed_path), padding=padding)
+    write_bed(merged_df, output_bed)
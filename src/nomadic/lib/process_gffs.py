@@ -1,5 +1,8 @@
+import os
+import csv
+import pickle
 import pandas as pd
-from dataclasses import dataclass
+from nomadic.lib.generic import get_file_signature
 
 
 # ================================================================
@@ -8,67 +11,154 @@ from dataclasses import dataclass
 # ================================================================
 
 
-def load_gff(gff_path):
+GFF_COLUMNS = [
+    "seqid",
+    "source",
+    "feature",
+    "start",
+    "end",
+    "score",
+    "strand",
+    "phase",
+    "attributes",
+]
+
+
+def _get_gff_cache_path(gff_path):
+    """Path of the cached, parsed version of a `gff_path`"""
+    return f"{gff_path}.cache.pkl"
+
+
+def _parse_gff(gff_path):
+    """
+    Parse a Gene Feature Format file into a pandas data frame,
+    with all columns as strings except `start` and `end`
+
+    """
+
+    gff = pd.read_csv(
+        gff_path,
+        sep="\t",
+        header=None,
+        names=GFF_COLUMNS,
+        dtype=str,
+        quoting=csv.QUOTE_NONE,
+        na_filter=False,
+    )
+
+    # Drop header and comment lines
+    gff = gff[~gff["seqid"].str.startswith("#")].reset_index(drop=True)
+
+    # Enforce data types
+    gff["start"] = gff["start"].astype("int")
+    gff["end"] = gff["end"].astype("int")
+    gff["attributes"] = gff["attributes"].str.strip()
+
+    return gff
+
+
+def load_gff(gff_path, use_cache=True):
     """
     Load a Gene Feature Format file from a `gff_path` into
     a pandas data frame
 
+    The parsed data frame is cached next to the .gff file, and the
+    cache is reused as long as the modification time and size of the
+    .gff are unchanged.
+
     param:
         gff_path : str
             Path to .gff file.
+        use_cache : bool
+            Read and write the cached data frame.
     returns:
         _ : Pandas DataFrame
         A .gff file loaded as a pandas dataframe.
         
     """
 
-    # Define an entry in the gff
-    @dataclass
-    class gffEntry:
-        seqid: str
-        source: str
-        feature: str
-        start: int
-        end: int
-        score: str
-        strand: str
-        phase: str
-        attributes: str
-
-    # Iterate over rows in gff, load entries
-    with open(gff_path, "r") as gff:
-        entries = []
-        for record in gff:
-            if record.startswith("#"):
-                continue
-            fields = record.strip().split("\t")
-            entry = gffEntry(*fields)
-            entries.append(entry)
-    
-    # Enforce data types
-    gff = pd.DataFrame(entries)
-    gff["start"] = gff["start"].astype("int")
-    gff["end"] = gff["end"].astype("int")
+    if not use_cache:
+        return _parse_gff(gff_path)
+
+    cache_path = _get_gff_cache_path(gff_path)
+    signature = get_file_signature(gff_path)
+
+    # Try to load from the cache; any failure falls back to parsing
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as cache:
+                cached = pickle.load(cache)
+            if cached["signature"] == signature:
+                return cached["gff"].copy()
+        except Exception:
+            pass
+
+    gff = _parse_gff(gff_path)
+
+    # The cache is an optimisation; e.g. read-only directories are fine
+    try:
+        with open(cache_path, "wb") as cache:
+            pickle.dump({"signature": signature, "gff": gff}, cache)
+    except OSError:
+        pass
 
     return gff
 
 
+def extract_gff_attributes(gff_df, fields):
+    """
+    Extract multiple attributes from a gff loaded as a data frame,
+    parsing the attribute strings only once
+
+    Missing attributes are returned as None; if an attribute is
+    repeated, its first value is kept.
+
+    returns
+        _ : Pandas DataFrame
+            With one column per field, and the index of `gff_df`.
+
+    """
+
+    if gff_df.shape[0] == 0:
+        return pd.DataFrame(index=gff_df.index, columns=fields, dtype=object)
+
+    # Split into one (key, value) pair per row, by position in `gff_df`
+    pairs = (
+        gff_df["attributes"]
+        .reset_index(drop=True)
+        .str.split(";")
+        .explode()
+        .str.partition("=")
+    )
+    pairs.columns = ["key", "sep", "value"]
+    pairs = pairs[(pairs["sep"] == "=") & pairs["key"].isin(fields)]
+    pairs = pairs.rename_axis("row").reset_index()
+    pairs = pairs.drop_duplicates(subset=["row", "key"], keep="first")
+
+    attributes = (
+        pairs.pivot(index="row", columns="key", values="value")
+        .reindex(index=range(gff_df.shape[0]), columns=fields)
+        .astype(object)
+    )
+    attributes.index = gff_df.index
+    attributes = attributes.where(attributes.notna(), None)
+    attributes.index.name = None
+    attributes.columns.name = None
+
+    return attributes
+
+
 def extract_gff_attribute(gff_df, extract):
     """Extract attributes from a gff loaded as a data frame"""
 
-    results = []
-    for _, row in gff_df.iterrows():
-        fields = [r.split("=") for r in row["attributes"].split(";")]
-        result = [val for key, val in fields if key == extract]
-        results.append(result[0] if result else None)
-
-    return results
+    return extract_gff_attributes(gff_df, fields=[extract])[extract].tolist()
 
 
 def add_gff_fields(gff_df, fields=["ID", "Name", "Parent"]):
-    
+
+    attributes = extract_gff_attributes(gff_df, fields=fields)
     for field in fields:
-        gff_df[field] = extract_gff_attribute(gff_df, extract=field)
+        gff_df[field] = attributes[field].tolist()
     
     return gff_df
 
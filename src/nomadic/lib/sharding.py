@@ -0,0 +1,148 @@
+import subprocess
+import numpy as np
+import pysam
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+# ================================================================
+# Balance work across shards
+#
+# ================================================================
+
+
+def count_region_reads(bam_path, bed_df):
+    """
+    Count reads overlapping each region of `bed_df` in an indexed
+    `bam_path`
+
+    The index is used to seek to each region, but every record within
+    it is still read and decoded, so this costs a pass over the reads
+    of the regions; it is small next to calling variants over them.
+
+    """
+
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        return np.array(
+            [
+                bam.count(chrom, start, end) if chrom in bam.references else 0
+                for chrom, start, end in bed_df[["chrom", "start", "end"]].itertuples(
+                    index=False
+                )
+            ],
+            dtype="int64",
+        )
+
+
+def count_mapped_reads(bam_path):
+    """
+    Count the mapped reads of an indexed `bam_path` from its index statistics
+
+    """
+
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        return sum(stat.mapped for stat in bam.get_index_statistics())
+
+
+def partition_by_weight(weights, n_shards) -> List[List[int]]:
+    """
+    Partition items, in order, into at most `n_shards` contiguous
+    groups of roughly equal total weight
+
+    Keeping groups contiguous means that if items are sorted by
+    genomic position, so are the shards, and their outputs can be
+    concatenated without sorting.
+
+    params
+        weights: array-like, shape (n_items, )
+            Weight of each item, e.g. number of reads.
+        n_shards: int
+            Maximum number of groups.
+    returns
+        shards: list of list of int
+            Indexes of the items in each non-empty group.
+
+    """
+
+    # Weigh every item at least one, such that empty regions are spread
+    weights = np.maximum(np.asarray(weights, dtype="float64"), 1)
+    n_shards = max(min(n_shards, len(weights)), 1)
+
+    # Cut where the cumulative weight is closest to each multiple of the mean
+    cumulative = np.r_[0, np.cumsum(weights)]
+    targets = cumulative[-1] * np.arange(1, n_shards) / n_shards
+    cuts = np.searchsorted(cumulative, targets)
+    is_nearer_below = targets - cumulative[cuts - 1] < cumulative[cuts] - targets
+    cuts[is_nearer_below] -= 1
+    bounds = np.unique(np.r_[0, cuts, len(weights)])
+
+    return [list(range(a, b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# ================================================================
+# Run shards concurrently
+#
+# ================================================================
+
+
+def get_threads_per_shard(n_shards, threads):
+    """
+    Get the number of threads each of `n_shards` shards can use,
+    when at most `threads` shards run at once, such that the total
+    stays within `threads`
+
+    returns
+        threads_per_shard: int
+            Or None if shards run one at a time, in which case callers
+            keep their own default.
+
+    """
+
+    n_concurrent = min(n_shards, threads)
+    if n_concurrent <= 1:
+        return None
+
+    return max(threads // n_concurrent, 1)
+
+
+def run_in_pool(func, args_list, threads=1):
+    """
+    Run `func` on each tuple of arguments in `args_list`, with at most
+    `threads` running at once, and return results in order
+
+    Work is expected to happen mostly in subprocesses (e.g. calling
+    `bcftools`), so a pool of threads bounds the number of concurrent
+    processes. Any exception raised by `func` is re-raised.
+
+    """
+
+    if threads <= 1 or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(func, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+
+def concat_shard_vcfs(shard_vcfs, output_vcf):
+    """
+    Concatenate compressed VCFs of consecutive, non-overlapping shards
+
+    Tries `bcftools concat --naive`, which joins compressed blocks
+    without decoding; if the shards are incompatible (e.g. headers
+    differ), falls back to a standard concatenation.
+
+    """
+
+    inputs = " ".join(shard_vcfs)
+    try:
+        subprocess.run(
+            f"bcftools concat --naive -o {output_vcf} {inputs}",
+            shell=True,
+            check=True,
+            stderr=subprocess.DEVNULL,
+        )
+    except subprocess.CalledProcessError:
+        subprocess.run(
+            f"bcftools concat -Oz -o {output_vcf} {inputs}", shell=True, check=True
+        )
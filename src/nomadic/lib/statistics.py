@@ -1,5 +1,43 @@
 import numpy as np
-from collections import Counter
+
+
+# Row of each base in `get_array_encoding()`; brackets are skipped,
+# any other character is invalid
+ARRAY_ENCODING = {"A": 0, "T": 1, "C": 2, "G": 3, "[": -1, "]": -1}
+ENCODING_LOOKUP = np.full(256, -2, "int8")
+for base, row in ARRAY_ENCODING.items():
+    ENCODING_LOOKUP[ord(base)] = row
+
+
+def encode_sequence(seq):
+    """
+    Encode `seq` as an array of bytes, one per character
+
+    """
+    return np.frombuffer(str(seq).encode("ascii"), dtype="uint8")
+
+
+def get_run_lengths(seq):
+    """
+    Run-length encode the sequence `seq`
+
+    returns
+        starts: ndarray, int, shape (n_runs, )
+            Index of the first character of each run.
+        lengths: ndarray, int, shape (n_runs, )
+            Length of each run.
+
+    """
+
+    b = encode_sequence(seq)
+    if len(b) == 0:
+        return np.array([], "int64"), np.array([], "int64")
+
+    # A run starts wherever the character changes
+    starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    lengths = np.diff(np.r_[starts, len(b)])
+
+    return starts, lengths
 
 
 def get_homopolymer_runs(seq, l_max=None):
@@ -12,29 +50,16 @@ def get_homopolymer_runs(seq, l_max=None):
 
     """
 
-    # Store
-    h = np.zeros(len(seq), "int8")
-    h[:] = -1
-
-    # Initialise
-    i = 0
-    p = seq[i]
-    l = 0
-
-    # Iterate
-    for c in seq:
-        if c == p:
-            l += 1
-        else:
-            h[i : (i + l)] = l
-            i += l
-            p = c
-            l = 1
-
-    # Terminate
-    h[i : (i + l)] = l
+    # Expand the length of each run across its positions
+    _, lengths = get_run_lengths(seq)
+    encoded = lengths if l_max is None else np.minimum(lengths, l_max)
+    if len(encoded) and encoded.max() > np.iinfo("int8").max:
+        raise OverflowError(
+            f"Homopolymer of length {encoded.max()} out of bounds for int8."
+        )
+    h = np.repeat(encoded, lengths).astype("int8")
+
     if l_max is not None:
-        h[h > l_max] = l_max
         assert (h <= l_max).all(), "Error in homopolymer encoding."
     assert (h > 0).all(), "Error in homopolymer encoding."
 
@@ -45,20 +70,21 @@ def calc_sliding_percentGC(seq, window):
     """
     Calculate GC content in a sliding
     window over the sequence
-    
+
     """
-    # Preapre
-    n = len(seq)
+    # Prepare
+    b = encode_sequence(seq)
+    n = len(b)
     gc = np.zeros(n)
-    
-    # Iterate
-    for i in range(n - window + 1):
-        sub = seq[i:(i+window)]
-        cnts = Counter(sub)
-        gc[i] = cnts["G"] + cnts["C"]
-        
+
+    # Count G and C in each window from differences of a cumulative sum
+    n_windows = max(n - window + 1, 0)
+    is_gc = (b == ord("G")) | (b == ord("C"))
+    cumulative = np.r_[0, np.cumsum(is_gc)]
+    gc[:n_windows] = cumulative[window : window + n_windows] - cumulative[:n_windows]
+
     gc /= window
-        
+
     return gc
 
 
@@ -68,12 +94,13 @@ def get_array_encoding(seq):
 
     """
 
-    n = len(seq)
-    a = np.zeros((4, n))
-    dt = {"A" : 0, "T" : 1, "C" : 2, "G" : 3, "[":np.nan, "]":np.nan}
-    for i, base in enumerate(seq):
-        e = dt[base]
-        if e == e:
-            a[e, i] = 1
+    rows = ENCODING_LOOKUP[encode_sequence(seq)]
+    if (rows == -2).any():
+        raise KeyError(str(seq)[np.flatnonzero(rows == -2)[0]])
+
+    # Set one entry in each column, skipping brackets
+    a = np.zeros((4, len(rows)))
+    ixs = np.flatnonzero(rows >= 0)
+    a[rows[ixs], ixs] = 1
 
-    return a
\ No newline at end of file
+    return a
@@ -1,9 +1,10 @@
 import os
 import warnings
 import pandas as pd
-from nomadic.lib.process_bams import samtools_bedcov
+from nomadic.lib.coverage import CoverageCache
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import PlasmodiumFalciparum3D7
 
 
@@ -13,8 +14,29 @@ from nomadic.lib.references import PlasmodiumFalciparum3D7
 # ================================================================================ #
 
 
+def bedcov_barcode(barcode: str, params: dict, script_dir: str, reference, bed_path: str) -> None:
+    """
+    Compute coverage across a BED file for a single barcode
+
+    """
+
+    # Define input and output directory
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    input_dir = f"{barcode_dir}/bams"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Path to *complete* bam file
+    bam_path = f"{input_dir}/{barcode}.{reference.name}.final.sorted.bam"
+    csv_path = f"{output_dir}/{barcode}.{reference.name}.bedcov.csv"
+
+    # Compute BED coverage, from the cached per-base coverage
+    # -> Does not add any sample or barcode information natively
+    coverage = CoverageCache.from_bam(bam_path, bed_path)
+    coverage.summarise_bedcov().to_csv(csv_path, index=False)
+
+
 def bedcov_single(
-    expt_dir: str, config: str, bed_path: str, barcode: str = None
+    expt_dir: str, config: str, bed_path: str, barcode: str = None, jobs: int = 1
 ) -> None:
     """
     Compute coverage across a BED file for individual barcodes
@@ -34,21 +56,13 @@ def bedcov_single(
         params["barcodes"] = [params["focus_barcode"]]
 
     # Iterate over barcodes
-    for barcode in params["barcodes"]:
-        # Define input and output directory
-        print("-" * 80)
-        print(f"Running for: {barcode}")
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        input_dir = f"{barcode_dir}/bams"
-        output_dir = produce_dir(barcode_dir, script_dir)
-
-        # Path to *complete* bam file
-        bam_path = f"{input_dir}/{barcode}.{reference.name}.final.sorted.bam"
-        csv_path = f"{output_dir}/{barcode}.{reference.name}.bedcov.csv"
-
-        # Compute BED coverage
-        # -> Does not add any sample or barcode information natively
-        samtools_bedcov(bam_path=bam_path, bed_path=bed_path, output_csv=csv_path)
+    run_barcodes(
+        bedcov_barcode,
+        params["barcodes"],
+        args=(params, script_dir, reference, bed_path),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/bedcov",
+    )
 
     print_footer(t0)
 
@@ -124,9 +138,14 @@ def bedcov_merge(expt_dir: str, config: str, bed_path: str) -> None:
 
 
 def bedcov(
-    expt_dir: str, config: str, barcode: str, bed_path: str, overview: bool = False
+    expt_dir: str,
+    config: str,
+    barcode: str,
+    bed_path: str,
+    overview: bool = False,
+    jobs: int = 1,
 ) -> None:
     if overview:
         bedcov_merge(expt_dir, config, bed_path)
     else:
-        bedcov_single(expt_dir, config, barcode, bed_path)
+        bedcov_single(expt_dir, config, bed_path, barcode, jobs)
@@ -1,15 +1,17 @@
 import os
+import copy
 import click
 import pandas as pd
 import subprocess
-from itertools import product
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, sharding_options, jobs_option
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import PlasmodiumFalciparum3D7
 from nomadic.lib.process_vcfs import bcftools_view, bcftools_concat, bcftools_sort, bcftools_index
+from nomadic.lib.sharding import count_mapped_reads, get_threads_per_shard, partition_by_weight, run_in_pool
 from nomadic.pipeline.calling.callers import caller_collection
-from .downsample import BamDownSampler
+from .downsample import MultiBamDownSampler
 
 
 @click.command(short_help="Call variants across targets.")
@@ -40,7 +42,15 @@ from .downsample import BamDownSampler
     default=5,
     help="If --downsample invoked, number of times to iterate downsampling for each number of reads.",
 )
-def call(expt_dir, config, barcode, method, downsample, reads, iterations):
+@click.option(
+    "--seed",
+    type=int,
+    default=None,
+    help="If --downsample invoked, random seed from which all downsamples are drawn.",
+)
+@sharding_options
+@jobs_option
+def call(expt_dir, config, barcode, method, downsample, reads, iterations, seed, threads, shards, jobs):
     """
     Call variants, optionally with downsampling.
 
@@ -52,16 +62,141 @@ def call(expt_dir, config, barcode, method, downsample, reads, iterations):
         if not reads:
             raise ValueError("If --dowsample invoked, musts pass interger to -r.")
 
+        # Calling downsamples is not sharded
+        if threads != 1 or shards is not None:
+            raise ValueError(
+                "--threads and --shards are not supported with --downsample; use --jobs to run barcodes in parallel."
+            )
+
         # Run
-        call_with_downsample(expt_dir, config, barcode, method, reads, iterations)
+        call_with_downsample(expt_dir, config, barcode, method, reads, iterations, seed, jobs)
 
     # No dowampling
     else:
-        call_all_reads(expt_dir, config, barcode, method)
+        call_all_reads(expt_dir, config, barcode, method, threads, shards, jobs)
 
 
-def call_all_reads(expt_dir, config, barcode, method):
-    """Call variants across all reads"""
+def call_target(method, reference, amplicon_info, input_dir, output_dir, target_gene, sample_name, caller_threads=None):
+    """
+    Call variants for a single target, and trim them to the amplicon;
+    callers with a `THREADS` setting use `caller_threads`, if given
+
+    returns
+        trimmed_vcf_path: str
+            Path to the trimmed VCF.
+
+    """
+
+    # Define input bam and output vcf
+    bam_path = f"{input_dir}/reads.target.{target_gene}.bam"
+    vcf_path = f"{output_dir}/reads.target.{target_gene}.vcf.gz"
+
+    # Select variant calling method
+    # - copied, as the collection holds a single instance of each
+    print("Calling variants...")
+    print(f"  Input: {bam_path}")
+    print(f"  Ouput: {vcf_path}")
+    caller = copy.copy(caller_collection[method])
+    if caller_threads is not None and hasattr(caller, "THREADS"):
+        caller.THREADS = str(caller_threads)
+    caller.set_files(
+        bam_path=bam_path,
+        vcf_path=vcf_path,
+    )
+    caller.set_arguments(fasta_path=reference.fasta_path)
+    caller.call_variants(sample_name=sample_name)  # return True / False if it worked
+
+    # Trim VCF to only include variants that are within the amplicon
+    # - This avoids retaining spurious calls caused by chimeric reads, or artefacts
+    # involving duplicated variants in adjacent genes
+    trimmed_vcf_path = f"{output_dir}/reads.target.{target_gene}.trimmed.vcf.gz"
+    bcftools_view(
+        input_vcf=vcf_path,
+        output_vcf=trimmed_vcf_path,
+        r=f"{amplicon_info['chrom']}:{amplicon_info['start']}-{amplicon_info['end']}" 
+    )
+    os.remove(vcf_path) # we don't need the untrimmed version
+    print("Done.")
+    print("")
+
+    return trimmed_vcf_path
+
+
+def call_target_shard(method, reference, amplicon_df, input_dir, output_dir, target_genes, sample_name, caller_threads=None):
+    """Call variants for a shard of targets, one after another"""
+    return [
+        call_target(
+            method,
+            reference,
+            amplicon_df.loc[target_gene].squeeze(),
+            input_dir,
+            output_dir,
+            target_gene,
+            sample_name,
+            caller_threads
+        )
+        for target_gene in target_genes
+    ]
+
+
+def call_all_reads_barcode(
+    barcode, params, script_dir, method, reference, amplicon_df, threads=1, shards=1
+):
+    """
+    Call variants across all reads of a single barcode
+
+    """
+
+    # Define input and output directory
+    print(f"Running {method} for: {barcode}")
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    input_dir = f"{barcode_dir}/target-extraction"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Balance targets across shards by their number of reads
+    target_names = params["target_names"]
+    n_reads = [
+        count_mapped_reads(f"{input_dir}/reads.target.{target_gene}.bam")
+        for target_gene in target_names
+    ]
+    target_shards = [
+        [target_names[j] for j in ixs]
+        for ixs in partition_by_weight(n_reads, shards)
+    ]
+
+    # ITERATE over shards of targets, in parallel, sharing `threads`
+    caller_threads = get_threads_per_shard(len(target_shards), threads)
+    shard_vcfs = run_in_pool(
+        call_target_shard,
+        [
+            (method, reference, amplicon_df, input_dir, output_dir, target_genes, barcode, caller_threads)
+            for target_genes in target_shards
+        ],
+        threads=threads
+    )
+    target_vcfs = [vcf for vcfs in shard_vcfs for vcf in vcfs]
+
+    # Concatenate VCFs for all targets
+    print("Concatenating VCFs for all targets...")
+    concat_vcf = f"{output_dir}/reads.all_targets.vcf.gz"
+    bcftools_concat(input_vcfs=target_vcfs, O="z", output_vcf=concat_vcf)
+    sorted_vcf = concat_vcf.replace(".vcf.gz", ".sorted.vcf.gz")
+    bcftools_sort(input_vcf=concat_vcf, output_vcf=sorted_vcf, O="z")
+    bcftools_index(sorted_vcf)
+    os.remove(concat_vcf)
+    print(f"  Concatenated VCF: {sorted_vcf}")
+    print("Done.")
+    print("")
+
+
+def call_all_reads(expt_dir, config, barcode, method, threads=1, shards=None, jobs=1):
+    """
+    Call variants across all reads
+
+    Targets are split into `shards`, balanced by their number of
+    reads, which are called using up to `threads` processes.
+
+    """
     # PARSE INPUTS
     script_descrip = "NOMADIC: Call variants without downsampling"
     t0 = print_header(script_descrip)
@@ -78,108 +213,84 @@ def call_all_reads(expt_dir, config, barcode, method):
     amplicon_df.columns = ["chrom", "start", "end", "gene_name"]
     amplicon_df.index = amplicon_df["gene_name"]
 
+    # One shard per thread, unless specified
+    if shards is None:
+        shards = threads
+
     # Focus on a single barcode, if specified
     if "focus_barcode" in params:
         params["barcodes"] = [params["focus_barcode"]]
 
     # ITERATE over barcodes
-    for barcode in params["barcodes"]:
-
-        # Define input and output directory
-        print("-" * 80)
-        print(f"Running {method} for: {barcode}")
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        input_dir = f"{barcode_dir}/target-extraction"
-        output_dir = produce_dir(barcode_dir, script_dir)
-
-        # ITERATE over targets
-        target_vcfs = []
-        for target_gene in params["target_names"]:
-
-            # Define input bam and output vcf
-            bam_path = f"{input_dir}/reads.target.{target_gene}.bam"
-            vcf_path = f"{output_dir}/reads.target.{target_gene}.vcf.gz"
-
-            # Select variant calling method
-            print("Calling variants...")
-            print(f"  Input: {bam_path}")
-            print(f"  Ouput: {vcf_path}")
-            caller = caller_collection[method]
-            caller.set_files(
-                bam_path=bam_path,
-                vcf_path=vcf_path,
-            )
-            caller.set_arguments(fasta_path=reference.fasta_path)
-            caller.call_variants(sample_name=barcode)  # return True / False if it worked
-
-            # Trim VCF to only include variants that are within the amplicon
-            # - This avoids retaining spurious calls caused by chimeric reads, or artefacts
-            # involving duplicated variants in adjacent genes
-            trimmed_vcf_path = f"{output_dir}/reads.target.{target_gene}.trimmed.vcf.gz"
-            amplicon_info = amplicon_df.loc[target_gene].squeeze()
-            bcftools_view(
-                input_vcf=vcf_path,
-                output_vcf=trimmed_vcf_path,
-                r=f"{amplicon_info['chrom']}:{amplicon_info['start']}-{amplicon_info['end']}" 
-            )
-            target_vcfs.append(trimmed_vcf_path)
-            os.remove(vcf_path) # we don't need the untrimmed version
-            print("Done.")
-            print("")
-
-        # Concatenate VCFs for all targets
-        print("Concatenating VCFs for all targets...")
-        concat_vcf = f"{output_dir}/reads.all_targets.vcf.gz"
-        bcftools_concat(input_vcfs=target_vcfs, O="z", output_vcf=concat_vcf)
-        sorted_vcf = concat_vcf.replace(".vcf.gz", ".sorted.vcf.gz")
-        bcftools_sort(input_vcf=concat_vcf, output_vcf=sorted_vcf, O="z")
-        bcftools_index(sorted_vcf)
-        os.remove(concat_vcf)
-        print(f"  Concatenated VCF: {sorted_vcf}")
-        print("Done.")
-        print("")
+    run_barcodes(
+        call_all_reads_barcode,
+        params["barcodes"],
+        args=(params, script_dir, method, reference, amplicon_df, threads, shards),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/call",
+    )
 
     print_footer(t0)
 
 
-def call_with_downsample(expt_dir, config, barcode, method, reads, iterations):
-    """Call variants across all reads with downsampling"""
-    # PARSE INPUTS
-    script_descrip = "NOMADIC: Call variants without downsampling"
-    t0 = print_header(script_descrip)
-    script_dir = produce_dir(
-        "calling", method, "downsample"
-    )  # this will be easier to iterate overs
-    params = build_parameter_dict(expt_dir, config, barcode)
-
-    # Parse reads
-    print(f"Number of reads to downsample to: {reads}")
-
-    # Define reference genome
-    reference = PlasmodiumFalciparum3D7()
+def call_with_downsample_barcode(
+    barcode, params, script_dir, method, reference, amplicon_df, reads, iterations, seed=None
+):
+    """
+    Call variants for downsamples of a single barcode
 
-    # Target Amplicons
-    amplicon_path = "configs/beds/nomads8.amplicons.bed"
-    amplicon_df = pd.read_csv(amplicon_path, sep="\t", header=None)
-    amplicon_df.columns = ["chrom", "start", "end", "gene_name"]
-    amplicon_df.index = amplicon_df["gene_name"]
+    """
 
-    # Focus on a single barcode, if specified
-    if "focus_barcode" in params:
-        params["barcodes"] = [params["focus_barcode"]]
+    # Define input and output directory
+    print(f"Running {method} for: {barcode}")
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    input_dir = f"{barcode_dir}/target-extraction"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Draw all downsamples for each target; these are written to
+    # disk for one number of reads at a time
+    print("Drawing downsamples...")
+    downsamplers = {}
+    seed_dfs = []
+    for target_gene in params["target_names"]:
+        bam_path = f"{input_dir}/reads.target.{target_gene}.bam"
+        downsampler = MultiBamDownSampler(bam_path, seed=seed)
+        downsampler.draw(reads, iterations)
+        downsamplers[target_gene] = downsampler
+
+        # Record seeds
+        seed_df = downsampler.get_seeds_df()
+        seed_df.insert(0, "target_gene", target_gene)
+        seed_df.insert(1, "n_reads_total", downsampler.n_reads_total)
+        seed_dfs.append(seed_df)
+    pd.concat(seed_dfs).to_csv(f"{output_dir}/downsample.seeds.csv", index=False)
+    print("Done.")
+    print("")
+
+    # Iterate over number of reads
+    for n_reads in reads:
+
+        # Write all replicates for `n_reads`, in one pass over each target .bam
+        print(f"Writing downsamples to {n_reads} reads...")
+        downsampled_bams = {}
+        for target_gene, downsampler in downsamplers.items():
+            output_bams = {
+                (n, ix): (
+                    f"{output_dir}/temp.{barcode}.n{n:04d}.r{ix:03d}.{target_gene}.bam"
+                )
+                for n, ix in downsampler.subsets
+                if n == n_reads
+            }
+            if not output_bams:
+                continue
+            downsampler.write(output_bams)
+            for (_, ix), downsampled_bam in output_bams.items():
+                downsampled_bams[(ix, target_gene)] = downsampled_bam
+        print("Done.")
+        print("")
 
-    # ITERATE over barcodes
-    for barcode in params["barcodes"]:
-        # Define input and output directory
-        print("." * 80)
-        print(f"Running {method} for: {barcode}")
-        print("." * 80)
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        input_dir = f"{barcode_dir}/target-extraction"
-        output_dir = produce_dir(barcode_dir, script_dir)
-
-        # Iterate over number of reads and replicates
-        for n_reads, ix in product(reads, list(range(iterations))):
+        # Iterate over replicates
+        for ix in range(iterations):
 
             # We are creating an artifical sample from this barcode
             # by downsampling
@@ -190,22 +301,12 @@ def call_with_downsample(expt_dir, config, barcode, method, reads, iterations):
             target_vcfs = []
             for target_gene in params["target_names"]:
                 print(f"Target: {target_gene}")
-                # Define input bam
-                bam_path = f"{input_dir}/reads.target.{target_gene}.bam"
-
-                # Instantiate downsampler; ensure enough reads
-                bam_manager = BamDownSampler(bam_path)
-                if bam_manager.n_reads_total < n_reads:
+                # Get downsample; ensure enough reads
+                if (ix, target_gene) not in downsampled_bams:
                     print(f"Not enough reads for {target_gene} to downsample.")
-                    print(f"  No. reads total: {bam_manager.n_reads_total}")
                     print(f"  No. downsampling: {n_reads}")
                     continue
-
-                # Create dowsample
-                print("Downsampling...")
-                bam_manager.create_downsample(n_reads)
-                print("Done.")
-                print("")
+                downsampled_bam = downsampled_bams[(ix, target_gene)]
 
                 # Define output vcf
                 vcf_fn = f"{sample_name}.{target_gene}.vcf.gz"
@@ -213,11 +314,11 @@ def call_with_downsample(expt_dir, config, barcode, method, reads, iterations):
 
                 # Select variant calling method
                 print("Calling variants...")
-                print(f"  Input: {bam_path}")
+                print(f"  Input: {downsampled_bam}")
                 print(f"  Ouput: {vcf_path}")
                 caller = caller_collection[method]
                 caller.set_files(
-                    bam_path=bam_manager.downsampled_bam_path,  # here we pass downsampled .bam
+                    bam_path=downsampled_bam,  # here we pass downsampled .bam
                     vcf_path=vcf_path,
                 )
                 caller.set_arguments(fasta_path=reference.fasta_path)
@@ -226,7 +327,8 @@ def call_with_downsample(expt_dir, config, barcode, method, reads, iterations):
                 print("")
 
                 # Remove downsampled bam
-                bam_manager.remove_downsample()
+                os.remove(downsampled_bam)
+                os.remove(f"{downsampled_bam}.bai")
 
                 # Store target VCF, if the file exists
                 # Specifically handling issues around Clair3
@@ -259,4 +361,50 @@ def call_with_downsample(expt_dir, config, barcode, method, reads, iterations):
             print("Done.")
             print("")
 
+
+def call_with_downsample(expt_dir, config, barcode, method, reads, iterations, seed=None, jobs=1):
+    """
+    Call variants across all reads with downsampling
+
+    All downsamples of a target are drawn up front, with exact numbers
+    of reads, and the seed of each is recorded in `downsample.seeds.csv`.
+    For each number of reads, all replicates are written in a single pass
+    over each target .bam, and each is removed once called; the .bam of
+    a target is thus read once per number of reads, and at most
+    `iterations` downsamples of it are on disk at a time.
+
+    """
+    # PARSE INPUTS
+    script_descrip = "NOMADIC: Call variants without downsampling"
+    t0 = print_header(script_descrip)
+    script_dir = produce_dir(
+        "calling", method, "downsample"
+    )  # this will be easier to iterate overs
+    params = build_parameter_dict(expt_dir, config, barcode)
+
+    # Parse reads
+    print(f"Number of reads to downsample to: {reads}")
+
+    # Define reference genome
+    reference = PlasmodiumFalciparum3D7()
+
+    # Target Amplicons
+    amplicon_path = "configs/beds/nomads8.amplicons.bed"
+    amplicon_df = pd.read_csv(amplicon_path, sep="\t", header=None)
+    amplicon_df.columns = ["chrom", "start", "end", "gene_name"]
+    amplicon_df.index = amplicon_df["gene_name"]
+
+    # Focus on a single barcode, if specified
+    if "focus_barcode" in params:
+        params["barcodes"] = [params["focus_barcode"]]
+
+    # ITERATE over barcodes
+    run_barcodes(
+        call_with_downsample_barcode,
+        params["barcodes"],
+        args=(params, script_dir, method, reference, amplicon_df, reads, iterations, seed),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/call",
+    )
+
     print_footer(t0)
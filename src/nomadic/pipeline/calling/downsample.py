@@ -2,6 +2,12 @@ import os
 import uuid
 import random
 import subprocess
+import pysam
+import numpy as np
+import pandas as pd
+from itertools import product
+from typing import Dict, List
+from nomadic.lib.process_bams import samtools_index
 
 
 class BamDownSampler:
@@ -86,3 +92,122 @@ class BamDownSampler:
         os.remove(self.downsampled_bam_path)
         os.remove(f"{self.downsampled_bam_path}.bai")
 
+
+
+class MultiBamDownSampler:
+    """
+    Draw many subsets of the reads of a `.bam` file, each with an
+    exact number of primary reads, and write them in batches
+
+    The `.bam` is read once to index its primary reads, and once
+    more for each call to `write`, which writes any number of subsets
+    in a single pass; batching subsets trades passes for disk use.
+    Each subset is drawn with its own seed, derived from `seed`, and
+    these are recorded such that any subset can be reproduced.
+
+    """
+
+    EXCLUDE_FLAGS = 0x900  # secondary, supplementary
+
+    def __init__(self, bam_path: str, seed: int = None):
+        # Sanity check
+        if not os.path.isfile(bam_path):
+            raise FileNotFoundError(f"No .bam file found at: {bam_path}.")
+
+        self.bam_path = bam_path
+        self.seed = seed if seed is not None else random.randint(0, 2**32 - 1)
+
+        # Index primary reads, in file order
+        self.read_names = self._get_primary_read_names(bam_path)
+        self.n_reads_total = len(self.read_names)
+
+        # Store subsets of primary read indices, and their seeds,
+        # by (n_reads, replicate)
+        self.subsets = {}
+        self.seeds = {}
+
+    def _get_primary_read_names(self, bam_path: str) -> List[str]:
+        """Get the names of all primary reads in `bam_path`"""
+
+        with pysam.AlignmentFile(bam_path, "rb") as bam:
+            return [
+                read.query_name
+                for read in bam.fetch(until_eof=True)
+                if not read.flag & self.EXCLUDE_FLAGS
+            ]
+
+    def draw(self, n_reads: List[int], n_replicates: int) -> List[tuple]:
+        """
+        Draw `n_replicates` subsets for each number of reads in `n_reads`;
+        numbers greater than the total number of reads are skipped
+
+        returns
+            keys: list of tuple
+                The (n_reads, replicate) of each subset drawn.
+
+        """
+
+        keys = []
+        for n, replicate in product(n_reads, range(n_replicates)):
+            if n > self.n_reads_total:
+                continue
+            seed = int(
+                np.random.SeedSequence([self.seed, n, replicate]).generate_state(1)[0]
+            )
+            rng = np.random.default_rng(seed)
+            self.subsets[(n, replicate)] = np.sort(
+                rng.choice(self.n_reads_total, size=n, replace=False)
+            )
+            self.seeds[(n, replicate)] = seed
+            keys.append((n, replicate))
+
+        return keys
+
+    def get_read_names(self, key: tuple) -> List[str]:
+        """Get the names of the reads in the subset `key`"""
+
+        return [self.read_names[ix] for ix in self.subsets[key]]
+
+    def get_seeds_df(self) -> pd.DataFrame:
+        """Get the seed used to draw each subset"""
+
+        return pd.DataFrame(
+            [
+                {"n_reads": n, "replicate": replicate, "seed": seed}
+                for (n, replicate), seed in self.seeds.items()
+            ],
+            columns=["n_reads", "replicate", "seed"],
+        )
+
+    def write(self, output_bams: Dict[tuple, str], index: bool = True) -> None:
+        """
+        Write each subset `key` to `output_bams[key]`, in a single pass;
+        secondary and supplementary alignments of selected reads are kept
+
+        """
+
+        keys = list(output_bams)
+        read_ixs = {name: ix for ix, name in enumerate(self.read_names)}
+        is_selected = np.zeros((self.n_reads_total, len(keys)), dtype=bool)
+        for j, key in enumerate(keys):
+            is_selected[self.subsets[key], j] = True
+
+        with pysam.AlignmentFile(self.bam_path, "rb") as bam:
+            writers = [
+                pysam.AlignmentFile(output_bams[key], "wb", template=bam)
+                for key in keys
+            ]
+            try:
+                for read in bam.fetch(until_eof=True):
+                    ix = read_ixs.get(read.query_name)
+                    if ix is None:
+                        continue
+                    for j in np.flatnonzero(is_selected[ix]):
+                        writers[j].write(read)
+            finally:
+                for writer in writers:
+                    writer.close()
+
+        if index:
+            for key in keys:
+                samtools_index(output_bams[key])
@@ -0,0 +1,323 @@
+import pysam
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+
+# ================================================================
+# Parameters
+#
+# ================================================================
+
+
+BASES = "ACGT"
+BASE_CODES = {b: j for j, b in enumerate(BASES)}
+BASE_CODES.update({b.lower(): j for j, b in enumerate(BASES)})
+MISSING = -1
+
+EXCLUDE_FLAGS = 0x904  # unmapped, secondary, supplementary
+
+# Genotyping rule applied to each replicate
+MIN_DEPTH = 5
+MIN_WSAF = 0.2
+
+# Maximum number of (read, site) entries resampled at once
+MAX_BATCH_ENTRIES = 50_000_000
+
+
+# ================================================================
+# Load sites
+#
+# ================================================================
+
+
+def load_vcf_sites(vcf_path, sample_name=None):
+    """
+    Load the biallelic SNP sites of a VCF, one row per alternative
+    allele; if `sample_name` is given, only sites where that sample
+    carries the alternative allele are kept
+
+    returns
+        sites_df: DataFrame
+            With columns `chrom`, `pos` (1-based), `ref` and `alt`.
+
+    """
+
+    rows = []
+    with pysam.VariantFile(vcf_path) as vcf:
+        for record in vcf:
+            if len(record.ref) != 1 or not record.alts:
+                continue
+            gt = None
+            if sample_name is not None:
+                gt = record.samples[sample_name]["GT"]
+            for allele_ix, alt in enumerate(record.alts, start=1):
+                if len(alt) != 1 or alt not in BASES:
+                    continue
+                if gt is not None and allele_ix not in gt:
+                    continue
+                rows.append((record.chrom, record.pos, record.ref, alt))
+
+    return pd.DataFrame(rows, columns=["chrom", "pos", "ref", "alt"])
+
+
+# ================================================================
+# Extract alleles of each read
+#
+# ================================================================
+
+
+class AlleleMatrix:
+    """
+    The base observed by every primary read of a .bam at a set of
+    sites, stored as a compact (n_reads, n_positions) matrix
+
+    Bases are encoded as indexes into `BASES`; reads that do not
+    cover a position, or have a deletion or other base there, are
+    `MISSING`. Reads covering none of the positions are kept, such
+    that resampling draws from all reads of the .bam.
+
+    """
+
+    def __init__(self, bases: np.ndarray, sites_df: pd.DataFrame):
+        """
+        params
+            bases: ndarray, int8, shape (n_reads, n_positions)
+            sites_df: DataFrame
+                Sites with columns `chrom`, `pos`, `ref`, `alt` and
+                `position_ix`, the column of `bases` for the site.
+
+        """
+        self.bases = bases
+        self.sites_df = sites_df
+        self.n_reads = bases.shape[0]
+        self.ref_codes = np.array([BASE_CODES[b] for b in sites_df["ref"]], "int8")
+        self.alt_codes = np.array([BASE_CODES[b] for b in sites_df["alt"]], "int8")
+        self.position_ixs = sites_df["position_ix"].values
+
+    @classmethod
+    def from_bam(cls, bam_path: str, sites_df: pd.DataFrame):
+        """
+        Extract alleles at `sites_df` from the primary reads of `bam_path`,
+        using a single pileup column per position
+
+        """
+
+        sites_df = sites_df.reset_index(drop=True).copy()
+        positions = sites_df[["chrom", "pos"]].drop_duplicates().reset_index(drop=True)
+        sites_df["position_ix"] = pd.MultiIndex.from_frame(positions).get_indexer(
+            pd.MultiIndex.from_frame(sites_df[["chrom", "pos"]])
+        )
+
+        with pysam.AlignmentFile(bam_path, "rb") as bam:
+            # All primary reads are rows
+            read_names = pd.Index(
+                pd.unique(
+                    np.array(
+                        [
+                            read.query_name
+                            for read in bam.fetch(until_eof=True)
+                            if not read.flag & EXCLUDE_FLAGS
+                        ],
+                        dtype=object,
+                    )
+                )
+            )
+            bases = np.full((len(read_names), len(positions)), MISSING, dtype="int8")
+
+            # Fill one column per position
+            for j, (chrom, pos) in enumerate(positions.itertuples(index=False)):
+                if chrom not in bam.references:
+                    continue
+                for column in bam.pileup(
+                    chrom,
+                    pos - 1,
+                    pos,
+                    truncate=True,
+                    stepper="samtools",
+                    flag_filter=EXCLUDE_FLAGS,
+                    compute_baq=False,
+                    min_base_quality=0,
+                    max_depth=10**8,
+                    ignore_overlaps=False,
+                    ignore_orphans=False,
+                ):
+                    row_ixs = read_names.get_indexer(column.get_query_names())
+                    bases[row_ixs, j] = [
+                        BASE_CODES.get(b, MISSING)
+                        for b in column.get_query_sequences()
+                    ]
+
+        return cls(bases, sites_df)
+
+    def count_alleles(self, row_ixs: np.ndarray):
+        """
+        Count reference and alternative alleles at every site for
+        each set of reads in `row_ixs`
+
+        params
+            row_ixs: ndarray, int, shape (n_replicates, n_reads)
+        returns
+            ref_counts, alt_counts: ndarray, int, shape (n_replicates, n_sites)
+
+        """
+
+        sampled = self.bases[row_ixs][:, :, self.position_ixs]
+        ref_counts = (sampled == self.ref_codes).sum(axis=1)
+        alt_counts = (sampled == self.alt_codes).sum(axis=1)
+
+        return ref_counts, alt_counts
+
+
+# ================================================================
+# Resample reads and genotype
+#
+# ================================================================
+
+
+def call_alt_alleles(ref_counts, alt_counts, min_depth=MIN_DEPTH, min_wsaf=MIN_WSAF):
+    """
+    Call the alternative allele present where depth is at least
+    `min_depth` and within-sample allele frequency (WSAF) at least
+    `min_wsaf`
+
+    """
+
+    depth = ref_counts + alt_counts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wsaf = np.where(depth > 0, alt_counts / depth, 0)
+
+    return (depth >= min_depth) & (wsaf >= min_wsaf)
+
+
+class AlleleResampler:
+    """
+    Estimate how variant calling performance depends on read depth,
+    by resampling reads from the allele matrices of each target, in
+    place of re-running a variant caller on downsampled .bam files
+
+    As in `call --downsample`, each replicate draws exactly `n_reads`
+    reads from every target; targets with fewer are skipped.
+
+    """
+
+    def __init__(
+        self,
+        matrices: Dict[str, AlleleMatrix],
+        truth_df: pd.DataFrame,
+        seed: int = None,
+    ):
+        """
+        params
+            matrices: dict
+                Allele matrix of each target.
+            truth_df: DataFrame
+                True variants of the sample, with columns `chrom`,
+                `pos`, `ref` and `alt`.
+            seed: int
+                Seed of the random number generator.
+
+        """
+        self.matrices = matrices
+        self.rng = np.random.default_rng(seed)
+
+        # Mark true sites
+        truth = set(truth_df[["chrom", "pos", "alt"]].itertuples(index=False, name=None))
+        self.is_true = {
+            target: np.array(
+                [
+                    site in truth
+                    for site in matrix.sites_df[["chrom", "pos", "alt"]].itertuples(
+                        index=False, name=None
+                    )
+                ],
+                dtype=bool,
+            )
+            for target, matrix in matrices.items()
+        }
+
+    def _resample_target(self, matrix, is_true, n_reads, n_replicates, **kwargs):
+        """
+        Count true positives, false positives and false negatives in
+        each replicate for a single target
+
+        """
+
+        counts = np.zeros((n_replicates, 3), dtype="int64")
+        n_sites = max(len(matrix.position_ixs), 1)
+        batch_size = max(MAX_BATCH_ENTRIES // max(n_reads * n_sites, 1), 1)
+        for start in range(0, n_replicates, batch_size):
+            end = min(start + batch_size, n_replicates)
+            row_ixs = np.array(
+                [
+                    self.rng.choice(matrix.n_reads, size=n_reads, replace=False)
+                    for _ in range(start, end)
+                ]
+            ).reshape(end - start, n_reads)
+            is_called = call_alt_alleles(*matrix.count_alleles(row_ixs), **kwargs)
+            counts[start:end, 0] = (is_called & is_true).sum(axis=1)
+            counts[start:end, 1] = (is_called & ~is_true).sum(axis=1)
+            counts[start:end, 2] = (~is_called & is_true).sum(axis=1)
+
+        return counts
+
+    def run(self, n_reads, n_replicates, min_depth=MIN_DEPTH, min_wsaf=MIN_WSAF):
+        """
+        Resample `n_replicates` times at each depth in `n_reads`
+
+        returns
+            replicate_df: DataFrame
+                True positives, false positives and false negatives,
+                summed across targets, with sensitivity and precision,
+                for each depth and replicate.
+
+        """
+
+        dfs = []
+        for n in n_reads:
+            counts = np.zeros((n_replicates, 3), dtype="int64")
+            n_targets = 0
+            for target, matrix in self.matrices.items():
+                if matrix.n_reads < n:
+                    continue
+                counts += self._resample_target(
+                    matrix,
+                    self.is_true[target],
+                    n,
+                    n_replicates,
+                    min_depth=min_depth,
+                    min_wsaf=min_wsaf,
+                )
+                n_targets += 1
+
+            df = pd.DataFrame(counts, columns=["tp", "fp", "fn"])
+            df.insert(0, "n_reads", n)
+            df.insert(1, "replicate", np.arange(n_replicates))
+            df.insert(2, "n_targets", n_targets)
+            dfs.append(df)
+
+        replicate_df = pd.concat(dfs, ignore_index=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            replicate_df["sensitivity"] = replicate_df["tp"] / (
+                replicate_df["tp"] + replicate_df["fn"]
+            )
+            replicate_df["precision"] = replicate_df["tp"] / (
+                replicate_df["tp"] + replicate_df["fp"]
+            )
+
+        return replicate_df
+
+
+def summarise_curves(replicate_df):
+    """
+    Summarise sensitivity and precision across replicates, by depth
+
+    """
+
+    aggregations = {"n_replicates": ("replicate", "size")}
+    for metric in ["sensitivity", "precision"]:
+        aggregations[f"{metric}_mean"] = (metric, "mean")
+        aggregations[f"{metric}_q05"] = (metric, lambda x: x.quantile(0.05))
+        aggregations[f"{metric}_q95"] = (metric, lambda x: x.quantile(0.95))
+
+    return replicate_df.groupby("n_reads").agg(**aggregations).reset_index()
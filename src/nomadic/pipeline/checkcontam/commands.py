@@ -3,7 +3,14 @@ from nomadic.pipeline.cli import experiment_options, barcode_option
 
 @click.command(short_help="Check contamination rate across an experiment.")
 @experiment_options
-def checkcontam(expt_dir, config):
+@click.option(
+    "-r",
+    "--bed_path",
+    type=str,
+    default=None,
+    help="Path to BED file for computing coverage; by default, use the output of `nomadic bedcov --overview`.",
+)
+def checkcontam(expt_dir, config, bed_path):
     """
     Quickly call variants and annotate them with a given
     variant calling method
@@ -11,5 +18,5 @@ def checkcontam(expt_dir, config):
     """
     from .main import checkcontam
 
-    checkcontam(expt_dir, config)
+    checkcontam(expt_dir, config, bed_path)
 
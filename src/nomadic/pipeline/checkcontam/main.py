@@ -4,10 +4,11 @@ import pandas as pd
 import numpy as np
 
 from typing import Dict
-from functools import partial
 
+from nomadic.lib.coverage import CoverageCache
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.references import PlasmodiumFalciparum3D7
 
 
 # SETTINGS
@@ -23,11 +24,37 @@ def create_ntc_column(metadata: pd.DataFrame, ntc_indicator: str) -> pd.DataFram
     return [ntc_indicator in sample_id for sample_id in metadata["sample_id"]]
 
 
-def checkcontam(expt_dir: str, config: str):
+def load_barcode_coverage(params: Dict, bed_path: str) -> pd.DataFrame:
+    """
+    Compute mean coverage of each region of `bed_path` for every barcode,
+    from the cached per-base coverage of its .bam file
+
+    """
+
+    reference = PlasmodiumFalciparum3D7()
+
+    dfs = []
+    for barcode in params["barcodes"]:
+        bam_path = f"{params['barcodes_dir']}/{barcode}/bams/{barcode}.{reference.name}.final.sorted.bam"
+        if not os.path.exists(bam_path):
+            warnings.warn(f"No .bam file found at {bam_path}! Skipping.")
+            continue
+        barcode_df = CoverageCache.from_bam(bam_path, bed_path).summarise_bedcov()
+        barcode_df.insert(0, "barcode", barcode)
+        dfs.append(barcode_df)
+
+    return pd.concat(dfs)
+
+
+def checkcontam(expt_dir: str, config: str, bed_path: str = None):
     """
     Check for rates of contamination across an experiment
     where negative controls have been included
 
+    If `bed_path` is given, coverage is computed from each barcode's
+    cached per-base coverage; otherwise, it is loaded from the output
+    of `nomadic bedcov --overview`
+
     """
 
     # PARSE INPUTS
@@ -40,8 +67,11 @@ def checkcontam(expt_dir: str, config: str):
 
     # Load the bed coverage dataframe
     print("Loading bed coverage data...")
-    csv_path = f"{input_dir}/summary.bedcov.csv"
-    bedcov_df = pd.read_csv(csv_path)
+    if bed_path is not None:
+        bedcov_df = load_barcode_coverage(params, bed_path)
+    else:
+        csv_path = f"{input_dir}/summary.bedcov.csv"
+        bedcov_df = pd.read_csv(csv_path)
 
     # Load
     print("Loading metadata...")
@@ -97,30 +127,16 @@ def checkcontam(expt_dir: str, config: str):
     # Classify samples as PASS / FAIL
     ntc_summary_df.index = ntc_summary_df.name
 
-    mean_ntc_dt = dict(ntc_summary_df["mean_ntc_cov"])
-
-    def calc_per_mean_cov_ntc(row: pd.Series, mean_ntc_dt: Dict) -> float:
-        return 100 * mean_ntc_dt[row["name"]] / (row["mean_cov"] + 0.01)
-
-    def fold_ntc(row: pd.Series, mean_ntc_dt: Dict) -> float:
-        return row["mean_cov"] / mean_ntc_dt[row["name"]]
-
-    summary_funcs = {
-        "per_mean_cov_ntc": partial(calc_per_mean_cov_ntc, mean_ntc_dt=mean_ntc_dt),
-        "fold_ntc": partial(fold_ntc, mean_ntc_dt=mean_ntc_dt),
-        "contamination_pass": lambda r: r["per_mean_cov_ntc"] <= 1,
-        "min_cov_pass": lambda r: r["mean_cov"] >= 50,
-        "qc_pass": lambda r: r["contamination_pass"]
-        and r["min_cov_pass"]
-        and not r["is_negative"],
-    }
-
-    for summary_name, summary_func in summary_funcs.items():
-        merged_df.insert(
-            merged_df.shape[1],
-            summary_name,
-            merged_df.apply(summary_func, axis=1),  # needs to go row-wise
-        )
+    mean_ntc_cov = merged_df["name"].map(ntc_summary_df["mean_ntc_cov"])
+    merged_df["per_mean_cov_ntc"] = 100 * mean_ntc_cov / (merged_df["mean_cov"] + 0.01)
+    merged_df["fold_ntc"] = merged_df["mean_cov"] / mean_ntc_cov
+    merged_df["contamination_pass"] = merged_df["per_mean_cov_ntc"] <= 1
+    merged_df["min_cov_pass"] = merged_df["mean_cov"] >= 50
+    merged_df["qc_pass"] = (
+        merged_df["contamination_pass"]
+        & merged_df["min_cov_pass"]
+        & ~merged_df["is_negative"].astype(bool)
+    )
 
     # Need to improve this
     expt_summary = (merged_df
@@ -45,6 +45,47 @@ def barcode_option(fn):
     return fn
 
 
+def jobs_option(fn):
+    """
+    Wrapper for Click argument used to process barcodes
+    in parallel, -j <jobs>
+
+    """
+    fn = click.option(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        show_default=True,
+        help="Number of barcodes to process in parallel.",
+    )(fn)
+    return fn
+
+
+def sharding_options(fn):
+    """
+    Wrapper for Click arguments used to split variant calling
+    into shards run in parallel, -t <threads> and -s <shards>
+
+    """
+    fn = click.option(
+        "-s",
+        "--shards",
+        type=int,
+        default=None,
+        help="Number of shards to split calling into. Defaults to --threads.",
+    )(fn)
+    fn = click.option(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        show_default=True,
+        help="Maximum number of shards to call at once.",
+    )(fn)
+    return fn
+
+
 # ================================================================
 # Entry point for all commands
 #
@@ -78,6 +119,7 @@ from .depth.commands import depth
 from .quickcall.commands import quickcall
 from .bedcov.commands import bedcov
 from .checkcontam.commands import checkcontam
+from .genotype.commands import genotype
 
 cli.add_command(basecall)
 cli.add_command(barcode)
@@ -92,6 +134,7 @@ cli.add_command(depth)
 cli.add_command(quickcall)
 cli.add_command(bedcov)
 cli.add_command(checkcontam)
+cli.add_command(genotype)
 
 from .bmrc.commands import bmrc
 
@@ -2,12 +2,13 @@ import click
 from ..trim.targets import TARGET_COLLECTION
 from .main import main
 from .aligners import ALIGNER_COLLECTION
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 
 @click.command(short_help="Perform pairwise alignment between reads.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-t",
     "--target_gene",
@@ -31,13 +32,13 @@ from nomadic.pipeline.cli import experiment_options, barcode_option
     show_default=True,
     help="Pairwise alignment algorithm."
 )
-def align(expt_dir, config, barcode, target_gene, max_reads, algorithm):
+def align(expt_dir, config, barcode, jobs, target_gene, max_reads, algorithm):
     """
     Perform pairwise alignments for a collection
     of trimmed reads
     
     """
-    main(expt_dir, config, barcode, target_gene, max_reads, algorithm)
+    main(expt_dir, config, barcode, target_gene, max_reads, algorithm, jobs)
 
 
 
@@ -1,12 +1,13 @@
 import click
 from ..trim.targets import TARGET_COLLECTION
 from .main import main
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 
 @click.command(short_help="Look for overlaps between reads.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-t",
     "--target_gene",
@@ -14,10 +15,10 @@ from nomadic.pipeline.cli import experiment_options, barcode_option
     default="MSP2",
     help="Target gene reads search."
 )
-def overlap(expt_dir, config, barcode, target_gene):
+def overlap(expt_dir, config, barcode, jobs, target_gene):
     """
     Use `minimap2` to look for overlaps between a set
     of reads deriving from a single `fastq`
     
     """
-    main(expt_dir, config, barcode, target_gene)
\ No newline at end of file
+    main(expt_dir, config, barcode, target_gene, jobs)
\ No newline at end of file
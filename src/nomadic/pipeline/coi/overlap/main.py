@@ -1,6 +1,7 @@
 import subprocess
 
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.generic import produce_dir, print_header, print_footer
 from ..trim.targets import TARGET_COLLECTION
 
@@ -27,13 +28,41 @@ def create_overlap_paf(input_fastq, output_paf):
     subprocess.run(cmd, check=True, shell=True)
 
 
+# --------------------------------------------------------------------------------
+# Find overlaps for a single barcode
+#
+# --------------------------------------------------------------------------------
+
+
+def overlap_barcode(barcode, params, script_dir, target_gene):
+    """
+    Find overlaps between the reads of a `target_gene` of
+    a single barcode
+
+    """
+
+    # DIRECTORIES
+    coi_dir = produce_dir(params["barcodes_dir"], barcode, script_dir)
+    fastq_dir = f"{coi_dir}/fastq_clipped"
+    fastq_path = f"{fastq_dir}/reads.target.{target_gene}.clipped.fastq"
+
+    overlap_dir = produce_dir(coi_dir, "overlap")
+    paf_path = f"{overlap_dir}/reads.overlap.{target_gene}.paf"
+    create_overlap_paf(
+        input_fastq=fastq_path,
+        output_paf=paf_path
+    )
+
+    print("Done.\n")
+
+
 # --------------------------------------------------------------------------------
 # Main script
 # 
 # --------------------------------------------------------------------------------
 
 
-def main(expt_dir, config, barcode, target_gene):
+def main(expt_dir, config, barcode, target_gene, jobs=1):
     """
     Use `minimap2` to look for overlaps between a set
     of reads deriving from a single `fastq`
@@ -60,23 +89,11 @@ def main(expt_dir, config, barcode, target_gene):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # DIRECTORIES
-        coi_dir = produce_dir(params["barcodes_dir"], barcode, script_dir)
-        fastq_dir = f"{coi_dir}/fastq_clipped"
-        fastq_path = f"{fastq_dir}/reads.target.{target_gene}.clipped.fastq"
-
-        overlap_dir = produce_dir(coi_dir, "overlap")
-        paf_path = f"{overlap_dir}/reads.overlap.{target_gene}.paf"
-        create_overlap_paf(
-            input_fastq=fastq_path,
-            output_paf=paf_path
-        )
-
-        print("Done.\n")
-
+    run_barcodes(
+        overlap_barcode,
+        params["barcodes"],
+        args=(params, script_dir, target_gene),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/coi/overlap",
+    )
     print_footer(t0)
\ No newline at end of file
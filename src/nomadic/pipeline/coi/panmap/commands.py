@@ -1,12 +1,13 @@
 import click
 from ..trim.targets import TARGET_COLLECTION
 from .main import main
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 
 @click.command(short_help="Map to a panel of Pf strains.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-t",
     "--target_gene",
@@ -14,10 +15,10 @@ from nomadic.pipeline.cli import experiment_options, barcode_option
     default="MSP2",
     help="Target gene reads to map."
 )
-def panmap(expt_dir, config, barcode, target_gene):
+def panmap(expt_dir, config, barcode, jobs, target_gene):
     """
     Map reads from a `target_gene` to a panel of P.f.
     referennce strains
     
     """
-    main(expt_dir, config, barcode, target_gene)
\ No newline at end of file
+    main(expt_dir, config, barcode, target_gene, jobs)
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.generic import produce_dir, print_header, print_footer
 from nomadic.lib.references import (
     PlasmodiumFalciparum3D7,
@@ -14,7 +15,36 @@ from nomadic.pipeline.coi.trim.targets import TARGET_COLLECTION
 from .mappers import Minimap2PAF
 
 
-def main(expt_dir, config, barcode, target_gene):
+def panmap_barcode(barcode, params, script_dir, target_gene, references):
+    """
+    Map the reads of a `target_gene` of a single barcode to
+    each reference of a panel
+
+    """
+
+    # DIRECTORIES
+    coi_dir = produce_dir(params["barcodes_dir"], barcode, script_dir)
+    fastq_dir = f"{coi_dir}/fastq_clipped"
+
+    for reference in references:
+        print(f"SPECIES: {reference.name}")
+
+        # Produce required directory
+        output_dir = produce_dir(coi_dir, "panmap")
+        output_bam = f"{output_dir}/{barcode}.{reference.name}.{target_gene}.sorted.paf"
+
+        # Instantiate mapper
+        mapper = Minimap2PAF(reference)
+
+        # Map
+        print("Mapping...")
+        mapper.map_from_fastqs(fastq_dir=fastq_dir)
+        mapper.run(output_bam)
+        print("Done.\n")
+    print("Done.\n")
+
+
+def main(expt_dir, config, barcode, target_gene, jobs=1):
     """
     Map reads for a given target gene to a panel of
     P.f. strains
@@ -50,32 +80,13 @@ def main(expt_dir, config, barcode, target_gene):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # DIRECTORIES
-        coi_dir = produce_dir(params["barcodes_dir"], barcode, script_dir)
-        fastq_dir = f"{coi_dir}/fastq_clipped"
-
-        for reference in references:
-            print(f"SPECIES: {reference.name}")
-
-            # Produce required directory
-            output_dir = produce_dir(coi_dir, "panmap")
-            output_bam = f"{output_dir}/{barcode}.{reference.name}.{target_gene}.sorted.paf"
-
-            # Instantiate mapper
-            mapper = Minimap2PAF(reference)
-
-            # Map
-            print("Mapping...")
-            mapper.map_from_fastqs(fastq_dir=fastq_dir)
-            mapper.run(output_bam)
-            print("Done.\n")
-        print("Done.\n")
-
+    run_barcodes(
+        panmap_barcode,
+        params["barcodes"],
+        args=(params, script_dir, target_gene, references),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/coi/panmap",
+    )
     print_footer(t0)
 
 
@@ -2,12 +2,13 @@ import click
 from ..trim.targets import TARGET_COLLECTION
 from .main import main
 from .overview import plot_overview
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 
 @click.command(short_help="Plot COI results.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-t",
     "--target_gene",
@@ -18,7 +19,7 @@ from nomadic.pipeline.cli import experiment_options, barcode_option
 @click.option(
     "--overview", is_flag=True, help="Produce an overview across all barcodes."
 )
-def plot(expt_dir, config, barcode, target_gene, overview):
+def plot(expt_dir, config, barcode, jobs, target_gene, overview):
     """
     Plot results of COI analyses.
 
@@ -30,4 +31,4 @@ def plot(expt_dir, config, barcode, target_gene, overview):
     if overview:
         plot_overview(expt_dir, config, target_gene)
     else:
-        main(expt_dir, config, barcode, target_gene)
\ No newline at end of file
+        main(expt_dir, config, barcode, target_gene, jobs)
\ No newline at end of file
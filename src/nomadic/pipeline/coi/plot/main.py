@@ -14,6 +14,7 @@ from nomadic.lib.references import (
     PF_REF_PALETTE
 )
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.generic import produce_dir, print_header, print_footer
 from nomadic.pipeline.coi.trim.targets import TARGET_COLLECTION
 
@@ -260,13 +261,107 @@ def plot_identity_network(
 
 
 
+# --------------------------------------------------------------------------------
+# Plot a single barcode
+#
+# --------------------------------------------------------------------------------
+
+
+def plot_barcode(barcode, params, target_gene, references):
+    """
+    Plot COI results for a single barcode
+
+    """
+
+    # DIRECTORIES
+    # Inputs
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    coi_dir = f"{barcode_dir}/coi"
+
+    # Output
+    plot_dir = produce_dir(coi_dir, "plots")
+
+    # Clipped read information
+    fastq_csv_path = f"{coi_dir}/fastq_clipped/reads.target.{target_gene}.clipped.csv"
+    read_df = pd.read_csv(fastq_csv_path)
+
+    # Load Panmap dataframes
+    panmap_dfs = []
+    for r in references:
+
+        # Load
+        input_paf = f"{coi_dir}/panmap/{barcode}.{r.name}.{target_gene}.sorted.paf"
+        paf_df = load_paf(input_paf)
+        paf_df.insert(0, "barcode", barcode)
+        paf_df.insert(1, "reference", r.name)
+
+        # Remove duplicate mappings, if they exist
+        # retaining highest MAPQ
+        if paf_df["query_name"].duplicated().any():
+            paf_df.sort_values(["query_name", "mapq"], ascending=False, inplace=True)
+            paf_df.drop_duplicates("query_name", inplace=True)
+
+        # Store
+        panmap_dfs.append(paf_df)
+
+    # Combine
+    panmap_df = pd.concat(panmap_dfs)
+
+    # Merge in highest identity across panel mapping
+    panmap_wide_df = pd.pivot(
+        index="query_name",
+        columns="reference",
+        values="identity",
+        data=panmap_df
+    )
+    highest_identity_ref = panmap_wide_df.idxmax(axis=1)
+    highest_identity_ref.name = "highest_identity_ref"
+
+    # TODO
+    # - I SHOULD BE WRITING THIS AS A CSV
+
+    read_df = pd.merge(
+        left=read_df, 
+        right=highest_identity_ref,
+        left_on="read_id",
+        right_index=True
+    )
+    read_df.insert(0, "barcode", barcode)
+
+    # # Load pairwise overlap information
+    # overlap_df = load_paf(f"{coi_dir}/overlap/reads.overlap.{target_gene}.paf")
+
+
+    # PLOTTING
+    # Plot read length histogram
+    print("Plotting read lengths...")
+    plot_target_histogram(
+        read_df, 
+        target_gene,
+        references,
+        palette=PF_REF_PALETTE,
+        xlims=(700, 1000),
+        output_path=f"{plot_dir}/plot.read_lengths.{target_gene}.pdf")
+
+
+    # # Identity network
+    # print("Plotting identity network...")
+    # plot_identity_network(
+    #     overlap_df, 
+    #     read_df, 
+    #     references, 
+    #     identity_threshold=NETWORK_IDENTITY_THRESHOLD,
+    #     output_path=f"{plot_dir}/plot.identity_network.{target_gene}.idn{100*NETWORK_IDENTITY_THRESHOLD:.0f}per.pdf"
+    # )
+
+
 # --------------------------------------------------------------------------------
 # Main script
 #
 # --------------------------------------------------------------------------------
 
 
-def main(expt_dir, config, barcode, target_gene):
+def main(expt_dir, config, barcode, target_gene, jobs=1):
     """
     Filter and trim all reads in a BAM file to overlap a `target_gene` 
     and span `start` and `end` positions; then convert to FASTQ
@@ -301,92 +396,13 @@ def main(expt_dir, config, barcode, target_gene):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # DIRECTORIES
-        # Inputs
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        coi_dir = f"{barcode_dir}/coi"
-
-        # Output
-        plot_dir = produce_dir(coi_dir, "plots")
-
-        # Clipped read information
-        fastq_csv_path = f"{coi_dir}/fastq_clipped/reads.target.{target_gene}.clipped.csv"
-        read_df = pd.read_csv(fastq_csv_path)
-
-        # Load Panmap dataframes
-        panmap_dfs = []
-        for r in references:
-            
-            # Load
-            input_paf = f"{coi_dir}/panmap/{barcode}.{r.name}.{target_gene}.sorted.paf"
-            paf_df = load_paf(input_paf)
-            paf_df.insert(0, "barcode", barcode)
-            paf_df.insert(1, "reference", r.name)
-            
-            # Remove duplicate mappings, if they exist
-            # retaining highest MAPQ
-            if paf_df["query_name"].duplicated().any():
-                paf_df.sort_values(["query_name", "mapq"], ascending=False, inplace=True)
-                paf_df.drop_duplicates("query_name", inplace=True)
-            
-            # Store
-            panmap_dfs.append(paf_df)
-            
-        # Combine
-        panmap_df = pd.concat(panmap_dfs)
-
-        # Merge in highest identity across panel mapping
-        panmap_wide_df = pd.pivot(
-            index="query_name",
-            columns="reference",
-            values="identity",
-            data=panmap_df
-        )
-        highest_identity_ref = panmap_wide_df.idxmax(axis=1)
-        highest_identity_ref.name = "highest_identity_ref"
-
-        # TODO
-        # - I SHOULD BE WRITING THIS AS A CSV
-
-        read_df = pd.merge(
-            left=read_df, 
-            right=highest_identity_ref,
-            left_on="read_id",
-            right_index=True
-        )
-        read_df.insert(0, "barcode", barcode)
-
-        # # Load pairwise overlap information
-        # overlap_df = load_paf(f"{coi_dir}/overlap/reads.overlap.{target_gene}.paf")
-
-
-        # PLOTTING
-        # Plot read length histogram
-        print("Plotting read lengths...")
-        plot_target_histogram(
-            read_df, 
-            target_gene,
-            references,
-            palette=PF_REF_PALETTE,
-            xlims=(700, 1000),
-            output_path=f"{plot_dir}/plot.read_lengths.{target_gene}.pdf")
-
-
-        # # Identity network
-        # print("Plotting identity network...")
-        # plot_identity_network(
-        #     overlap_df, 
-        #     read_df, 
-        #     references, 
-        #     identity_threshold=NETWORK_IDENTITY_THRESHOLD,
-        #     output_path=f"{plot_dir}/plot.identity_network.{target_gene}.idn{100*NETWORK_IDENTITY_THRESHOLD:.0f}per.pdf"
-        # )
-
+    run_barcodes(
+        plot_barcode,
+        params["barcodes"],
+        args=(params, target_gene, references),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/coi/plot",
+    )
     print_footer(t0)
 
 
@@ -1,12 +1,13 @@
 import click
 from .targets import TARGET_COLLECTION
 from .main import main
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 
 @click.command(short_help="Trim to high-quality reads overlappng a target.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-t",
     "--target_gene",
@@ -14,10 +15,10 @@ from nomadic.pipeline.cli import experiment_options, barcode_option
     default="MSP2",
     help="Trim mapped reads to this target gene."
 )
-def trim(expt_dir, config, barcode, target_gene):
+def trim(expt_dir, config, barcode, jobs, target_gene):
     """
     Filter and trim all reads in a BAM file to overlap a `target_gene`, 
     then convert to FASTQ
     
     """
-    main(expt_dir, config, barcode, target_gene)
\ No newline at end of file
+    main(expt_dir, config, barcode, target_gene, jobs)
\ No newline at end of file
@@ -10,6 +10,7 @@ import uuid
 import numpy as np
 
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.generic import produce_dir, print_header, print_footer
 from nomadic.lib.process_bams import samtools_index, bedtools_intersect
 from nomadic.lib.process_fastqs import load_fastq_read_info
@@ -178,13 +179,81 @@ def clip_bam_to_fastq(
 
 
 
+# --------------------------------------------------------------------------------
+# Trim a single barcode
+#
+# --------------------------------------------------------------------------------
+
+
+def trim_barcode(barcode, params, script_dir, target_gene, target):
+    """
+    Filter and trim the reads of a single barcode to overlap a
+    `target_gene`, then convert to FASTQ
+
+    """
+
+    # DIRECTORIES
+    # Input BAM
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    bam_path = f"{barcode_dir}/target-extraction/reads.target.{target_gene}.bam"
+    # Spanning [start, end] BAM
+    coi_dir = produce_dir(barcode_dir, script_dir)
+    bam_complete_path = f"{coi_dir}/reads.target.{target_gene}.complete.bam"
+
+    print("Restricting to reads overlapping target region...")
+    bedtools_intersect_with_region(
+        input_a=bam_path,
+        chrom=target.chrom, 
+        start=target.start, 
+        end=target.end,
+        args="-F 1.0",
+        output=bam_complete_path
+    )
+    print("Done.\n")
+
+    # Quality and read length filtered BAM
+    bam_filtered_path = bam_complete_path.replace(".bam", ".filtered.bam")
+
+    print("Filtering BAM by read length and mean quality...")
+    filter_bam(
+        input_bam=bam_complete_path,
+        filtered_bam=bam_filtered_path,
+        min_read_length=2000,
+        max_read_length=4000  # No amplicons exceed 4kbp
+    )
+    samtools_index(bam_filtered_path)
+    print("Done.\n")
+
+    # FASTQ
+    fastq_dir = produce_dir(coi_dir, "fastq_clipped")
+    fastq_path = f"{fastq_dir}/reads.target.{target_gene}.clipped.fastq"
+
+    print("Clipping and converting to FASTQ...")
+    BUFFER_BP = 400  # If you are 400bp shorter than expected over ORF, exclude
+    MIN_READ_LENGTH = target.end - target.start - BUFFER_BP
+    clip_bam_to_fastq(
+        input_bam=bam_filtered_path,
+        output_fastq=fastq_path,
+        chrom=target.chrom,
+        start=target.start,
+        end=target.end,
+        min_length=MIN_READ_LENGTH,
+    )
+    print("Done.\n")
+
+    print("Writing read information summary CSV...")
+    read_df = load_fastq_read_info(fastq_path)
+    read_df.to_csv(fastq_path.replace(".fastq", ".csv"), index=False)
+    print("Done.\n")
+
+
 # --------------------------------------------------------------------------------
 # Main script
 #
 # --------------------------------------------------------------------------------
 
 
-def main(expt_dir, config, barcode, target_gene):
+def main(expt_dir, config, barcode, target_gene, jobs=1):
     """
     Filter and trim all reads in a BAM file to overlap a `target_gene` 
     and span `start` and `end` positions; then convert to FASTQ
@@ -211,64 +280,13 @@ def main(expt_dir, config, barcode, target_gene):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # DIRECTORIES
-        # Input BAM
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        bam_path = f"{barcode_dir}/target-extraction/reads.target.{target_gene}.bam"
-        # Spanning [start, end] BAM
-        coi_dir = produce_dir(barcode_dir, script_dir)
-        bam_complete_path = f"{coi_dir}/reads.target.{target_gene}.complete.bam"
-
-        print("Restricting to reads overlapping target region...")
-        bedtools_intersect_with_region(
-            input_a=bam_path,
-            chrom=target.chrom, 
-            start=target.start, 
-            end=target.end,
-            args="-F 1.0",
-            output=bam_complete_path
-        )
-        print("Done.\n")
-
-        # Quality and read length filtered BAM
-        bam_filtered_path = bam_complete_path.replace(".bam", ".filtered.bam")
-
-        print("Filtering BAM by read length and mean quality...")
-        filter_bam(
-            input_bam=bam_complete_path,
-            filtered_bam=bam_filtered_path,
-            min_read_length=2000,
-            max_read_length=4000  # No amplicons exceed 4kbp
-        )
-        samtools_index(bam_filtered_path)
-        print("Done.\n")
-
-        # FASTQ
-        fastq_dir = produce_dir(coi_dir, "fastq_clipped")
-        fastq_path = f"{fastq_dir}/reads.target.{target_gene}.clipped.fastq"
-
-        print("Clipping and converting to FASTQ...")
-        BUFFER_BP = 400  # If you are 400bp shorter than expected over ORF, exclude
-        MIN_READ_LENGTH = target.end - target.start - BUFFER_BP
-        clip_bam_to_fastq(
-            input_bam=bam_filtered_path,
-            output_fastq=fastq_path,
-            chrom=target.chrom,
-            start=target.start,
-            end=target.end,
-            min_length=MIN_READ_LENGTH,
-        )
-        print("Done.\n")
-
-        print("Writing read information summary CSV...")
-        read_df = load_fastq_read_info(fastq_path)
-        read_df.to_csv(fastq_path.replace(".fastq", ".csv"), index=False)
-        print("Done.\n")
+    run_barcodes(
+        trim_barcode,
+        params["barcodes"],
+        args=(params, script_dir, target_gene, target),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/coi/trim",
+    )
     print("Done.\n")
 
     print_footer(t0)
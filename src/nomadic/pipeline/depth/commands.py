@@ -1,16 +1,17 @@
 import click
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 # Defaults
 AMPLICON_BED_PATH = (
     "resources/truthsets/stratifications/multiplex.03.greedy.confident_amplicons.bed"
 )
-CDS_BED_PATH = "resources/truthsets/stratifications/multiplex.03.greedy.cds.bed "
+CDS_BED_PATH = "resources/truthsets/stratifications/multiplex.03.greedy.cds.bed"
 
 # Command
 @click.command(short_help="Analyse read depth profile.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-a",
     "--amplicon_bed_path",
@@ -25,11 +26,17 @@ CDS_BED_PATH = "resources/truthsets/stratifications/multiplex.03.greedy.cds.bed
     default=CDS_BED_PATH,
     help="Path to BED file defining amplicon coding sequences regions.",
 )
-def depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path):
+@click.option(
+    "-g",
+    "--genome_track",
+    is_flag=True,
+    help="Also compute mean depth in bins across the whole genome.",
+)
+def depth(expt_dir, config, barcode, jobs, amplicon_bed_path, cds_bed_path, genome_track):
     """
     Analyse depth profiles across a set of amplicons
 
     """
     from .main import depth
 
-    depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path)
+    depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path, jobs, genome_track)
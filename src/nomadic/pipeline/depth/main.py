@@ -1,14 +1,135 @@
-import os
 import pandas as pd
 import numpy as np
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import PlasmodiumFalciparum3D7
-from nomadic.lib.process_bams import samtools_depth, bedtools_intersect
-from nomadic.lib.process_gffs import write_gff_to_bed
+from nomadic.lib.coverage import CoverageCache
+from nomadic.lib.intervals import IntervalIndex
+from nomadic.lib.process_beds import load_bed
 
 
-def depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path):
+def join_bed(df, bed_path, prefix, left=False):
+    """
+    Join each row of `df`, with `chrom` and 0-based `start` columns, to
+    every interval of `bed_path` containing it, in .bed file order, as
+    `bedtools intersect -wa -wb`; with `left`, rows without an interval
+    are kept, with missing values as in `-loj`
+
+    """
+
+    bed_df = load_bed(bed_path, with_name=True)
+    bed_df.columns = [f"{prefix}_{c}" for c in ["chrom", "start", "end", "target_id"]]
+    index = IntervalIndex.from_dataframe(
+        bed_df, f"{prefix}_chrom", f"{prefix}_start", f"{prefix}_end", zero_based=True
+    )
+    row_ixs, bed_ixs = index.query(df["chrom"].values, df["start"].values + 1)
+
+    if left:
+        is_missing = np.ones(df.shape[0], dtype=bool)
+        is_missing[row_ixs] = False
+        missing_ixs = np.flatnonzero(is_missing)
+        row_ixs = np.concatenate([row_ixs, missing_ixs])
+        bed_ixs = np.concatenate([bed_ixs, np.full(len(missing_ixs), -1)])
+        order = np.argsort(row_ixs, kind="stable")
+        row_ixs, bed_ixs = row_ixs[order], bed_ixs[order]
+
+        # Missing intervals, as `bedtools intersect -loj`
+        missing = {
+            f"{prefix}_chrom": ".",
+            f"{prefix}_start": -1,
+            f"{prefix}_end": -1,
+            f"{prefix}_target_id": ".",
+        }
+        bed_df = pd.concat([bed_df, pd.DataFrame([missing])], ignore_index=True)
+
+    joined_df = pd.concat(
+        [
+            df.iloc[row_ixs].reset_index(drop=True),
+            bed_df.iloc[bed_ixs].reset_index(drop=True),
+        ],
+        axis=1,
+    )
+
+    return joined_df
+
+
+def depth_barcode(
+    barcode, params, script_dir, reference, amplicon_bed_path, cds_bed_path, genome_track=False
+):
+    """
+    Analyse the depth profile of a single barcode across a set of amplicons,
+    and optionally across the whole genome
+
+    """
+
+    # Define relevant paths
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    bam_file = f"{barcode}.{reference.name}.final.sorted.bam"
+    bam_path = f"{barcode_dir}/bams/{bam_file}"
+    depth_dir = produce_dir(barcode_dir, script_dir)
+    depth_path = f"{depth_dir}/{bam_file.replace('.bam','.depth')}"
+
+    # Compute depths, from the cached per-base coverage
+    print("Computing depths...")
+    coverage = CoverageCache.from_bam(bam_path, amplicon_bed_path)
+    depth_df = coverage.get_depth_df()
+    depth_df.to_csv(depth_path, sep="\t", header=False, index=False)
+
+    depth_df.insert(2, "end", depth_df["start"] + 1)
+    print(f"  Total bases covered: {depth_df.shape[0]}bp")
+    print(f"  Average depth: {depth_df['depth'].mean():.2f}")
+
+    # Merge with amplicons
+    print("Annotating amplicons...")
+    complete_df = join_bed(depth_df, amplicon_bed_path, prefix="amp")
+
+    # Merge with CDS
+    print("Annotating CDS...")
+    complete_df = join_bed(complete_df, cds_bed_path, prefix="cds", left=True)
+    depth_annotate_cds_path = f"{depth_path}.amplicon.cds.bed"
+    complete_df.to_csv(depth_annotate_cds_path, sep="\t", header=False, index=False)
+
+    # Create summary table
+    summary_df = (
+        complete_df.assign(
+            below_1X=complete_df["depth"] <= 0,
+            below_10X=complete_df["depth"] <= 10,
+            below_20X=complete_df["depth"] <= 20,
+        )
+        .groupby("cds_target_id")
+        .agg(
+            n_bases=pd.NamedAgg("depth", "size"),
+            mean_depth=pd.NamedAgg("depth", "mean"),
+            median_depth=pd.NamedAgg("depth", "median"),
+            frac_below_1X=pd.NamedAgg("below_1X", "mean"),
+            frac_below_10X=pd.NamedAgg("below_10X", "mean"),
+            frac_below_20X=pd.NamedAgg("below_20X", "mean"),
+        )
+        .reset_index()
+    )
+    summary_df.insert(0, "barcode", barcode)
+    summary_path = f"{depth_dir}/table.{barcode}.depth_summary.csv"
+    summary_df.to_csv(summary_path, index=False)
+
+    # Genome-wide track, cached separately
+    if genome_track:
+        print("Computing genome-wide depth...")
+        track_df = coverage.get_genome_track()
+        track_df.insert(0, "barcode", barcode)
+        track_path = f"{depth_dir}/table.{barcode}.genome_depth.csv"
+        track_df.to_csv(track_path, index=False)
+
+    print("Outputs written to:")
+    print(f" {depth_path}")
+    print(f" {depth_annotate_cds_path}")
+    print(f"  {summary_path}")
+    if genome_track:
+        print(f"  {track_path}")
+    print("Done.\n")
+
+
+def depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path, jobs=1, genome_track=False):
     """
     Analyse depth profiles across a set of amplicons
 
@@ -22,6 +143,7 @@ def depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path):
     print(f"  Configuration path: {config}")
     print(f"  Amplicon BED file: {amplicon_bed_path}")
     print(f"  CDS BED file: {cds_bed_path}")
+    print(f"  Genome-wide track: {genome_track}")
     print("Done.")
     print("")
 
@@ -34,98 +156,11 @@ def depth(expt_dir, config, barcode, amplicon_bed_path, cds_bed_path):
         params["barcodes"] = [params["focus_barcode"]]
 
     # Iterate over barcodes
-    for barcode in params["barcodes"]:
-
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # Define relevant paths
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        bam_file = f"{barcode}.{reference.name}.final.sorted.bam"
-        bam_path = f"{barcode_dir}/bams/{bam_file}"
-        depth_dir = produce_dir(barcode_dir, script_dir)
-        depth_path = f"{depth_dir}/{bam_file.replace('.bam','.depth')}"
-
-        # Compute depths
-        print("Computing depths...")
-        samtools_depth(
-            input_bam=bam_path, region_bed=amplicon_bed_path, output_path=depth_path
-        )
-
-        # Load and convert to bed, for merging
-        depth_df = pd.read_csv(depth_path, sep="\t", names=["chrom", "start", "depth"])
-        depth_df.insert(2, "end", depth_df["start"] + 1)
-        depth_bed_path = f"{depth_path}.bed"
-        write_gff_to_bed(
-            df=depth_df,
-            bed_path=depth_bed_path,
-            bed_columns=["chrom", "start", "end", "depth"],
-        )
-        print(f"  Total bases covered: {depth_df.shape[0]}bp")
-        print(f"  Average depth: {depth_df['depth'].mean():.2f}")
-
-        # Merge with amplicons
-        print("Annotating amplicons...")
-        depth_annotate_path = depth_bed_path.replace(".bed", ".amplicon.bed")
-        bedtools_intersect(
-            input_a=depth_bed_path,
-            input_b=amplicon_bed_path,
-            args="-wa -wb",
-            output=depth_annotate_path,
-        )
-
-        # Merge with CDS
-        print("Annotating CDS...")
-        depth_annotate_cds_path = depth_bed_path.replace(".bed", ".amplicon.cds.bed")
-        bedtools_intersect(
-            input_a=depth_annotate_path,
-            input_b=cds_bed_path,
-            args="-wa -wb -loj",
-            output=depth_annotate_cds_path,
-        )
-        # Clean for space
-        os.remove(depth_annotate_path)
-        os.remove(depth_bed_path)
-
-        # Create summary table
-        complete_df = pd.read_csv(
-            depth_annotate_cds_path,
-            sep="\t",
-            names=[
-                "chrom",
-                "start",
-                "end",
-                "depth",
-                "amp_chrom",
-                "amp_start",
-                "amp_end",
-                "amp_target_id",
-                "cds_chrom",
-                "cds_start",
-                "cds_end",
-                "cds_target_id",
-            ],
-        )
-        summary_df = (
-            complete_df.groupby("cds_target_id")
-            .agg(
-                n_bases=pd.NamedAgg("depth", len),
-                mean_depth=pd.NamedAgg("depth", np.mean),
-                median_depth=pd.NamedAgg("depth", np.median),
-                frac_below_1X=pd.NamedAgg("depth", lambda x: sum(x <= 0) / len(x)),
-                frac_below_10X=pd.NamedAgg("depth", lambda x: sum(x <= 10) / len(x)),
-                frac_below_20X=pd.NamedAgg("depth", lambda x: sum(x <= 20) / len(x)),
-            )
-            .reset_index()
-        )
-        summary_df.insert(0, "barcode", barcode)
-        summary_path = f"{depth_dir}/table.{barcode}.depth_summary.csv"
-        summary_df.to_csv(summary_path, index=False)
-
-        print("Outputs written to:")
-        print(f" {depth_path}")
-        print(f" {depth_annotate_cds_path}")
-        print(f"  {summary_path}")
-        print("Done.\n")
+    run_barcodes(
+        depth_barcode,
+        params["barcodes"],
+        args=(params, script_dir, reference, amplicon_bed_path, cds_bed_path, genome_track),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/depth",
+    )
     print_footer(t0)
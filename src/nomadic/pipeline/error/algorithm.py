@@ -3,6 +3,7 @@ from nomadic.lib.process_gffs import load_gff, add_gff_fields
 from nomadic.lib.process_bams import samtools_mpileup
 from .bed import TargetBEDBuilder
 from .summarise import create_basecall_dfs
+from .counts import create_basecall_dfs_from_bam
 
 
 class ErrorAnalysisAlgorithm:
@@ -14,6 +15,7 @@ class ErrorAnalysisAlgorithm:
         """
         self.reference = reference
         self.output_dir = output_dir
+        self.bed_path = None
 
     def load_gff(self): # Needed here?
         self.gff_df = load_gff(self.reference.gff_path)
@@ -73,6 +75,46 @@ class ErrorAnalysisAlgorithm:
         """
         return create_basecall_dfs(self.pileup_path)
 
+    def summarise_target(self, bam_path):
+        """
+        Create mutation and indel data frames for the target from `bam_path`
+
+        """
+        self.create_target_mpileup(bam_path=bam_path)
+        return self.get_mpileup_summary()
+
+
+class PysamErrorAnalysisAlgorithm(ErrorAnalysisAlgorithm):
+    """
+    Count basecalls directly from the target .bam with pysam, rather
+    than writing and parsing a `samtools mpileup` file
+
+    """
+
+    def summarise_target(self, bam_path):
+        """
+        Create mutation and indel data frames for the target from `bam_path`
+
+        """
+        if self.bed_path is None:
+            raise ValueError("No BED file is defined.")
+
+        if not os.path.isfile(bam_path):
+            raise FileNotFoundError(f"No .bam file found at {bam_path}. Check path.")
+        self.bam_path = bam_path
+
+        return create_basecall_dfs_from_bam(
+            input_bam=self.bam_path,
+            fasta_path=self.reference.fasta_path,
+            bed_path=self.bed_path,
+        )
+
+
+algorithm_collection = {
+    "mpileup": ErrorAnalysisAlgorithm,
+    "pysam": PysamErrorAnalysisAlgorithm,
+}
+
 
 
 
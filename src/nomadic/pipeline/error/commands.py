@@ -9,26 +9,64 @@
 # summarise in .csv
 
 import click
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import PlasmodiumFalciparum3D7
 from nomadic.lib.process_gffs import load_gff, add_gff_fields
-from .algorithm import ErrorAnalysisAlgorithm
+from .algorithm import algorithm_collection
 from .bed import ByProteinCodingGene
 
 
+def error_barcode(barcode, params, script_dir, reference, approach, bed_builder):
+    """
+    Characterise differences from the reference genome in
+    the reads of each target, for a single barcode
+
+    """
+
+    # Define output directory, initiate algorithm
+    output_dir = produce_dir(params['barcodes_dir'], barcode, script_dir)
+    algorithm = algorithm_collection[approach](
+        reference=reference, output_dir=output_dir
+    )
+
+    # ITERATE over targets
+    for target_id, target_name in params["name_dt"].items():
+        print(f"  Target: {target_id} = {target_name}")
+
+        # Run algorithm to produce summary data rfames
+        bam_path = f"{params['barcodes_dir']}/{barcode}/target-extraction/reads.target.{target_name}.bam"
+        algorithm.set_target(target_id)
+        algorithm.create_target_bed(bed_builder)
+        mutation_df, indel_df = algorithm.summarise_target(bam_path=bam_path)
+
+        # Annotate
+        mutation_df.insert(0, "ID", target_id)
+        mutation_df.insert(1, "gene_name", params["name_dt"][target_id])
+        indel_df.insert(0, "ID", target_id)
+        indel_df.insert(1, "gene_name", params["name_dt"][target_id])
+
+        # Save
+        mutation_df.to_csv(f"{output_dir}/{target_id}.nt_error.csv")
+        indel_df.to_csv(f"{output_dir}/{target_id}.indel_lengths.csv")
+
+
 @click.command(short_help="Characterise error rate.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-a",
     "--approach",
-    type=str, # will be from choices
-    #required=True,
-    help="Variant calling method to use.",
+    type=click.Choice(algorithm_collection),
+    default="mpileup",
+    show_default=True,
+    required=False,
+    help="Method used to count basecalls; 'pysam' avoids writing .mpileup files.",
 )
-def error(expt_dir, config, barcode, approach):
+def error(expt_dir, config, barcode, jobs, approach):
     # PARSE INPUTS
     script_descrip = "NOMADIC: Characterise all differences from the reference genome"
     t0 = print_header(script_descrip)
@@ -60,35 +98,14 @@ def error(expt_dir, config, barcode, approach):
 
     # ITERATE over barcodes
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # Define output directory, initiate algorithm
-        output_dir = produce_dir(params['barcodes_dir'], barcode, script_dir)
-        algorithm = ErrorAnalysisAlgorithm(reference=reference, output_dir=output_dir)
-
-        # ITERATE over targets
-        for target_id, target_name in params["name_dt"].items():
-            print(f"  Target: {target_id} = {target_name}")
-
-            # Run algorithm to produce summary data rfames
-            bam_path = f"{params['barcodes_dir']}/{barcode}/target-extraction/reads.target.{target_name}.bam"
-            algorithm.set_target(target_id)
-            algorithm.create_target_bed(bed_builder)
-            algorithm.create_target_mpileup(bam_path=bam_path)
-            mutation_df, indel_df = algorithm.get_mpileup_summary()
-
-            # Annotate
-            mutation_df.insert(0, "ID", target_id)
-            mutation_df.insert(1, "gene_name", params["name_dt"][target_id])
-            indel_df.insert(0, "ID", target_id)
-            indel_df.insert(1, "gene_name", params["name_dt"][target_id])
-            
-            # Save
-            mutation_df.to_csv(algorithm.pileup_path.replace(".mpileup", ".nt_error.csv"))
-            indel_df.to_csv(algorithm.pileup_path.replace(".mpileup", ".indel_lengths.csv"))
+    run_barcodes(
+        error_barcode,
+        params["barcodes"],
+        args=(params, script_dir, reference, approach, bed_builder),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/error",
+    )
+    print_footer(t0)
 
 
 
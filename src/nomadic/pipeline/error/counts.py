@@ -0,0 +1,188 @@
+import pysam
+import numpy as np
+import pandas as pd
+
+
+# ================================================================
+# Count basecalls directly from a .bam file with pysam
+#
+# ================================================================
+
+
+# Symbols counted at each position, as in `create_basecall_dfs()`
+NT_SYMBOLS = ["A", "T", "C", "G", "-", "+"]
+
+# Reads skipped by `samtools mpileup` by default;
+# unmapped, secondary, QC fail and duplicate
+EXCLUDE_FLAGS = 0x704
+
+# CIGAR operations
+ALIGNED_OPS = (0, 7, 8)  # M, =, X
+INSERTION_OP = 1
+DELETION_OP = 2
+REF_SKIP_OP = 3
+
+
+def count_region_basecalls(bam, chrom, start, end):
+    """
+    Count basecalls at every position of a region of an opened
+    `bam` file, by strand, in the same way they are counted from
+    a `samtools mpileup` string by `tokenize_pileups()`
+
+    params
+        bam: pysam.AlignmentFile
+        chrom: str
+        start: int
+            0-based start of the region.
+        end: int
+            0-based, exclusive, end of the region.
+    returns
+        counts: ndarray, int, shape (n_positions, 6, 2)
+            Count of each of `NT_SYMBOLS` at each position, for reads
+            on the forward (0) and reverse (1) strand. Deletions are
+            counted at every deleted position; insertions at the
+            position preceding them.
+        n_other: ndarray, int, shape (n_positions, )
+            Count of aligned bases other than A, C, G or T, e.g. N.
+        indel_ixs: ndarray, int, shape (n_indels, )
+            Index of the position preceding each indel.
+        indel_lengths: ndarray, int, shape (n_indels, )
+            Length of each indel; insertions are positive and
+            deletions negative.
+
+    """
+
+    n_positions = end - start
+    counts = np.zeros((n_positions, len(NT_SYMBOLS), 2), dtype="int64")
+
+    # Aligned bases by strand, computed within htslib
+    for strand, is_reverse in enumerate([False, True]):
+        acgt = bam.count_coverage(
+            chrom,
+            start,
+            end,
+            quality_threshold=0,
+            read_callback=lambda read: not (read.flag & EXCLUDE_FLAGS)
+            and read.is_reverse == is_reverse,
+        )
+        for nt, nt_counts in zip("ACGT", acgt):
+            counts[:, NT_SYMBOLS.index(nt), strand] = nt_counts
+
+    # Walk CIGAR strings for aligned, deleted and inserted positions;
+    # ranges are accumulated as differences and summed at the end
+    aligned_diff = np.zeros(n_positions + 1, dtype="int64")
+    deleted_diff = np.zeros((n_positions + 1, 2), dtype="int64")
+    indel_ixs = []
+    indel_lengths = []
+
+    def add_range(diff, range_start, range_end, *strand):
+        range_start = min(max(range_start - start, 0), n_positions)
+        range_end = min(max(range_end - start, 0), n_positions)
+        if range_start < range_end:
+            diff[(range_start, *strand)] += 1
+            diff[(range_end, *strand)] -= 1
+
+    for read in bam.fetch(chrom, start, end):
+        if read.flag & EXCLUDE_FLAGS:
+            continue
+        strand = int(read.is_reverse)
+        ref_pos = read.reference_start
+        has_aligned = False
+        for op, length in read.cigartuples:
+            if op in ALIGNED_OPS:
+                add_range(aligned_diff, ref_pos, ref_pos + length)
+                ref_pos += length
+                has_aligned = True
+            elif op == DELETION_OP:
+                if has_aligned and start <= ref_pos - 1 < end:
+                    indel_ixs.append(ref_pos - 1 - start)
+                    indel_lengths.append(-length)
+                add_range(deleted_diff, ref_pos, ref_pos + length, strand)
+                ref_pos += length
+            elif op == INSERTION_OP:
+                if has_aligned and start <= ref_pos - 1 < end:
+                    indel_ixs.append(ref_pos - 1 - start)
+                    indel_lengths.append(length)
+                    counts[ref_pos - 1 - start, NT_SYMBOLS.index("+"), strand] += 1
+            elif op == REF_SKIP_OP:
+                ref_pos += length
+
+    counts[:, NT_SYMBOLS.index("-"), :] = np.cumsum(deleted_diff[:-1], axis=0)
+    n_aligned = np.cumsum(aligned_diff[:-1])
+    n_other = n_aligned - counts[:, :4, :].sum(axis=(1, 2))
+
+    return (
+        counts,
+        n_other,
+        np.array(indel_ixs, dtype="int64"),
+        np.array(indel_lengths, dtype="int64"),
+    )
+
+
+def create_basecall_dfs_from_bam(input_bam, fasta_path, bed_path):
+    """
+    Create data frames of all the basecalls by position, for
+    every region in `bed_path`, counting directly from `input_bam`
+
+    Produces the same tables as `create_basecall_dfs()` does
+    from a `samtools mpileup -aa` of the same regions.
+
+    """
+
+    bed_df = pd.read_csv(bed_path, sep="\t", header=None, usecols=[0, 1, 2])
+
+    mutation_dfs = []
+    indel_dfs = []
+    with pysam.AlignmentFile(input_bam, "rb") as bam, pysam.FastaFile(
+        fasta_path
+    ) as fasta:
+        for chrom, start, end in bed_df.itertuples(index=False):
+            counts, n_other, indel_ixs, indel_lengths = count_region_basecalls(
+                bam, chrom, start, end
+            )
+            positions = np.arange(start + 1, end + 1)
+            refs = np.array(list(fasta.fetch(chrom, start, end)), dtype=object)
+
+            # Get nucleotide frequencies
+            nt_frequencies = counts.sum(axis=2)
+            ref_counts = np.zeros(len(positions), dtype="int64")
+            for j, nt in enumerate(NT_SYMBOLS[:4]):
+                ref_counts += np.where(refs == nt, nt_frequencies[:, j], 0)
+            ref_counts += np.where(np.isin(refs, NT_SYMBOLS[:4]), 0, n_other)
+
+            # Compute summary statistics
+            coverage = n_other + nt_frequencies[:, :5].sum(axis=1)
+            calls = n_other + nt_frequencies.sum(axis=1)
+            error = calls - ref_counts
+            snv = error - nt_frequencies[:, 4] - nt_frequencies[:, 5]
+
+            mutation_df = pd.DataFrame(
+                {
+                    "position": positions,
+                    "ref": refs,
+                    "coverage": coverage,
+                    "calls": calls,
+                    "SNV": snv,
+                    "error": error,
+                }
+            )
+            for j, nt in enumerate(NT_SYMBOLS):
+                mutation_df[nt] = nt_frequencies[:, j]
+            mutation_dfs.append(mutation_df)
+
+            # Insertions precede deletions at each position
+            order = np.lexsort((indel_lengths < 0, indel_ixs))
+            indel_dfs.append(
+                pd.DataFrame(
+                    {
+                        "position": positions[indel_ixs[order]],
+                        "ref": refs[indel_ixs[order]],
+                        "length": indel_lengths[order],
+                    }
+                )
+            )
+
+    return (
+        pd.concat(mutation_dfs, ignore_index=True),
+        pd.concat(indel_dfs, ignore_index=True),
+    )
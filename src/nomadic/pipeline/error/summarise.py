@@ -1,6 +1,6 @@
 import re
+import numpy as np
 import pandas as pd
-from collections import Counter
 
 
 def get_indels(pileup):
@@ -72,66 +72,296 @@ def process_mpileup(pileup, ref):
     return pileup
 
 
-def create_basecall_dfs(input_pileup):
+# ================================================================
+# Tokenize pileups in a single pass over their bytes
+#
+# ================================================================
+
+
+# Bases that can make up an indel sequence
+IS_INDEL_BASE = np.zeros(256, dtype=bool)
+IS_INDEL_BASE[np.frombuffer(b"ATCGatcg", "uint8")] = True
+
+IS_DIGIT = np.zeros(256, dtype=bool)
+IS_DIGIT[ord("0") : ord("9") + 1] = True
+
+IS_SIGN = np.zeros(256, dtype=bool)
+IS_SIGN[np.frombuffer(b"+-", "uint8")] = True
+
+# Characters of reads on the reverse strand
+IS_REVERSE = np.zeros(256, dtype=bool)
+IS_REVERSE[ord("a") : ord("z") + 1] = True
+IS_REVERSE[np.frombuffer(b",#", "uint8")] = True
+
+# Separates pileups that are tokenized together
+PILEUP_SEP = ord("\n")
+
+
+def _expand_ranges(starts, lengths):
+    """Get all positions within ranges given by `starts` and `lengths`"""
+
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return np.repeat(starts, lengths) + offsets
+
+
+def _get_read_start_markers(pileup_bytes):
     """
-    Create data frames of all the basecalls by position
+    Get positions of read start markers (^), which are followed
+    by a mapping quality character that may itself be a ^
+
+    """
+
+    carets = np.flatnonzero(pileup_bytes == ord("^"))
+
+    # Within a run of consecutive carets, every other one is a marker
+    is_run_start = np.r_[True, np.diff(carets) != 1]
+    run_starts = np.maximum.accumulate(np.where(is_run_start, np.arange(len(carets)), 0))
+    carets = carets[(np.arange(len(carets)) - run_starts) % 2 == 0]
+
+    # A marker must be followed by its mapping quality
+    carets = carets[carets + 1 < len(pileup_bytes)]
+
+    return carets[pileup_bytes[carets + 1] != PILEUP_SEP]
 
 
+def _get_indel_tokens(pileup_bytes, mapq_positions):
     """
+    Find indel tokens, r"[+-]\d+", and whether each is followed by
+    a complete sequence of indel bases, as matched in `process_mpileup()`
 
-    nt_symbols = ["A", "T", "C", "G", "-", "+"]
+    returns
+        starts: ndarray, int, shape (n_indels, )
+            Position of the +/- of each token.
+        sizes: ndarray, int, shape (n_indels, )
+            Indel size given by the token.
+        ends: ndarray, int, shape (n_indels, )
+            Position after the indel sequence of each token.
+        is_complete: ndarray, bool, shape (n_indels, )
+
+    """
+
+    n = len(pileup_bytes)
+    starts = np.flatnonzero(IS_SIGN[pileup_bytes])
+    starts = starts[starts + 1 < n]
+    starts = starts[IS_DIGIT[pileup_bytes[starts + 1]]]
+    starts = np.setdiff1d(starts, mapq_positions, assume_unique=True)
+
+    # Parse the digits following each sign
+    sizes = np.zeros(len(starts), dtype="int64")
+    n_digits = np.zeros(len(starts), dtype="int64")
+    active = np.ones(len(starts), dtype=bool)
+    while active.any():
+        q = starts + 1 + n_digits
+        active &= q < n
+        active[active] = IS_DIGIT[pileup_bytes[q[active]]]
+        sizes[active] = 10 * sizes[active] + pileup_bytes[q[active]] - ord("0")
+        n_digits[active] += 1
+
+    seq_starts = starts + 1 + n_digits
+    ends = seq_starts + sizes
+    is_complete = ends <= n
+
+    # Check the indel sequence is made up only of indel bases; this
+    # also stops sequences running into the next pileup
+    n_bases = np.r_[0, np.cumsum(IS_INDEL_BASE[pileup_bytes])]
+    is_complete &= (
+        n_bases[np.minimum(ends, n)] - n_bases[np.minimum(seq_starts, n)] == sizes
+    )
+
+    return starts, sizes, ends, is_complete
 
-    # Prepare storage
-    mutation_dt = {
-        "position": [],
-        "ref": [],
-        "coverage": [],  # Insertions not counted
-        "calls": [],  # Insertions are counted
-        "SNV": [],
-        "error": [],
-    }
-    mutation_dt.update({k: [] for k in nt_symbols})
 
-    indel_dt = {"position": [], "ref": [], "length": []}
+def tokenize_pileups(pileups, refs):
+    """
+    Tokenize a batch of read pileups from `samtools mpileup`, counting
+    the characters produced by `process_mpileup()` and finding the
+    indels returned by `get_indels()`, for each pileup
+
+    All pileups are joined and every character is counted in a single
+    pass; read start and end markers and indel tokens are then
+    discounted, at a cost that scales with their number.
+
+    params
+        pileups: list of str, shape (n_pileups, )
+            Strings giving all nucleotides mapped to a specific
+            position, with characters defined by
+            `samtools mpileup`.
+        refs: list of str, shape (n_pileups, )
+            Reference base at the position of each pileup.
+    returns
+        counts: ndarray, int, shape (n_pileups, 2, 256)
+            Count of each character of each processed pileup,
+            by its byte value, for reads on the forward (0)
+            and reverse (1) strand.
+        indel_pileups: ndarray, int, shape (n_indels, )
+            Index of the pileup of each indel.
+        indels: ndarray, int, shape (n_indels, )
+            Sizes of all indels; within each pileup, insertions,
+            which are positive, precede deletions.
+
+    """
 
+    n_pileups = len(pileups)
+    pileup_bytes = np.frombuffer(
+        "\n".join(pileups).encode("latin-1"), dtype="uint8"
+    )
+    lengths = np.array([len(pileup) for pileup in pileups], dtype="int64")
+    pileup_ixs = np.repeat(np.arange(n_pileups, dtype="int32"), lengths + 1)
+    pileup_ixs = pileup_ixs[: len(pileup_bytes)]
+
+    def count(ixs):
+        return np.bincount(
+            256 * pileup_ixs[ixs] + pileup_bytes[ixs], minlength=256 * n_pileups
+        ).reshape(n_pileups, 256)
+
+    # Count all characters; separators fall in column 10, which is dropped
+    counts = np.bincount(
+        256 * pileup_ixs + pileup_bytes, minlength=256 * n_pileups
+    ).reshape(n_pileups, 256)
+    counts[:, PILEUP_SEP] = 0
+
+    # Discount read starts, with their mapping qualities, and read ends
+    markers = _get_read_start_markers(pileup_bytes)
+    counts -= count(markers)
+    counts -= count(markers + 1)
+    counts[:, ord("$")] = 0
+
+    # Discount indel tokens; complete insertions are kept only as their +
+    starts, sizes, ends, is_complete = _get_indel_tokens(pileup_bytes, markers + 1)
+    is_insert = pileup_bytes[starts] == ord("+")
+    remove_from = np.where(is_insert, starts + 1, starts)[is_complete]
+    counts -= count(_expand_ranges(remove_from, ends[is_complete] - remove_from))
+
+    # Split by strand; insertion strand is given by their sequence
+    counts = np.stack([counts * ~IS_REVERSE, counts * IS_REVERSE], axis=1)
+    is_kept_insert = is_complete & is_insert
+    n_reverse_inserts = np.bincount(
+        pileup_ixs[starts[is_kept_insert]],
+        weights=IS_REVERSE[pileup_bytes[(ends - sizes)[is_kept_insert]]],
+        minlength=n_pileups,
+    ).astype("int64")
+    counts[:, 0, ord("+")] -= n_reverse_inserts
+    counts[:, 1, ord("+")] += n_reverse_inserts
+
+    # Translate to upper case, matches to the reference, and * to -
+    counts[:, :, ord("A") : ord("Z") + 1] += counts[:, :, ord("a") : ord("z") + 1]
+    counts[:, :, ord("a") : ord("z") + 1] = 0
+    for j, ref in enumerate(refs):
+        if len(ref) == 1 and ord(ref.upper()) < 256:
+            counts[j, :, ord(ref.upper())] += counts[j, :, [ord("."), ord(",")]].sum(0)
+    counts[:, :, [ord("."), ord(",")]] = 0
+    counts[:, :, ord("-")] += counts[:, :, ord("*")]
+    counts[:, :, ord("*")] = 0
+
+    # Order indels by pileup, then insertions before deletions
+    indel_pileups = pileup_ixs[starts]
+    order = np.lexsort((starts, ~is_insert, indel_pileups))
+    indels = np.where(is_insert, sizes, -sizes)
+
+    return counts, indel_pileups[order], indels[order]
+
+
+def tokenize_pileup(pileup, ref):
+    """
+    Tokenize a single read pileup, as in `tokenize_pileups()`
+
+    returns
+        counts: ndarray, int, shape (2, 256)
+        indels: ndarray, int, shape (n_indels, )
+
+    """
+
+    counts, _, indels = tokenize_pileups([pileup], [ref])
+
+    return counts[0], indels
+
+
+def _iter_line_chunks(fn, chunk_bytes):
+    """Iterate over chunks of lines from `fn`, of about `chunk_bytes` each"""
+
+    lines = []
+    n_bytes = 0
+    for line in fn:
+        lines.append(line)
+        n_bytes += len(line)
+        if n_bytes >= chunk_bytes:
+            yield lines
+            lines = []
+            n_bytes = 0
+    if lines:
+        yield lines
+
+
+def create_basecall_dfs(input_pileup, chunk_bytes=2**23):
+    """
+    Create data frames of all the basecalls by position
+
+    Pileups are tokenized together in chunks of about `chunk_bytes`,
+    and counts for each chunk are computed as arrays.
+
+    """
+
+    nt_symbols = ["A", "T", "C", "G", "-", "+"]
+    nt_codes = [ord(nt) for nt in nt_symbols]
+
+    mutation_dfs = []
+    indel_dfs = []
     with open(input_pileup, "r") as fn:
-        for i, line in enumerate(fn):
+        for lines in _iter_line_chunks(fn, chunk_bytes):
 
-            # Prepare pileup
-            chrom, pos, ref, coverage, pileup, _ = line.split("\t")
-            processed_pileup = process_mpileup(pileup, ref)
+            # Prepare pileups
+            fields = [line.split("\t") for line in lines]
+            refs = np.array([f[2] for f in fields], dtype=object)
+            counts, indel_ixs, indels = tokenize_pileups([f[4] for f in fields], refs)
 
             # Get nucleotide frequencies in pileup
-            nt_frequencies = Counter(processed_pileup)
+            nt_frequencies = counts.sum(axis=1)
+            ref_codes = np.array(
+                [ord(r) if len(r) == 1 and ord(r) < 256 else -1 for r in refs]
+            )
 
             # Compute summary statistics
-            calls = sum([count for nt, count in nt_frequencies.items()])
-            error = sum([count for nt, count in nt_frequencies.items() if nt != ref])
-            snv = sum(
-                [
-                    count
-                    for nt, count in nt_frequencies.items()
-                    if nt != ref and not nt in ["+", "-"]
-                ]
+            calls = nt_frequencies.sum(axis=1)
+            error = calls - np.where(
+                ref_codes >= 0, nt_frequencies[np.arange(len(lines)), ref_codes], 0
             )
+            snv = error.copy()
+            for nt in ["+", "-"]:
+                snv -= np.where(refs != nt, nt_frequencies[:, ord(nt)], 0)
 
             # Store
-            mutation_dt["position"].append(int(pos))
-            mutation_dt["ref"].append(ref)
-            mutation_dt["coverage"].append(int(coverage))
-            mutation_dt["calls"].append(calls)
-            mutation_dt["SNV"].append(snv)
-            mutation_dt["error"].append(error)
-            for k in nt_symbols:
-                mutation_dt[k].append(nt_frequencies[k])
-
-            # Get indel lengths
-            indels = get_indels(pileup)
-            n_indels = len(indels)
+            positions = np.array([int(f[1]) for f in fields], dtype="int64")
+            mutation_df = pd.DataFrame(
+                {
+                    "position": positions,
+                    "ref": refs,
+                    "coverage": np.array([int(f[3]) for f in fields], dtype="int64"),
+                    "calls": calls,
+                    "SNV": snv,
+                    "error": error,
+                }
+            )
+            for nt, code in zip(nt_symbols, nt_codes):
+                mutation_df[nt] = nt_frequencies[:, code]
+            mutation_dfs.append(mutation_df)
 
-            # Store
-            indel_dt["position"].extend([int(pos)] * n_indels)
-            indel_dt["ref"].extend([ref] * n_indels)
-            indel_dt["length"].extend(indels)
+            # Store indel lengths
+            indel_dfs.append(
+                pd.DataFrame(
+                    {
+                        "position": positions[indel_ixs],
+                        "ref": refs[indel_ixs],
+                        "length": indels,
+                    }
+                )
+            )
+
+    if not mutation_dfs:
+        columns = ["position", "ref", "coverage", "calls", "SNV", "error"] + nt_symbols
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=["position", "ref", "length"])
+
+    mutation_df = pd.concat(mutation_dfs, ignore_index=True)
+    indel_df = pd.concat(indel_dfs, ignore_index=True)
 
-    return pd.DataFrame(mutation_dt), pd.DataFrame(indel_dt)
+    return mutation_df, indel_df
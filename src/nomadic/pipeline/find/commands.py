@@ -5,7 +5,7 @@ from nomadic.lib.parsing import build_parameter_dict
 from nomadic.lib.references import PlasmodiumFalciparum3D7
 from nomadic.pipeline.cli import experiment_options
 from nomadic.pipeline.calling.callers import caller_collection
-from nomadic.pipeline.find.gene import Gene
+from nomadic.pipeline.find.gene import GeneModelStore
 from nomadic.pipeline.find.vcf import load_vcf_using_allel
 from nomadic.pipeline.find.plot import MutationPanelPlot
 
@@ -45,13 +45,16 @@ def find(expt_dir, config, method):
     resistance_df = params["mutations"]
     resistance_df["resistance"] = True
 
-    # Create gene set based on targets
-    gene_set = {}
+    # Create gene set based on targets, reusing cached gene models
+    gene_store = GeneModelStore.from_reference(reference)
+    if gene_store.load():
+        print(f"Loaded cached gene models from: {gene_store.cache_path}")
     for target_id in params["target_ids"]:
-        print(f"Creating gene {target_id}.")
-        gene = Gene(gff_path=reference.gff_path, fasta_path=reference.fasta_path)
-        gene.set_gene_id(target_id)
-        gene_set[target_id] = gene
+        if target_id not in gene_store.genes:
+            print(f"Creating gene {target_id}.")
+    gene_set = gene_store.get_genes(params["target_ids"])
+    gene_store.save()
+    gene_store.close()
 
     # ITERATE over barcodes
     overall_results = []
@@ -73,12 +76,12 @@ def find(expt_dir, config, method):
             focus_gene = gene_set[target_id]
 
             # Label all mutations
-            mutations = [
-                focus_gene.query_for_mutation(
-                    chrom=row["chrom"], pos=row["pos"], ref=row["ref"], alt=row["alt"]
-                )
-                for _, row in vcf_df.iterrows()
-            ]
+            mutations = focus_gene.query_for_mutations(
+                chroms=vcf_df["chrom"].values,
+                positions=vcf_df["pos"].values,
+                refs=vcf_df["ref"].values,
+                alts=vcf_df["alt"].values,
+            )
 
             # Insert new column
             vcf_df.insert(0, "mutation", mutations)
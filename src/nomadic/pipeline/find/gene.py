@@ -1,5 +1,11 @@
+import os
+import pickle
 import pysam
+import numpy as np
+from itertools import product
 import pandas as pd
+from nomadic.lib.generic import get_file_signature
+from nomadic.lib.process_gffs import extract_gff_attributes
 
 
 class Gene:
@@ -76,10 +82,18 @@ class Gene:
         "TGG": "W",
     }
 
-    def __init__(self, gff_path, fasta_path):
+    def __init__(self, gff_path, fasta_path, gff=None, fasta=None):
+        """
+        A `gff` data frame, as produced by `_load_gff()` and `_add_gff_fields()`,
+        and an open pysam.FastaFile `fasta` can be passed to share them
+        across genes; otherwise they are loaded from `gff_path` and `fasta_path`
+
+        """
 
-        self.gff = self._load_gff(gff_path)
-        self.gff = self._add_gff_fields(self.gff)
+        if gff is None:
+            gff = self._add_gff_fields(self._load_gff(gff_path))
+        self.gff = gff
+        self.fasta = fasta
         self.fasta_path = fasta_path
         self.gene_id = None
 
@@ -94,6 +108,10 @@ class Gene:
         self.codon_nts = None
         self.codon_aas = None
 
+        self.lookup_start = None
+        self.codon_lookup = None
+        self.codon_bases = None
+
     @staticmethod
     def _load_gff(gff_path):
         """Load .gff file into a dataframe"""
@@ -132,28 +150,17 @@ class Gene:
     def _add_gff_fields(gff):
         """Add name, ID, and description fields to gff data frame"""
 
-        # Fields
-        name = []
-        parent = []
-        ID = []
-        descrip = []
-        fields = [name, parent, ID, descrip]
-
-        # Tags
-        tags = ["Name=", "Parent=", "ID=", "description="]
+        # Fields and their tags
+        fields = {"name": "Name", "parent": "Parent", "ID": "ID", "descrip": "description"}
 
-        # Iterate over rows, extract new fields
-        for ix, row in gff.iterrows():
-            attributes = row["attribute"].split(";")
-            for field, tag in zip(fields, tags):
-                r = [a.replace(tag, "") for a in attributes if a.startswith(tag)]
-                field.extend(r if r else [None])
+        # Extract all tags in one pass over the attributes
+        attributes = extract_gff_attributes(
+            gff.rename(columns={"attribute": "attributes"}), fields=list(fields.values())
+        )
 
         # Add new fields to data frame
-        gff["name"] = name
-        gff["parent"] = parent
-        gff["ID"] = ID
-        gff["descrip"] = descrip
+        for field, tag in fields.items():
+            gff[field] = attributes[tag].tolist()
 
         return gff
 
@@ -190,13 +197,9 @@ class Gene:
     def _create_gene_coding_table(self):
         """Create a table of coding regions from the .gff"""
 
-        ixs = [
-            ix
-            for ix, p in self.gff["parent"].iteritems()
-            if p and p.startswith(self.gene_id)
-        ]
+        is_child = self.gff["parent"].str.startswith(self.gene_id, na=False)
 
-        self.cds_table = self.gff.loc[ixs].query("feature == 'CDS'")
+        self.cds_table = self.gff.loc[is_child].query("feature == 'CDS'")
         self.strand = str(self.cds_table.iloc[0]["strand"])
         self.chrom = str(self.cds_table.iloc[0]["seqname"])
 
@@ -209,19 +212,21 @@ class Gene:
 
         """
 
-        # Get nucleotide sequence
+        # Get nucleotide sequence, from a single open .fasta
+        fasta = self.fasta if self.fasta is not None else pysam.FastaFile(self.fasta_path)
         self.coding_sequence = ""
         self.positions = []
         for _, row in self.cds_table.iterrows():
 
-            self.coding_sequence += self._load_haplotype_from_fasta(
-                self.fasta_path,
+            self.coding_sequence += fasta.fetch(
                 reference=row["seqname"],
                 start=row["start"] - 1,
                 end=row["end"],
             )
 
             self.positions.extend(list(range(row["start"], row["end"] + 1)))
+        if self.fasta is None:
+            fasta.close()
         self.L = len(self.coding_sequence)
 
         # Reverse compliment, if necessaray
@@ -244,8 +249,65 @@ class Gene:
         assert self.codon_aas[0] == "M"
         assert self.codon_aas[-1] == "_"
 
+        self._create_codon_lookup()
+
         return None
 
+    def _create_codon_lookup(self):
+        """
+        Create arrays to look up the codon number and offset within
+        the codon of any position in the gene, and the bases of each codon
+
+        """
+
+        n_codons = len(self.codon_nts)
+        positions = np.array(self.positions[: 3 * n_codons])
+        seq_ixs = np.arange(3 * n_codons)
+
+        # Positions outside of complete codons are -1
+        self.lookup_start = positions.min()
+        self.codon_lookup = np.full((positions.max() - self.lookup_start + 1, 2), -1)
+        self.codon_lookup[positions - self.lookup_start, 0] = seq_ixs // 3
+        self.codon_lookup[positions - self.lookup_start, 1] = seq_ixs % 3
+
+        self.codon_bases = np.frombuffer(
+            self.coding_sequence[: 3 * n_codons].encode(), "uint8"
+        ).reshape(n_codons, 3)
+
+        return None
+
+    @classmethod
+    def _translate_codon_bases(cls, codon_bases):
+        """
+        Translate an array of codons, given as ASCII bases of shape
+        (n_codons, 3), into amino acids; unknown codons are None
+
+        """
+
+        # Encode A, C, G, T as 0-3, anything else as 4
+        base_codes = np.full(256, 4, "int64")
+        for code, base in enumerate("ACGT"):
+            base_codes[ord(base)] = code
+        codon_table = np.array(
+            [cls.genetic_code["".join(nts)] for nts in product("ACGT", repeat=3)],
+            dtype=object,
+        )
+
+        codes = base_codes[codon_bases]
+        is_known = (codes < 4).all(axis=1)
+        codon_ixs = codes[:, 0] * 16 + codes[:, 1] * 4 + codes[:, 2]
+
+        return np.where(is_known, codon_table[np.where(is_known, codon_ixs, 0)], None)
+
+    def __getstate__(self):
+        """Exclude the shared .gff and .fasta when pickling"""
+
+        state = self.__dict__.copy()
+        state["gff"] = None
+        state["fasta"] = None
+
+        return state
+
     def get_codon(self, number):
         """Get a codon by its number"""
 
@@ -272,29 +334,201 @@ class Gene:
 
         """
 
-        if not self.chrom == chrom:
-            return None
+        return self.query_for_mutations([chrom], [pos], [ref], [alt])[0]
 
-        if pos not in self.positions:
-            return None
+    def query_for_mutations(self, chroms, positions, refs, alts):
+        """
+        Check a batch of mutations, given as arrays of chromosomes `chroms`,
+        positions `positions`, reference bases `refs` and alternative bases
+        `alts`, as in `query_for_mutation()`
+
+        returns
+            mutations : list, str or None, shape (n_mutations, )
+                Amino-acid level consequence of each mutation, or None if
+                it does not fall within the gene.
 
+        """
+
+        chroms = np.asarray(chroms, dtype=object)
+        positions = np.asarray(positions, dtype="int64")
+        refs = np.asarray(refs, dtype=object)
+        alts = np.asarray(alts, dtype=object)
+
+        # Look up codon number and offset
+        lookup_ixs = positions - self.lookup_start
+        in_span = (
+            (chroms == self.chrom)
+            & (lookup_ixs >= 0)
+            & (lookup_ixs < self.codon_lookup.shape[0])
+        )
+        codons = np.full((len(positions), 2), -1)
+        codons[in_span] = self.codon_lookup[lookup_ixs[in_span]]
+        hits = np.flatnonzero(codons[:, 0] >= 0)
+        ixs, cixs = codons[hits, 0], codons[hits, 1]
+
+        # Bases with respect to the coding strand
+        refs, alts = refs[hits], alts[hits]
         if self.strand == "-":
-            ref = self._reverse_compliment(ref)
-            alt = self._reverse_compliment(alt)
+            refs = np.array([self._reverse_compliment(r) for r in refs], dtype=object)
+            alts = np.array([self._reverse_compliment(a) for a in alts], dtype=object)
+
+        ref_found = self.codon_bases[ixs, cixs].view("S1").astype(str).astype(object)
+        is_mismatch = ref_found != refs
+        if is_mismatch.any():
+            j = np.flatnonzero(is_mismatch)[0]
+            raise AssertionError(
+                f"Found mutation, but expected {refs[j]} and found {ref_found[j]}."
+            )
+
+        # Substitute single alternative bases; others have no known codon
+        alt_bases = np.array(
+            [ord(a) if len(a) == 1 else 0 for a in alts], dtype="uint8"
+        ).reshape(-1)
+        alt_codon_bases = self.codon_bases[ixs].copy()
+        alt_codon_bases[np.arange(len(hits)), cixs] = alt_bases
+
+        ref_aas = np.array(self.codon_aas, dtype=object)[ixs]
+        alt_aas = self._translate_codon_bases(alt_codon_bases)
+
+        mutations = [None] * len(positions)
+        for j, ix, ref_aa, alt_aa in zip(hits, ixs, ref_aas, alt_aas):
+            mutations[j] = f"{ref_aa}{ix+1}{alt_aa}"
+
+        return mutations
+
 
-        ref_found = self.coding_sequence[self.positions.index(pos)]
-        assert (
-            ref_found == ref
-        ), f"Found mutation, but expected {ref} and found {ref_found}."
+class GeneModelStore:
+    """
+    Build `Gene` objects for any set of gene IDs from a single parse of
+    a .gff file and a single open .fasta file
+
+    Built genes can be saved to, and loaded from, a cache on disk that
+    is keyed on the reference release, the modification time and size
+    of the .gff and .fasta files, and `CACHE_VERSION`, such that repeat
+    runs skip their construction entirely.
+
+    """
+
+    # Increment when `Gene` changes, to invalidate pickled genes
+    CACHE_VERSION = 1
+
+    def __init__(self, gff_path, fasta_path, release=None, cache_path=None):
+        self.gff_path = gff_path
+        self.fasta_path = fasta_path
+        self.release = release
+        self.cache_path = cache_path
+
+        self.genes = {}
+        self.n_built = 0
+
+        self._gff = None
+        self._fasta = None
+
+    @classmethod
+    def from_reference(cls, reference):
+        """
+        Initialise from a `Reference`, caching gene models next to its .gff
+
+        """
+
+        return cls(
+            gff_path=reference.gff_path,
+            fasta_path=reference.fasta_path,
+            release=getattr(reference, "release", None),
+            cache_path=f"{os.path.dirname(reference.gff_path)}/{reference.name}.gene_models.pkl",
+        )
+
+    @property
+    def gff(self):
+        """The .gff data frame, parsed once on first use"""
+
+        if self._gff is None:
+            self._gff = Gene._add_gff_fields(Gene._load_gff(self.gff_path))
+
+        return self._gff
+
+    @property
+    def fasta(self):
+        """The .fasta file, opened once on first use"""
+
+        if self._fasta is None:
+            self._fasta = pysam.FastaFile(self.fasta_path)
+
+        return self._fasta
 
-        ix = [j for j, ps in enumerate(self.codon_positions) if pos in ps][0]
-        cix = self.codon_positions[ix].index(pos)
+    def _get_cache_key(self):
+        return {
+            "version": self.CACHE_VERSION,
+            "release": self.release,
+            "gff_path": self.gff_path,
+            "gff_signature": get_file_signature(self.gff_path),
+            "fasta_path": self.fasta_path,
+            "fasta_signature": get_file_signature(self.fasta_path),
+        }
 
-        ref_aa = self.codon_aas[ix]
-        ref_nts = self.codon_nts[ix]
-        alt_nts = list(ref_nts)
-        alt_nts[cix] = alt
-        alt_nts = "".join(alt_nts)
-        alt_aa = self.genetic_code[alt_nts] if alt_nts in self.genetic_code else None
+    def get_gene(self, gene_id):
+        """Get the `Gene` for a `gene_id`, building it if necessary"""
+
+        if gene_id not in self.genes:
+            gene = Gene(
+                gff_path=self.gff_path,
+                fasta_path=self.fasta_path,
+                gff=self.gff,
+                fasta=self.fasta,
+            )
+            gene.set_gene_id(gene_id)
+            self.genes[gene_id] = gene
+            self.n_built += 1
+
+        return self.genes[gene_id]
+
+    def get_genes(self, gene_ids):
+        """Get a dictionary of `Gene` objects keyed by `gene_ids`"""
+
+        return {gene_id: self.get_gene(gene_id) for gene_id in gene_ids}
+
+    def load(self):
+        """
+        Load genes from the cache, if it exists and matches the reference
+
+        returns
+            _ : bool
+                Whether any genes were loaded.
+
+        """
+
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return False
+
+        try:
+            with open(self.cache_path, "rb") as cache:
+                cached = pickle.load(cache)
+        except Exception:
+            return False
+
+        if cached["key"] != self._get_cache_key():
+            return False
+
+        for gene_id, gene in cached["genes"].items():
+            self.genes.setdefault(gene_id, gene)
+
+        return True
+
+    def save(self):
+        """Save all genes to the cache, if any have been built"""
+
+        if self.cache_path is None or self.n_built == 0:
+            return None
+
+        try:
+            with open(self.cache_path, "wb") as cache:
+                pickle.dump({"key": self._get_cache_key(), "genes": self.genes}, cache)
+        except OSError:
+            pass
+
+        return None
 
-        return f"{ref_aa}{ix+1}{alt_aa}"
+    def close(self):
+        if self._fasta is not None:
+            self._fasta.close()
+            self._fasta = None
@@ -0,0 +1,32 @@
+import click
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
+from .genotyper import MIN_DEPTH, MIN_WSAF
+
+
+@click.command(short_help="Genotype known mutations.")
+@experiment_options
+@barcode_option
+@jobs_option
+@click.option(
+    "--min_depth",
+    type=int,
+    default=MIN_DEPTH,
+    show_default=True,
+    help="Minimum number of reads spanning a codon to call its amino acid.",
+)
+@click.option(
+    "--min_wsaf",
+    type=float,
+    default=MIN_WSAF,
+    show_default=True,
+    help="Minimum within-sample allele frequency of a called amino acid.",
+)
+def genotype(expt_dir, config, barcode, jobs, min_depth, min_wsaf):
+    """
+    Genotype the known mutations listed in the configuration file,
+    reading only their codons from each barcode's .bam file
+
+    """
+    from .main import genotype
+
+    genotype(expt_dir, config, barcode, jobs, min_depth, min_wsaf)
@@ -0,0 +1,148 @@
+import pysam
+import numpy as np
+import pandas as pd
+from nomadic.pipeline.find.gene import Gene
+
+
+# ================================================================
+# Parameters
+#
+# ================================================================
+
+
+# Reads skipped; unmapped, secondary, QC fail, duplicate, supplementary
+EXCLUDE_FLAGS = 0xF04
+
+# Amino acid calls
+MIN_DEPTH = 10
+MIN_WSAF = 0.1
+
+
+# ================================================================
+# Genotype known sites from a .bam file
+#
+# ================================================================
+
+
+def get_position_bases(bam, chrom, positions):
+    """
+    Get the base of every read at each of a set of 1-based `positions`
+
+    returns
+        position_bases: dict
+            A Series of bases indexed by read name, for each position.
+
+    """
+
+    position_bases = {}
+    for pos in positions:
+        names = []
+        bases = []
+        if chrom in bam.references:
+            for column in bam.pileup(
+                chrom,
+                pos - 1,
+                pos,
+                truncate=True,
+                stepper="samtools",
+                flag_filter=EXCLUDE_FLAGS,
+                compute_baq=False,
+                min_base_quality=0,
+                max_depth=10**8,
+                ignore_overlaps=False,
+                ignore_orphans=False,
+            ):
+                names = column.get_query_names()
+                bases = [b.upper() for b in column.get_query_sequences()]
+        series = pd.Series(bases, index=names, dtype=object)
+        is_kept = series.isin(list("ACGT")) & ~series.index.duplicated()
+        position_bases[pos] = series[is_kept]
+
+    return position_bases
+
+
+def get_read_codons(position_bases, positions, strand):
+    """
+    Get the codon, on the coding strand, of every read with a base at
+    each of the codon's `positions`, given in coding order
+
+    """
+
+    codon_df = pd.concat(
+        [position_bases[pos] for pos in positions], axis=1, join="inner"
+    )
+    codons = codon_df.iloc[:, 0] + codon_df.iloc[:, 1] + codon_df.iloc[:, 2]
+    if strand == "-":
+        codons = codons.map(lambda c: c.translate(c.maketrans("ACGT", "TGCA")))
+
+    return codons
+
+
+def call_amino_acid(ref_aa, alt_aa, depth, wsaf, min_depth=MIN_DEPTH, min_wsaf=MIN_WSAF):
+    """
+    Call the amino acid at a site from its depth and within-sample
+    allele frequency (WSAF); mixed calls are given as e.g. K/T
+
+    """
+
+    if depth == 0 or depth < min_depth:
+        return None
+    if wsaf < min_wsaf:
+        return ref_aa
+    if wsaf > 1 - min_wsaf:
+        return alt_aa
+
+    return f"{ref_aa}/{alt_aa}"
+
+
+def genotype_bam(bam_path, sites_df, min_depth=MIN_DEPTH, min_wsaf=MIN_WSAF):
+    """
+    Genotype each known mutation of `sites_df`, as produced by
+    `resolve_known_sites()`, from the reads of `bam_path`
+
+    Each read contributes the amino acid encoded by its codon; reads
+    with a deletion at any base of the codon are not counted.
+
+    returns
+        genotype_df: DataFrame
+            For each mutation, counts of reads encoding the reference,
+            alternative and other amino acids, depth, WSAF and the call.
+
+    """
+
+    # Get bases at every codon position, once
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        position_bases = {}
+        for chrom, chrom_df in sites_df.groupby("chrom"):
+            positions = sorted(set(pos for ps in chrom_df["positions"] for pos in ps))
+            position_bases[chrom] = get_position_bases(bam, chrom, positions)
+
+    rows = []
+    for _, site in sites_df.iterrows():
+        codons = get_read_codons(
+            position_bases[site["chrom"]], site["positions"], site["strand"]
+        )
+        aas = codons.map(lambda c: Gene.genetic_code.get(c))
+        ref_count = int((aas == site["ref_aa"]).sum())
+        alt_count = int((aas == site["alt_aa"]).sum())
+        depth = len(aas)
+        wsaf = alt_count / depth if depth > 0 else np.nan
+        rows.append(
+            {
+                "target_id": site["target_id"],
+                "gene_name": site["gene_name"],
+                "mutation": site["mutation"],
+                "chrom": site["chrom"],
+                "positions": ",".join(str(p) for p in site["positions"]),
+                "ref_count": ref_count,
+                "alt_count": alt_count,
+                "other_count": depth - ref_count - alt_count,
+                "depth": depth,
+                "wsaf": wsaf,
+                "aa_call": call_amino_acid(
+                    site["ref_aa"], site["alt_aa"], depth, wsaf, min_depth, min_wsaf
+                ),
+            }
+        )
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,98 @@
+import os
+import warnings
+import pandas as pd
+from nomadic.lib.generic import print_header, print_footer, produce_dir
+from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
+from nomadic.lib.references import PlasmodiumFalciparum3D7
+from nomadic.pipeline.find.gene import GeneModelStore
+from .sites import resolve_known_sites
+from .genotyper import MIN_DEPTH, MIN_WSAF, genotype_bam
+
+
+def genotype_barcode(barcode, params, script_dir, reference, sites_df, min_depth, min_wsaf):
+    """
+    Genotype known sites for a single barcode, and write to its
+    output directory
+
+    """
+
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    bam_path = f"{barcode_dir}/bams/{barcode}.{reference.name}.final.sorted.bam"
+    barcode_output_dir = produce_dir(barcode_dir, script_dir)
+    csv_path = f"{barcode_output_dir}/{barcode}.{reference.name}.genotypes.csv"
+
+    if not os.path.exists(bam_path):
+        warnings.warn(f"No .bam file found at {bam_path}! Skipping.")
+        return None
+
+    genotype_df = genotype_bam(bam_path, sites_df, min_depth, min_wsaf)
+    genotype_df.insert(0, "barcode", barcode)
+    genotype_df.to_csv(csv_path, index=False)
+
+    return genotype_df
+
+
+def genotype(
+    expt_dir: str,
+    config: str,
+    barcode: str = None,
+    jobs: int = 1,
+    min_depth: int = MIN_DEPTH,
+    min_wsaf: float = MIN_WSAF,
+) -> None:
+    """
+    Genotype the known mutations of the configuration file directly
+    from the .bam file of each barcode, without variant calling
+
+    """
+
+    # PARSE INPUTS
+    script_descrip = "NOMADIC: Genotype known mutations"
+    t0 = print_header(script_descrip)
+    script_dir = "genotype"
+    params = build_parameter_dict(expt_dir, config, barcode)
+    output_dir = produce_dir(params["nomadic_dir"], script_dir)
+
+    # Define reference genome
+    reference = PlasmodiumFalciparum3D7()
+
+    # Focus on a single barcode, if specified
+    if "focus_barcode" in params:
+        params["barcodes"] = [params["focus_barcode"]]
+
+    # Resolve mutations to genomic coordinates, once
+    print("Resolving known mutations...")
+    if "mutations" not in params:
+        raise ValueError("No [Mutations] section found in the configuration file.")
+    gene_store = GeneModelStore.from_reference(reference)
+    gene_store.load()
+    sites_df = resolve_known_sites(params["mutations"], gene_store)
+    gene_store.save()
+    gene_store.close()
+    print(f"  No. mutations: {sites_df.shape[0]}")
+    print("Done.")
+    print("")
+
+    # Genotype barcodes in parallel
+    print(f"Genotyping {len(params['barcodes'])} barcodes, {jobs} at a time...")
+    barcode_dfs = run_barcodes(
+        genotype_barcode,
+        params["barcodes"],
+        args=(params, script_dir, reference, sites_df, min_depth, min_wsaf),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/genotype",
+    )
+    barcode_dfs = [df for df in barcode_dfs if df is not None]
+    print("Done.")
+    print("")
+
+    # Combine, merge with metadata, save
+    if barcode_dfs:
+        overall_df = pd.concat(barcode_dfs)
+        overall_df = pd.merge(left=params["metadata"], right=overall_df, on="barcode")
+        output_csv = f"{output_dir}/table.resistance_mutations.genotypes.csv"
+        print(f"Writing to: {output_csv}")
+        overall_df.to_csv(output_csv, index=False)
+
+    print_footer(t0)
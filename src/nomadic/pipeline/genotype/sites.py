@@ -0,0 +1,76 @@
+import re
+import warnings
+import pandas as pd
+from nomadic.pipeline.find.gene import GeneModelStore
+
+
+# ================================================================
+# Resolve known mutations to genomic coordinates
+#
+# ================================================================
+
+
+MUTATION_PATTERN = re.compile(r"^([A-Z_*])(\d+)([A-Z_*])$")
+
+
+def parse_mutation(mutation):
+    """
+    Parse an amino acid mutation, e.g. K76T, into its
+    reference amino acid, codon number and alternative amino acid
+
+    """
+
+    match = MUTATION_PATTERN.match(mutation)
+    if match is None:
+        raise ValueError(f"Could not parse mutation {mutation}; expected e.g. K76T.")
+    ref_aa, number, alt_aa = match.groups()
+
+    return ref_aa, int(number), alt_aa
+
+
+def resolve_known_sites(mutations_df, gene_store: GeneModelStore):
+    """
+    Resolve each mutation of `mutations_df`, with columns `target`,
+    `gene_name` and `mutation`, to the genomic positions of its codon
+
+    Mutations outside of their gene are dropped, with a warning; a warning
+    is also raised if the reference amino acid differs from the gene model.
+
+    returns
+        sites_df: DataFrame
+            One row per mutation, with the chromosome, strand, codon
+            positions (in coding order), reference codon and amino acids.
+
+    """
+
+    rows = []
+    for target_id, gene_name, mutation in mutations_df[
+        ["target", "gene_name", "mutation"]
+    ].itertuples(index=False):
+        gene = gene_store.get_gene(target_id)
+        ref_aa, number, alt_aa = parse_mutation(mutation)
+
+        if not 1 <= number <= len(gene.codon_nts):
+            warnings.warn(f"Codon {number} of {mutation} is outside of {gene_name}. Skipping.")
+            continue
+        if gene.get_aa(number) != ref_aa:
+            warnings.warn(
+                f"Reference amino acid of {mutation} in {gene_name} is {gene.get_aa(number)}."
+            )
+
+        rows.append(
+            {
+                "target_id": target_id,
+                "gene_name": gene_name,
+                "mutation": mutation,
+                "chrom": gene.chrom,
+                "strand": gene.strand,
+                "codon": number,
+                "positions": list(gene.codon_positions[number - 1]),
+                "ref_codon": gene.get_codon(number),
+                "ref_aa": ref_aa,
+                "alt_aa": alt_aa,
+            }
+        )
+
+    return pd.DataFrame(rows)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -7,6 +8,17 @@ import pandas as pd
 #
 # ================================================================
 
+
+# FLAG bits defining each mapping state, in order of precedence
+# NB: Chimera arbitrarily dominant, given chimera and supp.
+MAPPING_STATE_BITS = {
+    "unmapped": 0x004,
+    "chim_mapped": 0x800,
+    "supp_mapped": 0x100,
+}
+DEFAULT_MAPPING_STATE = "uniq_mapped"
+
+
 def convert_to_padded_binary(val):
     return f"{val:012b}"[::-1]
 
@@ -109,45 +121,100 @@ def get_read_state_summary(species, mapping_state, detailed=False):
     return f"{species}_mapped" if not detailed else f"{species}_{mapping_state}"
 
 
+def get_read_mapping_states(read_ids, flags):
+    """
+    Classify every aligned segment into the `mapping_state` of the read
+    it belongs to, given the `read_ids` and `flags` of all segments
+
+    This is a vectorised equivalent of calling `get_read_mapping_state()`
+    on the flags of each read. Segments are sorted by read, the flags
+    of each read are combined with a bitwise OR, and states are then
+    assigned with array masks following `MAPPING_STATE_BITS`.
+
+    params:
+        read_ids: array-like, shape (n_segments, )
+            Read ID of each aligned segment.
+        flags: array-like of ints, shape (n_segments, )
+            FLAG field of each aligned segment.
+
+    returns:
+        mapping_states: ndarray, str, shape (n_segments, )
+            Mapping state of the read to which each segment belongs.
+
+    """
+
+    flags = np.asarray(flags, dtype="int64")
+    if flags.shape[0] == 0:
+        return np.array([], dtype=object)
+
+    # Codes are contiguous, 0 to n_reads - 1
+    codes, _ = pd.factorize(read_ids)
+
+    # Combine flags of all segments of each read
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.diff(sorted_codes, prepend=-1))
+    read_flags = np.bitwise_or.reduceat(flags[order], starts)
+
+    # Broadcast back to segments
+    return classify_combined_flags(read_flags[codes])
+
+
+def classify_combined_flags(combined_flags):
+    """
+    Assign a `mapping_state` given the bitwise OR of the flags of all
+    aligned segments belonging to each read
+
+    params:
+        combined_flags: ndarray of ints, shape (n, )
+            Combined FLAG fields.
+
+    returns:
+        mapping_states: ndarray, str, shape (n, )
+            Mapping state for each entry.
+
+    """
+
+    combined_flags = np.asarray(combined_flags, dtype="int64")
+
+    return np.select(
+        [(combined_flags & bit) > 0 for bit in MAPPING_STATE_BITS.values()],
+        list(MAPPING_STATE_BITS),
+        default=DEFAULT_MAPPING_STATE,
+    ).astype(object)
+
+
 def reduce_to_read_dataframe(alignments_df):
     """
     Reduce an alignments dataframe to a read-level dataframe,
     annotating mapping state
 
-    Pretty painful function
-
     """
 
     # Annotate every alignment with a mapping state
-    mapping_state_dt = {
-        read_id: get_read_mapping_state(adf["flag"].tolist())
-        for read_id, adf in alignments_df.groupby("read_id")
-    }
     alignments_df.insert(
         8,
         "mapping_state",
-        [mapping_state_dt[read_id] for read_id in alignments_df["read_id"]],
+        get_read_mapping_states(alignments_df["read_id"], alignments_df["flag"]),
     )
 
     # Reduce to primary alignment for every read
     read_df = alignments_df.query("flag in [0, 16, 4]")
 
     # Annotate with summary of species + mapping state
+    # see `get_read_state_summary()`
+    species = read_df["species"].to_numpy(dtype=object)
+    mapping_states = read_df["mapping_state"].to_numpy(dtype=object)
+    is_unmapped = mapping_states == "unmapped"
     read_df.insert(
         9,
         "primary_state",
-        [
-            get_read_state_summary(s, m)
-            for s, m in zip(read_df["species"], read_df["mapping_state"])
-        ],
+        np.where(is_unmapped, "unmapped", species + "_mapped"),
     )
     read_df.insert(
         10,
         "secondary_state",
-        [
-            get_read_state_summary(s, m, detailed=True)
-            for s, m in zip(read_df["species"], read_df["mapping_state"])
-        ],
+        np.where(is_unmapped, "unmapped", species + "_" + mapping_states),
     )
 
     return read_df
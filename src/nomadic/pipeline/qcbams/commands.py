@@ -3,15 +3,17 @@ import pandas as pd
 pd.options.mode.chained_assignment = None
 
 import click
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import (
     PlasmodiumFalciparum3D7,
     HomoSapiens,
 )
-from .io import load_alignment_information
+from .io import load_alignment_information, concat_alignment_dataframes
 from .classify import reduce_to_read_dataframe, convert_column_to_ordered_category
+from .stream import ReadSummaryStreamer, ReadHistogramAccumulator
 from .plot import (
     MappingStatesAndColors,
     HISTOGRAM_STATS,
@@ -44,6 +46,140 @@ def combine_barcode_dataframes(csv_filename, script_dir, params):
     return pd.concat(dfs)
 
 
+# ================================================================
+# Summarise reads of a single barcode
+#
+# ================================================================
+
+
+def qcbams_barcode(barcode, params, script_dir, pf_reference, hs_reference, msc):
+    """
+    Create histogram summaries of the reads of a single barcode
+
+    """
+
+    # Define directories
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    bam_dir = f"{barcode_dir}/bams"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Define input bams
+    pf_bam_path = f"{bam_dir}/{barcode}.{pf_reference.name}.final.sorted.bam"
+    hs_bam_path = f"{bam_dir}/{barcode}.{hs_reference.name}.final.sorted.bam"
+
+    # Load p.f. alignments
+    print("Loading data...")
+    pf_alignments_df = load_alignment_information(pf_bam_path)
+    pf_alignments_df.insert(0, "species", "pf")
+    pf_alignments_df.query(
+        "flag != 4", inplace=True
+    )  # these have been remapped to H.s.
+
+    # Load h.s. alignments
+    hs_alignments_df = load_alignment_information(hs_bam_path)
+    hs_alignments_df.insert(0, "species", "hs")
+
+    # Combine all alignments
+    alignments_df = concat_alignment_dataframes([pf_alignments_df, hs_alignments_df])
+
+    # Produce a read-level data frame
+    print("Processing...")
+    read_df = reduce_to_read_dataframe(alignments_df)
+    convert_column_to_ordered_category(read_df, "primary_state", msc.primary_levels)
+    convert_column_to_ordered_category(
+        read_df, "secondary_state", msc.secondary_levels
+    )
+
+    # Prepare plotter
+    plotter = ReadHistogramPlotter(read_df)
+
+    # Iterate over statistics, states, and plot
+    print("Plotting...")
+    for state, colors in msc.color_sets.items():
+
+        # Set states of interest, compute group sizes
+        plotter.set_groups(state, colors)
+        size_df = plotter.get_group_size_dataframe()
+        size_df.to_csv(f"{output_dir}/table.size.{state}.csv", index=False)
+
+        for histogram_stat in HISTOGRAM_STATS:
+
+            # Set statistics and create histogram
+            plotter.set_histogram_stats(**histogram_stat.__dict__)
+            plotter.create_histogram_dataframe()
+
+            # Plot
+            plotter.plot_histogram(
+                title=barcode,
+                output_path=f"{output_dir}/plot.{histogram_stat.stat}.{state}.png",
+            )
+
+            # Write to data frame
+            plotter.write_histogram_dataframe(
+                f"{output_dir}/table.bin_counts.{histogram_stat.stat}.{state}.csv"
+            )
+    print(f"Output directory: {output_dir}")
+    print("Done.")
+    print("")
+
+
+def qcbams_streaming_barcode(barcode, params, script_dir, pf_reference, hs_reference, msc):
+    """
+    Stream the reads of a single barcode into histogram summaries
+
+    """
+
+    # Define directories
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    bam_dir = f"{barcode_dir}/bams"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Define input bams; unmapped p.f. reads have been remapped to H.s.
+    streamers = {
+        "pf": ReadSummaryStreamer(
+            f"{bam_dir}/{barcode}.{pf_reference.name}.final.sorted.bam",
+            skip_unmapped=True,
+        ),
+        "hs": ReadSummaryStreamer(
+            f"{bam_dir}/{barcode}.{hs_reference.name}.final.sorted.bam"
+        ),
+    }
+
+    # Accumulate histograms
+    print("Streaming reads...")
+    accumulator = ReadHistogramAccumulator(msc)
+    for species, streamer in streamers.items():
+        for mapping_states, values in streamer.iter_chunks():
+            accumulator.update(species, mapping_states, values)
+
+    # Iterate over statistics, states, and plot
+    print("Plotting...")
+    for state, colors in msc.color_sets.items():
+
+        size_df = accumulator.get_group_size_dataframe(state)
+        size_df.to_csv(f"{output_dir}/table.size.{state}.csv", index=False)
+
+        for histogram_stat in HISTOGRAM_STATS:
+            hist_df = accumulator.get_histogram_dataframe(
+                state, histogram_stat.stat
+            )
+            hist_df.to_csv(
+                f"{output_dir}/table.bin_counts.{histogram_stat.stat}.{state}.csv",
+                index=False,
+            )
+
+            # Plot
+            plotter = JointHistogramPlotter(hist_df, msc.level_sets[state], colors)
+            plotter.set_histogram_stats(**histogram_stat.__dict__)
+            plotter.plot_histogram(
+                title=barcode,
+                output_path=f"{output_dir}/plot.{histogram_stat.stat}.{state}.png",
+            )
+    print(f"Output directory: {output_dir}")
+    print("Done.")
+    print("")
+
+
 # ================================================================
 # Main script, run from `cli.py`
 #
@@ -53,10 +189,16 @@ def combine_barcode_dataframes(csv_filename, script_dir, params):
 @click.command(short_help="QC analysis of .bam files.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "--overview", is_flag=True, help="Produce an overview across all barcodes."
 )
-def qcbams(expt_dir, config, barcode, overview):
+@click.option(
+    "--streaming",
+    is_flag=True,
+    help="Accumulate histograms chunk-by-chunk, with memory independent of read count; .bam files are first collated by read name into a temporary file.",
+)
+def qcbams(expt_dir, config, barcode, jobs, overview, streaming):
     """
     Run a quality control analysis of .bam files generated from
     `nomadic map` and `nomadic remap`
@@ -64,8 +206,10 @@ def qcbams(expt_dir, config, barcode, overview):
     """
     if overview:
         qcbams_overview(expt_dir, config)
+    elif streaming:
+        qcbams_streaming(expt_dir, config, barcode, jobs)
     else:
-        qcbams_individual(expt_dir, config, barcode)
+        qcbams_individual(expt_dir, config, barcode, jobs)
 
 
 def qcbams_overview(expt_dir, config):
@@ -140,7 +284,7 @@ def qcbams_overview(expt_dir, config):
     print_footer(t0)
 
 
-def qcbams_individual(expt_dir, config, barcode):
+def qcbams_individual(expt_dir, config, barcode, jobs=1):
     """
     Create a series of histogram summaries of reads
     within .bam files
@@ -166,72 +310,48 @@ def qcbams_individual(expt_dir, config, barcode):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # Define directories
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        bam_dir = f"{barcode_dir}/bams"
-        output_dir = produce_dir(barcode_dir, script_dir)
-
-        # Define input bams
-        pf_bam_path = f"{bam_dir}/{barcode}.{pf_reference.name}.final.sorted.bam"
-        hs_bam_path = f"{bam_dir}/{barcode}.{hs_reference.name}.final.sorted.bam"
-
-        # Load p.f. alignments
-        print("Loading data...")
-        pf_alignments_df = load_alignment_information(pf_bam_path)
-        pf_alignments_df.insert(0, "species", "pf")
-        pf_alignments_df.query(
-            "flag != 4", inplace=True
-        )  # these have been remapped to H.s.
-
-        # Load h.s. alignments
-        hs_alignments_df = load_alignment_information(hs_bam_path)
-        hs_alignments_df.insert(0, "species", "hs")
-
-        # Combine all alignments
-        alignments_df = pd.concat([pf_alignments_df, hs_alignments_df], axis=0)
-
-        # Produce a read-level data frame
-        print("Processing...")
-        read_df = reduce_to_read_dataframe(alignments_df)
-        convert_column_to_ordered_category(read_df, "primary_state", msc.primary_levels)
-        convert_column_to_ordered_category(
-            read_df, "secondary_state", msc.secondary_levels
-        )
+    run_barcodes(
+        qcbams_barcode,
+        params["barcodes"],
+        args=(params, script_dir, pf_reference, hs_reference, msc),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/qcbams",
+    )
+    print_footer(t0)
 
-        # Prepare plotter
-        plotter = ReadHistogramPlotter(read_df)
-
-        # Iterate over statistics, states, and plot
-        print("Plotting...")
-        for state, colors in msc.color_sets.items():
-
-            # Set states of interest, compute group sizes
-            plotter.set_groups(state, colors)
-            size_df = plotter.get_group_size_dataframe()
-            size_df.to_csv(f"{output_dir}/table.size.{state}.csv", index=False)
-
-            for histogram_stat in HISTOGRAM_STATS:
-
-                # Set statistics and create histogram
-                plotter.set_histogram_stats(**histogram_stat.__dict__)
-                plotter.create_histogram_dataframe()
-
-                # Plot
-                plotter.plot_histogram(
-                    title=barcode,
-                    output_path=f"{output_dir}/plot.{histogram_stat.stat}.{state}.png",
-                )
-
-                # Write to data frame
-                plotter.write_histogram_dataframe(
-                    f"{output_dir}/table.bin_counts.{histogram_stat.stat}.{state}.csv"
-                )
-        print(f"Output directory: {output_dir}")
-        print("Done.")
-        print("")
+
+def qcbams_streaming(expt_dir, config, barcode, jobs=1):
+    """
+    Create the same histogram summaries as `qcbams_individual`,
+    but stream reads in chunks into fixed-size histograms rather
+    than loading every alignment
+
+    """
+
+    # PARSE INPUTS
+    script_descrip = "NOMADIC: Quality control analysis of .bam files (streaming)"
+    t0 = print_header(script_descrip)
+    script_dir = "qc-bams"
+    params = build_parameter_dict(expt_dir, config, barcode)
+
+    # Focus on a single barcode, if specified
+    if "focus_barcode" in params:
+        params["barcodes"] = [params["focus_barcode"]]
+
+    # Define reference genomes
+    pf_reference = PlasmodiumFalciparum3D7()
+    hs_reference = HomoSapiens()
+
+    # Instantiate mapping states and colors
+    msc = MappingStatesAndColors()
+
+    # ITERATE
+    print("Iterating over barcodes...")
+    run_barcodes(
+        qcbams_streaming_barcode,
+        params["barcodes"],
+        args=(params, script_dir, pf_reference, hs_reference, msc),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/qcbams",
+    )
     print_footer(t0)
@@ -1,7 +1,7 @@
 import pysam
 import pandas as pd
 import numpy as np
-from dataclasses import dataclass, fields
+from pandas.api.types import union_categoricals
 
 
 # ================================================================
@@ -16,66 +16,96 @@ def calc_percent_gc(seq):
     if not seq:
         return None
 
-    N = len(seq)
-    n_gc = len([nt for nt in seq if nt in ["G", "C"]])
+    return 100 * (seq.count("G") + seq.count("C")) / len(seq)
 
-    return 100 * n_gc / N
 
+def calc_mean_qscore(qualities):
+    """Calculate mean of a raw base quality buffer"""
 
-def load_alignment_information(input_bam: str) -> pd.DataFrame:
+    if qualities is None:
+        return None
+
+    return np.frombuffer(qualities, dtype="uint8").mean()
+
+
+# Columns of the alignment data frame, and their types; `read_id`
+# is stored separately as a categorical
+ALIGNMENT_COLUMNS = {
+    "mapq": "uint8",
+    "flag": "uint16",
+    "query_length": "int32",
+    "query_alignment_length": "int32",
+    "mean_qscore": "float64",
+    "per_gc": "float64",
+}
+
+
+def load_alignment_information(input_bam: str, chunk_size: int = 2**16) -> pd.DataFrame:
     """
     Load information about every alignment from an input bam
     file `input_bam`
 
+    Values are written directly into preallocated typed arrays, which
+    are sized from the .bam index if it exists and otherwise grown by
+    `chunk_size` alignments. Read IDs are stored as a categorical, such
+    that each read ID string is held only once.
+
     """
 
-    @dataclass
-    class AlignmentSummary:
-        """
-        Simple summary of a single alignment
-        from a .bam file
-
-        """
-
-        read_id: str
-        mapq: int
-        flag: int
-        query_length: int
-        query_alignment_length: int
-        mean_qscore: float
-        per_gc: float
-
-        @classmethod
-        def from_pysam_aligned_segment(cls, pysam_segment: pysam.AlignedSegment):
-            """
-            Instantiate from a pysam aligned segment
-
-            """
-            # Compute mean quality score
-            qscores = np.array(pysam_segment.query_qualities)
-            mean_qscore = qscores.mean() if qscores.shape else None
-
-            return cls(
-                read_id=pysam_segment.query_name,
-                mapq=pysam_segment.mapq,
-                flag=pysam_segment.flag,
-                query_length=pysam_segment.query_length,
-                query_alignment_length=pysam_segment.query_alignment_length,
-                mean_qscore=mean_qscore,
-                per_gc=calc_percent_gc(pysam_segment.query),
-            )
-
-    # Iterate over aligned segments in .bam, store results
     with pysam.AlignmentFile(input_bam, "r") as bam:
-        results = [
-            AlignmentSummary.from_pysam_aligned_segment(segment) for segment in bam
-        ]
+
+        capacity = chunk_size
+        if bam.has_index():
+            capacity = max(bam.mapped + bam.unmapped, 1)
+
+        read_codes = np.zeros(capacity, "int32")
+        arrays = {
+            column: np.zeros(capacity, dtype) for column, dtype in ALIGNMENT_COLUMNS.items()
+        }
+        read_index = {}
+
+        n = 0
+        for segment in bam.fetch(until_eof=True):
+            if n == capacity:
+                capacity += chunk_size
+                read_codes = np.resize(read_codes, capacity)
+                arrays = {c: np.resize(a, capacity) for c, a in arrays.items()}
+
+            read_codes[n] = read_index.setdefault(segment.query_name, len(read_index))
+            arrays["mapq"][n] = segment.mapping_quality
+            arrays["flag"][n] = segment.flag
+            arrays["query_length"][n] = segment.query_length
+            arrays["query_alignment_length"][n] = segment.query_alignment_length
+
+            mean_qscore = calc_mean_qscore(segment.query_qualities)
+            arrays["mean_qscore"][n] = np.nan if mean_qscore is None else mean_qscore
+
+            per_gc = calc_percent_gc(segment.query_alignment_sequence)
+            arrays["per_gc"][n] = np.nan if per_gc is None else per_gc
+
+            n += 1
 
     # We need to make sure, in the case of no reads, we still produce a dataframe
     # with correct column names and types; or types get coerced later on
-    if not results:
-        column_types = {f.name: f.type for f in fields(AlignmentSummary)}
-        empty_df = pd.DataFrame(results, columns=column_types).astype(column_types)
-        return empty_df
+    df = pd.DataFrame({column: array[:n] for column, array in arrays.items()})
+    df.insert(
+        0,
+        "read_id",
+        pd.Categorical.from_codes(read_codes[:n], categories=list(read_index)),
+    )
+
+    return df
+
+
+def concat_alignment_dataframes(dfs):
+    """
+    Concatenate alignment data frames returned by `load_alignment_information`,
+    keeping `read_id` categorical across all of them
+
+    """
+
+    read_ids = union_categoricals([df["read_id"] for df in dfs])
+    df = pd.concat(dfs, axis=0, ignore_index=True)
+    df["read_id"] = read_ids
 
-    return pd.DataFrame(results)
+    return df
@@ -0,0 +1,240 @@
+import os
+import pysam
+import numpy as np
+import pandas as pd
+from .io import calc_percent_gc, calc_mean_qscore
+from .classify import classify_combined_flags
+from .plot import HISTOGRAM_STATS
+
+
+# ================================================================
+# Stream read-level summaries from a .bam file in chunks
+#
+# ================================================================
+
+
+# Primary records, as selected by `reduce_to_read_dataframe()`
+PRIMARY_FLAGS = (0, 16, 4)
+
+
+def is_name_collated(bam):
+    """
+    Check whether the records of an opened `bam` file are grouped
+    by read name, based on its header
+
+    """
+
+    hd = bam.header.to_dict().get("HD", {})
+
+    return hd.get("SO") == "queryname" or hd.get("GO") == "query"
+
+
+def collate_bam(bam_path, collated_bam_path):
+    """
+    Group the records of `bam_path` by read name, writing them to
+    `collated_bam_path`; `samtools collate` spills to temporary files
+    next to the output, such that its memory use is bounded
+
+    """
+
+    pysam.collate(
+        "-l", "1", "-o", collated_bam_path, "-T", f"{collated_bam_path}.tmp", bam_path
+    )
+
+
+class ReadSummaryStreamer:
+    """
+    Stream read-level summaries from a .bam file in fixed-size chunks,
+    without holding a per-alignment table in memory
+
+    Each read is summarised by the statistics of its primary record
+    and the bitwise OR of the flags of all its records, from which
+    the mapping state is assigned.
+
+    Records are read in a single pass with all records of a read
+    adjacent, such that memory is constant. A .bam that is not already
+    collated by read name, e.g. the coordinate sorted `.final.sorted.bam`
+    files of `nomadic map`, is first collated into a temporary .bam
+    next to it, which is removed once streaming finishes.
+
+    """
+
+    def __init__(self, bam_path, skip_unmapped=False, chunk_size=2**16):
+        self.bam_path = bam_path
+        self.skip_unmapped = skip_unmapped
+        self.chunk_size = chunk_size
+        self.stats = [h.stat for h in HISTOGRAM_STATS]
+
+    def _iter_records(self, bam):
+        """Iterate over all records, optionally skipping unmapped records"""
+
+        for segment in bam.fetch(until_eof=True):
+            if self.skip_unmapped and segment.flag == 4:
+                continue
+            yield segment
+
+    def _get_values(self, segment):
+        """Get the histogram statistics of a primary record"""
+
+        values = {
+            "query_length": segment.query_length,
+            "per_gc": calc_percent_gc(segment.query_alignment_sequence),
+            "mean_qscore": calc_mean_qscore(segment.query_qualities),
+        }
+
+        return [np.nan if values[s] is None else values[s] for s in self.stats]
+
+    def _iter_collated(self, bam):
+        """Yield (combined flags, primary values) for reads in a collated .bam"""
+
+        current_name = None
+        combined_flags = 0
+        primary_values = None
+        for segment in self._iter_records(bam):
+            if segment.query_name != current_name:
+                if primary_values is not None:
+                    yield combined_flags, primary_values
+                current_name = segment.query_name
+                combined_flags = 0
+                primary_values = None
+            combined_flags |= segment.flag
+            if segment.flag in PRIMARY_FLAGS:
+                primary_values = self._get_values(segment)
+
+        if primary_values is not None:
+            yield combined_flags, primary_values
+
+    def iter_chunks(self):
+        """
+        Yield chunks of read summaries
+
+        returns
+            mapping_states: ndarray, str, shape (n_reads, )
+                Mapping state of each read in the chunk.
+            values: dict of ndarray, float, shape (n_reads, )
+                Values of each histogram statistic for each read.
+
+        """
+
+        combined_flags = np.zeros(self.chunk_size, "int64")
+        values = np.zeros((self.chunk_size, len(self.stats)), "float64")
+
+        def get_chunk(n):
+            mapping_states = classify_combined_flags(combined_flags[:n])
+            return mapping_states, {s: values[:n, j] for j, s in enumerate(self.stats)}
+
+        with pysam.AlignmentFile(self.bam_path, "rb") as bam:
+            is_collated = is_name_collated(bam)
+
+        bam_path = self.bam_path
+        if not is_collated:
+            bam_path = self.bam_path.replace(".bam", ".collated.bam")
+            collate_bam(self.bam_path, bam_path)
+
+        try:
+            with pysam.AlignmentFile(bam_path, "rb") as bam:
+                n = 0
+                for flags, read_values in self._iter_collated(bam):
+                    combined_flags[n] = flags
+                    values[n] = read_values
+                    n += 1
+                    if n == self.chunk_size:
+                        yield get_chunk(n)
+                        n = 0
+                if n > 0:
+                    yield get_chunk(n)
+        finally:
+            if not is_collated:
+                os.remove(bam_path)
+
+
+# ================================================================
+# Accumulate histograms of read statistics by mapping state
+#
+# ================================================================
+
+
+class ReadHistogramAccumulator:
+    """
+    Accumulate fixed-size histograms of every statistic in
+    `HISTOGRAM_STATS`, for every group of the primary and
+    secondary mapping states
+
+    Produces the same tables as `ReadHistogramPlotter`.
+
+    """
+
+    def __init__(self, msc, histogram_stats=HISTOGRAM_STATS):
+        self.level_sets = msc.level_sets
+        self.bins = {
+            h.stat: np.arange(h.min_val, h.max_val + h.intv, h.intv)
+            for h in histogram_stats
+        }
+        self.counts = {
+            state: {
+                stat: np.zeros((len(levels), len(bins) - 1), "int64")
+                for stat, bins in self.bins.items()
+            }
+            for state, levels in self.level_sets.items()
+        }
+        self.sizes = {
+            state: np.zeros(len(levels), "int64")
+            for state, levels in self.level_sets.items()
+        }
+
+    @staticmethod
+    def get_states(species, mapping_states):
+        """
+        Get primary and secondary states, as with `get_read_state_summary()`
+
+        """
+
+        is_unmapped = mapping_states == "unmapped"
+
+        return {
+            "primary_state": np.where(is_unmapped, "unmapped", f"{species}_mapped"),
+            "secondary_state": np.where(
+                is_unmapped, "unmapped", f"{species}_" + mapping_states
+            ),
+        }
+
+    def update(self, species, mapping_states, values):
+        """
+        Update histograms with a chunk of reads from `species`
+
+        """
+
+        for state, groups in self.get_states(species, mapping_states).items():
+            for j, level in enumerate(self.level_sets[state]):
+                in_level = groups == level
+                n_level = in_level.sum()
+                if n_level == 0:
+                    continue
+                self.sizes[state][j] += n_level
+                for stat, bins in self.bins.items():
+                    counts, _ = np.histogram(values[stat][in_level], bins=bins)
+                    self.counts[state][stat][j] += counts
+
+    def get_group_size_dataframe(self, state):
+        """Get sizes of the different groups for a `state`"""
+
+        return pd.DataFrame(
+            {"group": self.level_sets[state], "n_reads": self.sizes[state]}
+        )
+
+    def get_histogram_dataframe(self, state, stat):
+        """Get histogram of `stat` for each group of a `state`"""
+
+        bins = self.bins[stat]
+        hist_df = pd.DataFrame(
+            {
+                level: counts
+                for level, counts in zip(
+                    self.level_sets[state], self.counts[state][stat]
+                )
+            }
+        )
+        hist_df.insert(0, "bin_lower", bins[:-1])
+        hist_df.insert(1, "bin_higher", bins[1:])
+
+        return hist_df
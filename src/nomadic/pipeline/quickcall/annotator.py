@@ -2,11 +2,15 @@ import os
 import re
 import warnings
 import subprocess
+import pysam
 import pandas as pd
+from collections import Counter
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Tuple
 from nomadic.lib.generic import produce_dir
 from nomadic.lib.references import Reference
+from .consequences import PanelConsequenceTable
 
 
 # ================================================================
@@ -60,9 +64,11 @@ class Consequence:
         self.concise_aa_change = f"{from_aa}{aa_pos}{to_aa}"
         
     @classmethod
+    @lru_cache(maxsize=None)
     def from_string(cls, csq_string: str):
         """
-        Parse from the output string
+        Parse from the output string; memoised, as the same
+        consequence is typically shared by many samples and sites
 
         What to do if "double"?
         Or @
@@ -88,6 +94,50 @@ class Consequence:
         return cls(*fields)
 
 
+# ================================================================
+# Formatting VCF values as output by `bcftools query`
+#
+# ================================================================
+
+
+def format_info_value(value) -> str:
+    """
+    Format an INFO value; missing values are given as '.'
+
+    """
+    if value is None:
+        return "."
+    if isinstance(value, tuple):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+
+def format_genotype(alleles: Tuple[int], phased: bool) -> str:
+    """
+    Format a GT value, e.g. as 0/1 or 0|1; missing alleles are given as '.'
+
+    """
+    if alleles is None:
+        return "."
+    sep = "|" if phased else "/"
+    return sep.join("." if a is None else str(a) for a in alleles)
+
+
+def format_number(value):
+    """
+    Format a numeric value, keeping only the first of multiple values;
+    missing values are given as None
+
+    """
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    if value is None:
+        return None
+    if isinstance(value, float):
+        return float(f"{value:g}")
+    return value
+
+
 # ================================================================
 # Annotating a VCF with information about amplicons & effects
 #
@@ -98,14 +148,42 @@ class VariantAnnotator:
     AMP_HEADER = (
         "##INFO=<ID=AMP_ID,Number=1,Type=String,Description=Amplicon identifier>"
     )
+    TSV_COLUMNS = [
+        "sample",
+        "chrom",
+        "pos",
+        "ref",
+        "alt",
+        "qual",
+        "mut_type",
+        "aa_change",
+        "aa_pos",
+        "strand",
+        "amplicon",
+        "gt",
+        "gq",
+        "dp",
+        "wsaf",
+    ]
+    WSAF_DESCRIPTION = "Added by +fill-tags expression WSAF=1-FORMAT/AD/FORMAT/DP"
+    BCSQ_DESCRIPTION = (
+        "Local consequence annotation from BCFtools/csq, Format: "
+        "Consequence|gene|transcript|biotype|strand|amino_acid_change|dna_change"
+    )
 
     def __init__(
-        self, vcf_path: str, bed_path: str, reference: Reference, output_dir: str
+        self,
+        vcf_path: str,
+        bed_path: str,
+        reference: Reference,
+        output_dir: str,
+        consequence_table: PanelConsequenceTable = None,
     ) -> None:
         self.vcf_path = vcf_path
         self.bed_path = bed_path
         self.reference = reference  # The GFF path needs to be GFF3 compliant
         self.output_dir = produce_dir(output_dir)
+        self.consequence_table = consequence_table
 
         # Outputs
         self.output_vcf = f"{output_dir}/{os.path.basename(self.vcf_path).replace('.vcf.gz', '.annotated.vcf.gz')}"
@@ -159,7 +237,7 @@ class VariantAnnotator:
 
         return cmd
     
-    def run(self):
+    def _run_bcftools(self):
         """
         Annotate variant calls using `bcftools csq`
 
@@ -178,80 +256,217 @@ class VariantAnnotator:
         cmd = f"{cmd_tags} | {cmd_annot} | {cmd_csq}"
         subprocess.run(cmd, shell=True, check=True)
 
-    def _convert_to_tsv(self):
+    @staticmethod
+    def _set_wsaf(record) -> None:
         """
-        Convert the annotated VCF file to a small TSV file
-        in preparation for plotting
+        Compute the WSAF of each sample from its allelic depths,
+        as `bcftools +fill-tags` in `_get_wsaf_command()`
 
         """
 
-        # Define fixed and per-sample fields
-        # Note that sample name also gets added.
-        fixed = {
-            "chrom": "CHROM",
-            "pos": "POS",
-            "ref": "REF",
-            "alt": "ALT",
-            "qual": "QUAL",
-            "consequence": "BCSQ",
-            "amplicon": "AMP_ID",
-        }
-        called = {
-            "gt": "GT", 
-            "gq": "GQ",
-            "dp": "DP", 
-            "wsaf": "WSAF{0}"
-        }
+        for call in record.samples.values():
+            ad, dp = call.get("AD"), call.get("DP")
+            if ad is None or dp is None or dp == 0 or None in ad:
+                continue
+            call["WSAF"] = tuple(1 - a / dp for a in ad)
+
+    def _run_csq_fallback(self, records, header) -> dict:
+        """
+        Run `bcftools csq` on `records` that are not in the consequence table
 
-        # Write header
-        sep = "\t"
-        cmd_header = f"printf 'sample\t{sep.join(list(fixed) + list(called))}\n' > {self.output_tsv}"
-        sep += "%"
+        returns
+            consequences: dict
+                BCSQ values keyed by (chrom, pos, ref, alts).
+
+        """
 
-        # Iterate and query for each sample
-        cmd_query = f"for sample in `bcftools query {self.output_vcf} -l`; do"
-        cmd_query += "  bcftools query -s $sample"
-        cmd_query += f" -f \"$sample\t%{sep.join(fixed.values())}\t[%{sep.join(called.values())}]\n\""
-        cmd_query += f" {self.output_vcf} >> {self.output_tsv};"
-        cmd_query += " done;"
+        fallback_vcf = self.output_vcf.replace(".vcf.gz", ".csq_fallback.vcf.gz")
+        fallback_csq_vcf = fallback_vcf.replace(".vcf.gz", ".csq.vcf.gz")
+        with pysam.VariantFile(fallback_vcf, "wz", header=header) as vcf:
+            for record in records:
+                vcf.write(record)
 
-        cmd = f"{cmd_header} && {cmd_query}"
+        cmd = self._get_csq_command(input_vcf=fallback_vcf, output_vcf=fallback_csq_vcf)
         subprocess.run(cmd, shell=True, check=True)
 
-    def _parse_consequences(self):
+        consequences = {}
+        with pysam.VariantFile(fallback_csq_vcf) as vcf:
+            for record in vcf:
+                key = (record.chrom, record.pos, record.ref, record.alts)
+                consequences[key] = record.info.get("BCSQ")
+
+        os.remove(fallback_vcf)
+        os.remove(fallback_csq_vcf)
+
+        return consequences
+
+    def _run_with_table(self):
         """
-        Parse the consequenc string in the TSV
+        Annotate variant calls in a single pass, computing WSAF and joining
+        amplicons and SNV consequences from `self.consequence_table`;
+        `bcftools csq` is run only for variants not in the table,
+        such as indels, MNPs and intronic SNVs, and for variants
+        sharing a codon
+
+        """
+
+        table = self.consequence_table
+
+        with pysam.VariantFile(self.vcf_path) as vcf:
+            header = vcf.header.copy()
+            if "WSAF" not in header.formats:
+                header.formats.add("WSAF", ".", "Float", self.WSAF_DESCRIPTION)
+            if "AMP_ID" not in header.info:
+                header.info.add("AMP_ID", 1, "String", "Amplicon identifier")
+            records = []
+            for record in vcf:
+                record.translate(header)
+                self._set_wsaf(record)
+                records.append(record)
+
+        # Amplicons
+        amplicons = table.get_amplicons(
+            [r.chrom for r in records], [r.pos for r in records], [r.stop for r in records]
+        )
+        for record, amplicon in zip(records, amplicons):
+            if amplicon is not None:
+                record.info["AMP_ID"] = amplicon
+
+        # Join SNV consequences, one per alternative allele
+        snv_ixs = [
+            i
+            for i, r in enumerate(records)
+            if len(r.ref) == 1
+            and r.alts
+            and all(len(a) == 1 and a in "ACGT" for a in r.alts)
+        ]
+        keys = [(i, records[i].chrom, records[i].pos, a) for i in snv_ixs for a in records[i].alts]
+        found = table.lookup(
+            [k[1] for k in keys], [k[2] for k in keys], [k[3] for k in keys]
+        )
+        record_csqs = {i: [] for i in snv_ixs}
+        for (i, *_), csq_string in zip(keys, found):
+            record_csqs[i].append(csq_string)
+
+        # Variants sharing a codon are combined by `bcftools csq --phase a`,
+        # with the partners of the first marked `@<pos>`
+        variant_ixs = [
+            i
+            for i, r in enumerate(records)
+            if r.alts and any(not a.startswith("<") and a != "*" for a in r.alts)
+        ]
+        variant_codons = table.get_codons(
+            [records[i].chrom for i in variant_ixs],
+            [records[i].pos for i in variant_ixs],
+            [records[i].stop for i in variant_ixs],
+        )
+        codon_counts = Counter(c for codons in variant_codons for c in codons)
+        shared_ixs = {
+            i
+            for i, codons in zip(variant_ixs, variant_codons)
+            if any(codon_counts[c] > 1 for c in codons)
+        }
+
+        consequences = {}
+        fallback_records = []
+        for i, record in enumerate(records):
+            csq_strings = record_csqs.get(i, [None])
+            if None in csq_strings or i in shared_ixs:
+                fallback_records.append(record)
+                continue
+            csqs = [c for s in csq_strings for c in s.split(",") if c != "."]
+            consequences[i] = tuple(dict.fromkeys(csqs)) or None
+
+        # Fall back to `bcftools csq` for the remainder
+        if fallback_records:
+            print(f"  Running bcftools csq for {len(fallback_records)} variants...")
+            fallback = self._run_csq_fallback(fallback_records, header)
+            for i, record in enumerate(records):
+                if i not in consequences:
+                    key = (record.chrom, record.pos, record.ref, record.alts)
+                    consequences[i] = fallback.get(key)
+
+        # Write
+        output_header = header.copy()
+        if "BCSQ" not in output_header.info:
+            output_header.info.add("BCSQ", ".", "String", self.BCSQ_DESCRIPTION)
+        with pysam.VariantFile(self.output_vcf, "wz", header=output_header) as vcf:
+            for i, record in enumerate(records):
+                record.translate(output_header)
+                if consequences[i] is not None:
+                    record.info["BCSQ"] = consequences[i]
+                vcf.write(record)
 
-        TODO:
-        - What happens if there are NO mutations?
-        - Then CSQ is an empty list
+    def run(self):
+        """
+        Annotate variant calls with their WSAF, amplicon and consequence;
+        using the panel consequence table, if given, or otherwise
+        `bcftools csq`
 
         """
 
-        df = pd.read_csv(self.output_tsv, sep="\t")
-        csqs = [Consequence.from_string(c) for c in df["consequence"]]
-        if csqs:
-            mut_type, aa_change, aa_pos, strand = zip(
-                *[(c.csq, c.concise_aa_change, c.aa_pos, c.strand) for c in csqs]
-            )
+        if self.consequence_table is None:
+            self._run_bcftools()
         else:
-            print(f"No mutations passed quality control for {self.barcode_name}.")
-            mut_type, aa_change, aa_pos, strand = None, None, None, None
-
-        df.insert(6, "mut_type", mut_type)
-        df.insert(7, "aa_change", aa_change)
-        df.insert(8, "aa_pos", aa_pos)
-        df.insert(9, "strand", strand)
-        df.drop("consequence", axis=1, inplace=True)
-        df.to_csv(self.output_tsv, sep="\t", index=False)
+            self._run_with_table()
+
+    def _iter_sample_rows(self):
+        """
+        Iterate over (sample, site) rows of the annotated VCF, reading
+        it only once; values are formatted as by `bcftools query`, with
+        the consequence string parsed into its fields
+
+        """
+
+        with pysam.VariantFile(self.output_vcf) as vcf:
+            samples = list(vcf.header.samples)
+            sample_rows = {sample: [] for sample in samples}
+            for record in vcf:
+                csq = Consequence.from_string(
+                    format_info_value(record.info.get("BCSQ"))
+                )
+                fixed = [
+                    record.chrom,
+                    record.pos,
+                    record.ref,
+                    ",".join(record.alts) if record.alts else ".",
+                    format_number(record.qual),
+                    csq.csq,
+                    csq.concise_aa_change,
+                    csq.aa_pos,
+                    csq.strand,
+                    format_info_value(record.info.get("AMP_ID")),
+                ]
+                for sample in samples:
+                    call = record.samples[sample]
+                    sample_rows[sample].append(
+                        [sample]
+                        + fixed
+                        + [
+                            format_genotype(call.get("GT"), call.phased),
+                            format_number(call.get("GQ")),
+                            format_number(call.get("DP")),
+                            format_number(call.get("WSAF")),
+                        ]
+                    )
+
+        # Sample-major order, as in the per-sample queries
+        for sample in samples:
+            yield from sample_rows[sample]
 
     def convert_to_tsv(self):
         """
-        This is more preparing to merge across barcodes
+        Convert the annotated VCF file to a small table, in
+        long format with one row per sample and site, in preparation
+        for merging across barcodes and plotting
 
         """
 
-        self._convert_to_tsv()
-        self._parse_consequences()
+        df = pd.DataFrame(list(self._iter_sample_rows()), columns=self.TSV_COLUMNS)
+        if df.shape[0] == 0:
+            print(f"No mutations passed quality control for {self.output_vcf}.")
 
-        
\ No newline at end of file
+        for column in ["qual", "gq", "dp", "wsaf"]:
+            df[column] = pd.to_numeric(df[column])
+
+        df.to_csv(self.output_tsv, sep="\t", index=False)
@@ -1,9 +1,20 @@
 import os
+import copy
 import shutil
 import subprocess
+import pysam
 from abc import ABC, abstractmethod
+from typing import Dict
 from nomadic.lib.generic import produce_dir
 from nomadic.lib.process_vcfs import bcftools_reheader, bcftools_index
+from nomadic.lib.process_beds import load_bed, write_bed, write_padded_bed
+from nomadic.lib.sharding import (
+    count_region_reads,
+    get_threads_per_shard,
+    partition_by_weight,
+    run_in_pool,
+    concat_shard_vcfs,
+)
 
 
 # ================================================================
@@ -13,15 +24,77 @@ from nomadic.lib.process_vcfs import bcftools_reheader, bcftools_index
 
 
 class VariantCaller(ABC):
+    # Bases added either side of each region when calling is restricted,
+    # such that reads and context at amplicon edges are retained
+    REGION_PADDING = 100
+
     def __init__(self, fasta_path: str) -> None:
         self.fasta_path = fasta_path
         self.vcf_path = None
+        self.regions_path = None
+        self.threads = None
 
     @abstractmethod
     def _run(self, bam_path: str, vcf_path: str) -> None:
         pass
 
-    def run(self, bam_path: str, vcf_path: str, sample_name: str = None):
+    def set_regions(self, bed_path: str, output_bed: str, padding: int = None):
+        """
+        Restrict variant calling to the regions of `bed_path`, padded
+        by `padding` bases and merged; the calling regions are written
+        to `output_bed`
+
+        """
+        if padding is None:
+            padding = self.REGION_PADDING
+
+        write_padded_bed(bed_path, output_bed, padding=padding)
+        self.regions_path = output_bed
+
+    def _run_sharded(
+        self, bam_path: str, vcf_path: str, shards: int, threads: int
+    ) -> None:
+        """
+        Split the calling regions into `shards` groups, balanced by the
+        number of reads they contain, call each group with at most
+        `threads` running at once, and concatenate the results
+
+        """
+
+        # Balance regions, which are sorted, into contiguous shards
+        regions_df = load_bed(self.regions_path)
+        weights = count_region_reads(bam_path, regions_df)
+        shard_dir = produce_dir(vcf_path.replace(".vcf.gz", ".shards"))
+
+        # Each shard is called by a copy of the caller, restricted to its regions
+        # and sharing `threads` with the other shards running at once
+        jobs = []
+        shard_vcfs = []
+        partition = partition_by_weight(weights, shards)
+        threads_per_shard = get_threads_per_shard(len(partition), threads)
+        for j, ixs in enumerate(partition):
+            shard_caller = copy.copy(self)
+            shard_caller.threads = threads_per_shard
+            shard_caller.regions_path = f"{shard_dir}/shard{j:03d}.bed"
+            write_bed(regions_df.iloc[ixs], shard_caller.regions_path)
+            shard_vcf = f"{shard_dir}/shard{j:03d}.vcf.gz"
+            jobs.append((shard_caller, bam_path, shard_vcf))
+            shard_vcfs.append(shard_vcf)
+
+        run_in_pool(
+            lambda caller, bam, vcf: caller._run(bam, vcf), jobs, threads=threads
+        )
+        concat_shard_vcfs(shard_vcfs, vcf_path)
+        shutil.rmtree(shard_dir)
+
+    def run(
+        self,
+        bam_path: str,
+        vcf_path: str,
+        sample_name: str = None,
+        shards: int = 1,
+        threads: int = 1,
+    ):
         """
         Run core variant calling method
 
@@ -29,13 +102,20 @@ class VariantCaller(ABC):
         - Optionally adding sample name
         - Indexing the output VCF
 
+        Calling is restricted to regions if `.set_regions()` has been run;
+        these can then be called in `shards` in parallel, using up to
+        `threads` processes.
+
         """
 
         # Store
         self.vcf_path = vcf_path
 
         # Core method
-        self._run(bam_path, vcf_path)
+        if shards > 1 and self.regions_path is not None:
+            self._run_sharded(bam_path, vcf_path, shards, threads)
+        else:
+            self._run(bam_path, vcf_path)
 
         # Optionally name
         if sample_name is not None:
@@ -44,16 +124,53 @@ class VariantCaller(ABC):
         # Index
         bcftools_index(self.vcf_path)
 
-    def filter(self, 
-               output_vcf: str, 
-               bed_path: str,
-               min_depth: int = 50, 
-               #min_qual: int = 20,
-               to_biallelic: bool = False
-               ) -> None:
+    @staticmethod
+    def _is_biallelic_snp(record) -> bool:
+        """As `bcftools view --types='snps' --min-alleles 2 --max-alleles 2`"""
+
+        return (
+            record.alts is not None
+            and len(record.alts) == 1
+            and len(record.ref) == 1
+            and record.alts[0] in ["A", "C", "G", "T"]
+        )
+
+    def _get_output_header(self, vcf):
         """
-        Filters the output VCF to only regions contained within
-        `bed_path`; also optionally excludes sites below a threshold
+        Get the header for filtered outputs of `vcf`
+
+        htslib defines INFO/END on reading symbolic alleles, e.g. <*>,
+        so it is defined here up front.
+
+        """
+
+        header = pysam.VariantHeader()
+        for header_record in vcf.header.records:
+            header.add_record(header_record)
+        if "END" not in header.info:
+            header.info.add("END", 1, "Integer", "End position of the variant")
+        for sample in vcf.header.samples:
+            header.add_sample(sample)
+
+        return header
+
+    def filter_outputs(
+        self,
+        outputs: Dict[str, bool],
+        bed_path: str,
+        min_depth: int = 50,
+    ) -> None:
+        """
+        Filter the output VCF to only records overlapping regions of
+        `bed_path`, and set genotypes with depth below `min_depth` to missing,
+        as `bcftools view -R | bcftools filter -S .`
+
+        All outputs are written, and indexed, in a single pass over the VCF.
+
+        params
+            outputs: Dict[str, bool]
+                Path of each output VCF, and whether it should be
+                reduced to biallelic SNPs.
 
         """
 
@@ -61,27 +178,61 @@ class VariantCaller(ABC):
             raise ValueError("Must run variant calling before filtering.")
 
         self.MIN_DEPTH = min_depth
-        #self.MIN_QUAL = min_qual
 
-        cmd_view = "bcftools view"
-        cmd_view += f" -R {bed_path}"
-        if to_biallelic:
-            cmd_view += " --types='snps'"
-            cmd_view += " --min-alleles 2"
-            cmd_view += " --max-alleles 2"
-        cmd_view += f" {self.vcf_path}"
+        # Regions, by chromosome
+        bed_df = load_bed(bed_path)
+        regions = {
+            chrom: (chrom_df["start"].values, chrom_df["end"].values)
+            for chrom, chrom_df in bed_df.groupby("chrom")
+        }
+
+        with pysam.VariantFile(self.vcf_path) as vcf:
+            header = self._get_output_header(vcf)
+            output_files = {
+                output_vcf: pysam.VariantFile(output_vcf, "wz", header=header)
+                for output_vcf in outputs
+            }
+            for record in vcf:
+                if record.chrom not in regions:
+                    continue
+                starts, ends = regions[record.chrom]
+                if not ((starts < record.stop) & (ends > record.start)).any():
+                    continue
+                record.translate(header)
+
+                # Mask genotypes with low depth
+                for call in record.samples.values():
+                    dp, gt = call.get("DP"), call.get("GT")
+                    if dp is not None and dp < min_depth and gt is not None:
+                        call["GT"] = (None,) * len(gt)
+
+                is_biallelic = self._is_biallelic_snp(record)
+                for output_vcf, to_biallelic in outputs.items():
+                    if to_biallelic and not is_biallelic:
+                        continue
+                    output_files[output_vcf].write(record)
+
+            for output_file in output_files.values():
+                output_file.close()
 
-        cmd_filter = "bcftools filter"
-        cmd_filter += " -S ."
-        cmd_filter += f" -e 'FORMAT/DP<{self.MIN_DEPTH}'" # ||QUAL<{self.MIN_QUAL}'"
-        cmd_filter += f" -Oz -o {output_vcf} -"
+        # Index
+        for output_vcf in outputs:
+            pysam.tabix_index(output_vcf, preset="vcf", force=True, csi=True)
 
-        cmd = f"{cmd_view} | {cmd_filter}"
+    def filter(self, 
+               output_vcf: str, 
+               bed_path: str,
+               min_depth: int = 50, 
+               #min_qual: int = 20,
+               to_biallelic: bool = False
+               ) -> None:
+        """
+        Filters the output VCF to only regions contained within
+        `bed_path`; also optionally excludes sites below a threshold
 
-        subprocess.run(cmd, check=True, shell=True)
+        """
 
-        # Index
-        bcftools_index(output_vcf)
+        self.filter_outputs({output_vcf: to_biallelic}, bed_path, min_depth)
 
 
 # ================================================================
@@ -117,6 +268,9 @@ class BcfTools(VariantCaller):
 
         `-P` : Prior on mutation rate
 
+        If regions are set, `-R` restricts `bcftools mpileup` to them,
+        reading only the alignments that overlap.
+
         """
 
         cmd_pileup = "bcftools mpileup -Ou"
@@ -124,6 +278,8 @@ class BcfTools(VariantCaller):
         cmd_pileup += f" --annotate {self.ANNOTATE_MPILEUP}"
         cmd_pileup += f" --max-depth {self.MAX_DEPTH}"
         cmd_pileup += f" -f {self.fasta_path}"
+        if self.regions_path is not None:
+            cmd_pileup += f" -R {self.regions_path}"
         cmd_pileup += f" {bam_path}"
 
         # NB: We are returning *all* variants (not using -v)
@@ -146,6 +302,9 @@ class Clair3Singularity(VariantCaller):
 
     SIF_PATH = "/u/jash/containers/clair3_latest.sif"
 
+    # Threads per run, unless limited when calling in shards
+    THREADS = 4
+
     # In theory, the model should match the version of the basecalling
     # software (guppy/dorado) that was used
     MODEL = "/u/jash/projects/rerio/clair3_models/r1041_e82_400bps_sup_v420"
@@ -172,6 +331,9 @@ class Clair3Singularity(VariantCaller):
             self.vcf_dir,
             self.MODEL,
         ]
+        if self.regions_path is not None:
+            self.regions_path = os.path.abspath(self.regions_path)
+            self.dirs.append(os.path.dirname(self.regions_path))
 
     def _run(self, bam_path: str, vcf_path: str, sample_name: str = None) -> None:
 
@@ -184,12 +346,14 @@ class Clair3Singularity(VariantCaller):
         cmd += f" {self.SIF_PATH} /opt/bin/run_clair3.sh"
         cmd += f" --bam_fn={self.bam_path}"
         cmd += f" --ref_fn={self.fasta_path}"
-        cmd += f" --threads='4'"
+        cmd += f" --threads={self.threads or self.THREADS}"
         cmd += " --platform='ont'"
         # cmd += f" --model_path=/opt/models/{self.MODEL}"
         cmd += f" --model_path={self.MODEL}"
         cmd += f" --output {self.vcf_dir}"
         cmd += " --include_all_ctgs"
+        if self.regions_path is not None:
+            cmd += f" --bed_fn={self.regions_path}"
         cmd += " --enable_phasing"
 
         # NB: We are returning all variant calls, including 0/0
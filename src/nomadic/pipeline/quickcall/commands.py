@@ -1,5 +1,5 @@
 import click
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, sharding_options, jobs_option
 from .callers import caller_collection
 
 
@@ -21,10 +21,27 @@ from .callers import caller_collection
     required=False,
     help="Variant calling method.",
 )
+@click.option(
+    "-p",
+    "--padding",
+    type=int,
+    default=100,
+    show_default=True,
+    help="Bases added either side of each BED region when calling variants.",
+)
+@click.option(
+    "--bcftools_csq",
+    is_flag=True,
+    help="Annotate consequences by running `bcftools csq` on each VCF, rather than from a table of all SNVs in the panel.",
+)
+@sharding_options
+@jobs_option
 @click.option(
     "--overview", is_flag=True, help="Produce an overview across all barcodes."
 )
-def quickcall(expt_dir, config, barcode, bed_path, method, overview):
+def quickcall(
+    expt_dir, config, barcode, bed_path, method, padding, bcftools_csq, threads, shards, jobs, overview
+):
     """
     Quickly call variants and annotate them with a given
     variant calling method
@@ -32,5 +49,7 @@ def quickcall(expt_dir, config, barcode, bed_path, method, overview):
     """
     from .main import quickcall
 
-    quickcall(expt_dir, config, barcode, bed_path, method, overview)
+    quickcall(
+        expt_dir, config, barcode, bed_path, method, overview, padding, threads, shards, jobs, bcftools_csq
+    )
 
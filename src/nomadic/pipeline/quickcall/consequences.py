@@ -0,0 +1,432 @@
+import os
+import pickle
+import warnings
+import numpy as np
+import pandas as pd
+from nomadic.lib.generic import get_file_signature
+from nomadic.lib.process_beds import load_bed
+from nomadic.lib.references import Reference
+from nomadic.pipeline.find.gene import Gene, GeneModelStore
+
+
+# ================================================================
+# Consequences of single nucleotide variants in a gene
+#
+# ================================================================
+
+
+GENE_FEATURES = ["gene", "protein_coding_gene"]
+BIOTYPE = "protein_coding"
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+SPLICE_REGION_EXON = 3  # coding bases next to a splice site, as in `bcftools csq`
+
+
+def format_aa(aa: str) -> str:
+    """Stop codons are `_` in `Gene`, but `*` in `bcftools csq`"""
+    return "*" if aa == "_" else aa
+
+
+def get_codon_index(gene: Gene, pos: int):
+    """
+    Get the index of the codon containing `pos`, and of `pos` within it
+
+    returns
+        ix, cix: int, int
+            Or None, if `pos` is not within a complete codon.
+
+    """
+
+    lookup_ix = pos - gene.lookup_start
+    if not 0 <= lookup_ix < gene.codon_lookup.shape[0]:
+        return None
+
+    ix, cix = gene.codon_lookup[lookup_ix]
+    if ix < 0:
+        return None
+
+    return int(ix), int(cix)
+
+
+def get_splice_region(gene: Gene, n_bp: int = SPLICE_REGION_EXON) -> set:
+    """
+    Get the coding positions within `n_bp` of a splice site, where
+    `bcftools csq` adds `splice_region` to the consequence
+
+    """
+
+    cds_df = gene.cds_table.sort_values("start")
+    positions = set()
+    for start in cds_df["start"].iloc[1:]:
+        positions.update(range(start, start + n_bp))
+    for end in cds_df["end"].iloc[:-1]:
+        positions.update(range(end - n_bp + 1, end + 1))
+
+    return positions
+
+
+def get_snv_consequence(gene: Gene, gene_name: str, pos: int, ref: str, alt: str) -> str:
+    """
+    Get the consequence of substituting `ref` with `alt` at `pos`, formatted
+    as a `bcftools csq` BCSQ string, e.g.
+
+        missense|crt|PF3D7_0709000.1|protein_coding|-|76K>76T|403625T>G
+
+    returns
+        csq_string: str
+            The consequence, or None if `pos` is not within a complete codon.
+
+    """
+
+    codon = get_codon_index(gene, pos)
+    if codon is None:
+        return None
+
+    transcript = str(gene.cds_table.iloc[0]["parent"])
+    prefix = f"{gene_name}|{transcript}|{BIOTYPE}|{gene.strand}"
+
+    # Substitute into the codon, on the coding strand
+    ix, cix = codon
+    coding_alt = alt if gene.strand == "+" else alt.translate(COMPLEMENT)
+    ref_codon = gene.codon_nts[ix]
+    alt_codon = ref_codon[:cix] + coding_alt + ref_codon[cix + 1 :]
+    ref_aa = format_aa(gene.codon_aas[ix])
+    alt_aa = format_aa(Gene.genetic_code.get(alt_codon))
+    number = ix + 1
+
+    if ref_aa == alt_aa:
+        csq = "stop_retained" if ref_aa == "*" else "synonymous"
+        aa_change = f"{number}{ref_aa}"
+    else:
+        if number == 1 and ref_aa == "M":
+            csq = "start_lost"
+        elif alt_aa == "*":
+            csq = "stop_gained"
+        elif ref_aa == "*":
+            csq = "stop_lost"
+        else:
+            csq = "missense"
+        aa_change = f"{number}{ref_aa}>{number}{alt_aa}"
+
+    return f"{csq}|{prefix}|{aa_change}|{pos}{ref}>{alt}"
+
+
+# ================================================================
+# Table of all possible SNV consequences within a panel
+#
+# ================================================================
+
+
+class PanelConsequenceTable:
+    """
+    Consequences and amplicon IDs of all three possible SNVs at every
+    position of an amplicon panel, computed once from the reference
+
+    Variants can then be annotated by a join on (chrom, pos, alt),
+    rather than running `bcftools csq` over the reference for every
+    .vcf file. Only consequences that `bcftools csq` gives a lone SNV
+    are tabulated; positions that are untranslated, intronic, in a
+    splice region or in a gene with several transcripts are left
+    to `bcftools csq`. The codons of each position are kept such
+    that SNVs in the same codon can also be left to `bcftools csq`,
+    which combines them.
+
+    The table is cached on disk, keyed on the reference release,
+    the modification time and size of the .gff, .fasta and panel
+    .bed file, and `CACHE_VERSION`.
+
+    """
+
+    # Increment when the table changes, to invalidate cached tables
+    CACHE_VERSION = 1
+
+    def __init__(self, bed_path, gff_path, fasta_path, release=None, cache_path=None):
+        self.bed_path = bed_path
+        self.gff_path = gff_path
+        self.fasta_path = fasta_path
+        self.release = release
+        self.cache_path = cache_path
+
+        self.bed_df = None
+        self.table_df = None
+        self._codons = None
+
+    @classmethod
+    def from_reference(cls, reference: Reference, bed_path: str):
+        """
+        Initialise from a `Reference`, using the standardised .gff
+        given to `bcftools csq`, and caching the table next to it
+
+        """
+
+        bed_name = os.path.basename(bed_path).replace(".bed", "")
+
+        return cls(
+            bed_path=bed_path,
+            gff_path=reference.gff_standard_path,
+            fasta_path=reference.fasta_path,
+            release=getattr(reference, "release", None),
+            cache_path=f"{os.path.dirname(reference.gff_standard_path)}/{reference.name}.{bed_name}.consequences.pkl",
+        )
+
+    def _get_cache_key(self):
+        return {
+            "version": self.CACHE_VERSION,
+            "release": self.release,
+            "gff_path": self.gff_path,
+            "gff_signature": get_file_signature(self.gff_path),
+            "fasta_path": self.fasta_path,
+            "fasta_signature": get_file_signature(self.fasta_path),
+            "bed_path": self.bed_path,
+            "bed_signature": get_file_signature(self.bed_path),
+        }
+
+    def _get_genes(self, gene_store: GeneModelStore, genes_df: pd.DataFrame) -> list:
+        """
+        Get the `Gene`, name, start, end and splice region of each gene
+        in `genes_df`; the `Gene` is None if its consequences cannot be
+        tabulated
+
+        """
+
+        genes = []
+        for _, gene_row in genes_df.iterrows():
+            try:
+                gene = gene_store.get_gene(gene_row["ID"])
+            except AssertionError:
+                warnings.warn(f"Could not build gene model for {gene_row['ID']}. Skipping.")
+                continue
+            gene_name = gene_row["name"] if pd.notna(gene_row["name"]) else gene_row["ID"]
+
+            # `Gene` joins the CDS of all transcripts
+            if gene.cds_table["parent"].nunique() > 1:
+                genes.append((None, gene_name, gene_row["start"], gene_row["end"], None))
+                continue
+
+            splice_region = get_splice_region(gene)
+            genes.append((gene, gene_name, gene_row["start"], gene_row["end"], splice_region))
+
+        return genes
+
+    def build(self, gene_store: GeneModelStore = None):
+        """
+        Enumerate and annotate every SNV within the panel
+
+        """
+
+        is_own_store = gene_store is None
+        if is_own_store:
+            gene_store = GeneModelStore(self.gff_path, self.fasta_path, self.release)
+
+        self.bed_df = load_bed(self.bed_path, with_name=True)
+        genes_df = gene_store.gff.query("feature in @GENE_FEATURES")
+
+        rows = []
+        for chrom, start, end, amplicon in self.bed_df.itertuples(index=False):
+            # Genes overlapping the amplicon
+            overlap_df = genes_df.query(
+                "seqname == @chrom and start <= @end and end > @start"
+            )
+            genes = self._get_genes(gene_store, overlap_df)
+
+            seq = gene_store.fasta.fetch(chrom, start, end).upper()
+            for pos, ref in enumerate(seq, start + 1):
+                if ref not in "ACGT":
+                    continue
+
+                # Codons of the position; its consequences are left to
+                # `bcftools csq` if it is within a gene but not a codon
+                codons = []
+                coding_genes = []
+                is_tabulated = True
+                for gene, gene_name, gene_start, gene_end, splice_region in genes:
+                    if not gene_start <= pos <= gene_end:
+                        continue
+                    codon = get_codon_index(gene, pos) if gene is not None else None
+                    if codon is None:
+                        is_tabulated = False
+                        continue
+                    transcript = str(gene.cds_table.iloc[0]["parent"])
+                    codons.append(f"{transcript}:{codon[0] + 1}")
+                    coding_genes.append((gene, gene_name))
+                    if pos in splice_region:
+                        is_tabulated = False
+
+                for alt in "ACGT":
+                    if alt == ref:
+                        continue
+                    consequence = None
+                    if is_tabulated:
+                        csqs = [
+                            get_snv_consequence(gene, gene_name, pos, ref, alt)
+                            for gene, gene_name in coding_genes
+                        ]
+                        consequence = ",".join(csqs) if csqs else "."
+                    rows.append(
+                        (chrom, pos, ref, alt, consequence, ",".join(codons) or None, amplicon)
+                    )
+
+        if is_own_store:
+            gene_store.close()
+
+        # Compact; strings are stored as categories
+        table_df = pd.DataFrame(
+            rows, columns=["chrom", "pos", "ref", "alt", "consequence", "codon", "amplicon"]
+        )
+        table_df.drop_duplicates(["chrom", "pos", "alt"], inplace=True)
+        for column in ["chrom", "ref", "alt", "consequence", "codon", "amplicon"]:
+            table_df[column] = table_df[column].astype("category")
+        table_df.index = pd.MultiIndex.from_arrays(
+            [table_df["chrom"].astype(str), table_df["pos"], table_df["alt"].astype(str)]
+        )
+        self.table_df = table_df.sort_index()
+        self._codons = None
+
+        return self
+
+    def load(self):
+        """
+        Load the table from the cache, if it exists and matches the reference
+
+        returns
+            _ : bool
+                Whether the table was loaded.
+
+        """
+
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return False
+
+        try:
+            with open(self.cache_path, "rb") as cache:
+                cached = pickle.load(cache)
+        except Exception:
+            return False
+
+        if cached["key"] != self._get_cache_key():
+            return False
+
+        self.bed_df = cached["bed_df"]
+        self.table_df = cached["table_df"]
+        self._codons = None
+
+        return True
+
+    def save(self):
+        """Save the table to the cache, if it has been built"""
+
+        if self.cache_path is None or self.table_df is None:
+            return None
+
+        try:
+            with open(self.cache_path, "wb") as cache:
+                pickle.dump(
+                    {
+                        "key": self._get_cache_key(),
+                        "bed_df": self.bed_df,
+                        "table_df": self.table_df,
+                    },
+                    cache,
+                )
+        except OSError:
+            pass
+
+        return None
+
+    def lookup(self, chroms, positions, alts):
+        """
+        Look up the consequence strings of a batch of SNVs
+
+        returns
+            consequences: ndarray, str or None, shape (n_snvs, )
+                BCSQ string of each SNV, '.' if outside of any gene,
+                or None if the SNV is not within the panel, or its
+                consequence is left to `bcftools csq`.
+
+        """
+
+        keys = pd.MultiIndex.from_arrays(
+            [
+                np.asarray(chroms, dtype=object),
+                np.asarray(positions, dtype="int64"),
+                np.asarray(alts, dtype=object),
+            ]
+        )
+        consequences = self.table_df["consequence"].reindex(keys)
+
+        return np.where(consequences.isna(), None, consequences.astype(object))
+
+    def get_codons(self, chroms, starts, ends):
+        """
+        Get the codons overlapped by each of a batch of variants,
+        spanning 1-based `starts` to `ends` inclusive, as
+        `<transcript>:<codon number>` strings
+
+        returns
+            codons: list of set, shape (n_variants, )
+
+        """
+
+        if self._codons is None:
+            codons = self.table_df["codon"].astype(object)
+            codons = codons[codons.notna()]
+            self._codons = codons.groupby(level=[0, 1]).first()
+
+        keys = [
+            (chrom, pos)
+            for chrom, start, end in zip(chroms, starts, ends)
+            for pos in range(start, end + 1)
+        ]
+        if not keys:
+            return [set() for _ in starts]
+        found = self._codons.reindex(pd.MultiIndex.from_tuples(keys))
+
+        codons = []
+        ix = 0
+        for start, end in zip(starts, ends):
+            n = end - start + 1
+            codons.append(
+                {c for value in found.iloc[ix : ix + n].dropna() for c in value.split(",")}
+            )
+            ix += n
+
+        return codons
+
+    def get_amplicons(self, chroms, starts, ends):
+        """
+        Get the ID of the first amplicon overlapping each of a batch
+        of variants, spanning 1-based `starts` to `ends` inclusive
+
+        returns
+            amplicons: ndarray, str or None, shape (n_variants, )
+
+        """
+
+        chroms = np.asarray(chroms, dtype=object)
+        starts = np.asarray(starts, dtype="int64")
+        ends = np.asarray(ends, dtype="int64")
+
+        amplicons = np.full(len(chroms), None, dtype=object)
+        for chrom, start, end, amplicon in self.bed_df.itertuples(index=False):
+            is_overlap = (chroms == chrom) & (start < ends) & (end >= starts)
+            amplicons[is_overlap & (amplicons == None)] = str(amplicon)  # noqa: E711
+
+        return amplicons
+
+
+def load_consequence_table(reference: Reference, bed_path: str):
+    """
+    Load the consequence table of the panel in `bed_path` from its
+    cache, building and caching it first if necessary
+
+    """
+
+    table = PanelConsequenceTable.from_reference(reference, bed_path)
+    if table.load():
+        return table
+
+    print("Building panel consequence table...")
+    table.build()
+    table.save()
+    print(f"  No. SNVs: {table.table_df.shape[0]}")
+
+    return table
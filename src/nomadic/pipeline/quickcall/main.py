@@ -2,27 +2,92 @@ import os
 import warnings
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import PlasmodiumFalciparum3D7
 from .callers import caller_collection
 from .annotator import VariantAnnotator
-from .merger import VariantMerger
+from .consequences import load_consequence_table
+from .store import CohortStore
 
 
 # from nomadic.lib.process_vcfs import bcftools_view, bcftools_concat, bcftools_sort, bcftools_index
 
-def quickcall(expt_dir: str, config: str, barcode: str, bed_path: str, method: str, overview: bool=False) -> None:
+def quickcall(expt_dir: str, config: str, barcode: str, bed_path: str, method: str, overview: bool=False, padding: int=None, threads: int=1, shards: int=None, jobs: int=1, bcftools_csq: bool=False) -> None:
     if overview:
-        quickcall_merge(expt_dir, config, bed_path, method)
+        quickcall_merge(expt_dir, config, bed_path, method, bcftools_csq)
     else:
-        quickcall_single(expt_dir, config, barcode, bed_path, method)
+        quickcall_single(expt_dir, config, barcode, bed_path, method, padding, threads, shards, jobs, bcftools_csq)
 
 
 
-def quickcall_single(expt_dir: str, config: str, barcode: str, bed_path: str, method: str) -> None:
+def quickcall_barcode(barcode: str, params: dict, script_dir: str, method: str, reference, bed_path: str, consequence_table, padding: int=None, threads: int=1, shards: int=1) -> None:
+    """
+    Call, filter and annotate variants for a single barcode
+
+    """
+
+    # Define input and output directory
+    print(f"Running {method} for: {barcode}")
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    input_dir = f"{barcode_dir}/bams"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Path to *complete* bam file
+    bam_path = f"{input_dir}/{barcode}.{reference.name}.final.sorted.bam"
+    vcf_path = f"{output_dir}/{barcode}.{reference.name}.{method}.unfiltered.vcf.gz"
+
+    # TODO:
+    # -> I *could* and probably *should* filter at this point
+
+    # Get variant caller and call
+    CallingMethod = caller_collection[method]
+    caller = CallingMethod(fasta_path=reference.fasta_path)
+    caller.set_regions(
+        bed_path,
+        output_bed=vcf_path.replace(".unfiltered.vcf.gz", ".regions.bed"),
+        padding=padding
+    )
+
+    print("Calling variants...")
+    caller.run(bam_path, vcf_path, sample_name=barcode, shards=shards, threads=threads)
+    print("Done.")
+    print("")
+
+    print("Filtering variants...")
+    filtered_vcf = vcf_path.replace(".unfiltered.vcf.gz", ".filtered.vcf.gz")
+    biallelic_vcf = vcf_path.replace(".unfiltered.vcf.gz", ".biallelic.filtered.vcf.gz")
+    caller.filter_outputs(
+        {filtered_vcf: False, biallelic_vcf: True},  # reduce to biallelic?
+        bed_path=bed_path
+    )
+
+    # Annotation
+    print("Annotating variants...")
+    annotator = VariantAnnotator(
+        biallelic_vcf, # Note that we annotated only filtered VCF
+        bed_path,
+        reference,
+        output_dir=output_dir,
+        consequence_table=consequence_table
+    )
+    annotator.run()
+    annotator.convert_to_tsv()
+    print("Done.")
+    print("")
+
+
+def quickcall_single(expt_dir: str, config: str, barcode: str, bed_path: str, method: str, padding: int=None, threads: int=1, shards: int=None, jobs: int=1, bcftools_csq: bool=False) -> None:
     """
     Effectively an improved approach to variant calling
     vs. the old `call`
 
+    Calling is restricted to the regions in `bed_path`, padded
+    by `padding` bases, and split into `shards` that are run
+    using up to `threads` processes. Barcodes are run `jobs` at a time.
+    Consequences are joined from a table of all SNVs in the panel,
+    unless `bcftools_csq`, in which case `bcftools csq` is run on
+    every VCF.
+
     NB:
     - Now we are *not* necessarily filtering the BAM file
     of chimeric or secondary reads
@@ -41,61 +106,33 @@ def quickcall_single(expt_dir: str, config: str, barcode: str, bed_path: str, me
     # Define reference genome
     reference = PlasmodiumFalciparum3D7()
 
+    # Consequences of all SNVs in the panel, built once
+    consequence_table = None
+    if not bcftools_csq:
+        consequence_table = load_consequence_table(reference, bed_path)
+
+    # One shard per thread, unless specified
+    if shards is None:
+        shards = threads
+
     # Focus on a single barcode, if specified
     if "focus_barcode" in params:
         params["barcodes"] = [params["focus_barcode"]]
 
     # Iterate over barcodes
-    for barcode in params["barcodes"]:
-        # Define input and output directory
-        print("-" * 80)
-        print(f"Running {method} for: {barcode}")
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        input_dir = f"{barcode_dir}/bams"
-        output_dir = produce_dir(barcode_dir, script_dir)
-
-        # Path to *complete* bam file
-        bam_path = f"{input_dir}/{barcode}.{reference.name}.final.sorted.bam"
-        vcf_path = f"{output_dir}/{barcode}.{reference.name}.{method}.unfiltered.vcf.gz"
-
-        # TODO:
-        # -> I *could* and probably *should* filter at this point
-
-        # Get variant caller and call
-        CallingMethod = caller_collection[method]
-        caller = CallingMethod(fasta_path=reference.fasta_path)
-
-        print("Calling variants...")
-        caller.run(bam_path, vcf_path, sample_name=barcode)
-        print("Done.")
-        print("")
-
-        print("Filtering variants...")
-        filtered_vcf = vcf_path.replace(".unfiltered.vcf.gz", ".filtered.vcf.gz")
-        caller.filter(output_vcf=filtered_vcf, bed_path=bed_path)
-
-        print("Reducing to biallelic...")
-        biallelic_vcf = vcf_path.replace(".unfiltered.vcf.gz", ".biallelic.filtered.vcf.gz")
-        caller.filter(output_vcf=biallelic_vcf, to_biallelic=True, bed_path=bed_path)
-
-        # Annotation
-        print("Annotating variants...")
-        annotator = VariantAnnotator(
-            biallelic_vcf, # Note that we annotated only filtered VCF
-            bed_path,
-            reference,
-            output_dir=output_dir
-        )
-        annotator.run()
-        annotator.convert_to_tsv()
-        print("Done.")
-        print("")
+    run_barcodes(
+        quickcall_barcode,
+        params["barcodes"],
+        args=(params, script_dir, method, reference, bed_path, consequence_table, padding, threads, shards),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/quickcall",
+    )
 
     print_footer(t0)
 
 
 
-def quickcall_merge(expt_dir: str, config: str, bed_path: str, method: str) -> None:
+def quickcall_merge(expt_dir: str, config: str, bed_path: str, method: str, bcftools_csq: bool=False) -> None:
     """
     Merge the VCF files and write a final TSV
     
@@ -110,6 +147,11 @@ def quickcall_merge(expt_dir: str, config: str, bed_path: str, method: str) -> N
     # Define reference genome
     reference = PlasmodiumFalciparum3D7()
 
+    # Consequences of all SNVs in the panel, built once
+    consequence_table = None
+    if not bcftools_csq:
+        consequence_table = load_consequence_table(reference, bed_path)
+
     # Iterate over barcodes
     vcfs = []
     for barcode in params["barcodes"]:
@@ -129,10 +171,16 @@ def quickcall_merge(expt_dir: str, config: str, bed_path: str, method: str) -> N
 
     print(f"Found {len(vcfs)} total.")
 
-    # Merging
+    # Add new or updated barcodes to the cohort store, then export
+    print("Updating cohort store...")
+    store = CohortStore(f"{output_dir}/cohort", bed_path)
+    added = store.add_vcfs(vcfs)
+    print(f"  Added {len(added)} samples; {len(store.samples)} total.")
+    print(f"  Sites: {store.n_sites}")
     output_vcf = f"{output_dir}/merged.vcf.gz"
-    merger = VariantMerger(vcfs)
-    merger.run(output_vcf)
+    store.export_vcf(output_vcf, samples=store.get_samples(vcfs))
+    print("Done.")
+    print("")
 
     # Annotation
     print("Annotating variants...")
@@ -140,7 +188,8 @@ def quickcall_merge(expt_dir: str, config: str, bed_path: str, method: str) -> N
         output_vcf, # Note that we annotated only filtered VCF
         bed_path,
         reference,
-        output_dir=output_dir
+        output_dir=output_dir,
+        consequence_table=consequence_table
     )
     annotator.run()
     annotator.convert_to_tsv()
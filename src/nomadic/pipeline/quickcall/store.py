@@ -0,0 +1,529 @@
+import os
+import glob
+import pysam
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from nomadic.lib.generic import produce_dir, get_file_signature
+from nomadic.lib.process_beds import load_bed
+
+
+# ================================================================
+# Persistent store of genotypes across a cohort
+#
+# ================================================================
+
+
+class CohortStore:
+    """
+    Store GT, GQ, DP and AD of every sample at every SNV called in
+    the cohort, as sites x samples arrays on disk
+
+    As in `bcftools merge`, reference-only records (ALT `.`) are kept, with
+    alternative allele `.`, and provide the calls of their sample at any SNV
+    at the same position. Multi-allelic records are kept, with alternative
+    alleles joined by `,`, such that their position is excluded on export.
+
+    Samples are appended in chunks, one per call to `add_vcfs()`; each
+    chunk holds arrays over the sites known when it was written, and
+    sites discovered later are missing for the samples of earlier chunks.
+    Adding samples therefore only reads their own .vcf files, and the
+    store can be queried by amplicon or sample, or exported to a .vcf
+    file, without re-merging the cohort. Sites are assigned to the
+    amplicons of `bed_path`, if given, which is re-read on every load,
+    such that assignments follow changes to the .bed file.
+
+    Layout of `store_dir`:
+        sites.csv           Site index; chrom, pos, ref, alt, qual, amplicon
+        samples.csv         Sample index; source .vcf and its modification
+                            time (ns) and size, chunk and column
+        contigs.csv         Contig names and lengths, for export
+        chunks/chunk.N.npz  Arrays of shape (n_sites, n_samples[, 2])
+
+    """
+
+    SITE_COLUMNS = ["chrom", "pos", "ref", "alt", "qual", "amplicon"]
+    SAMPLE_COLUMNS = ["sample", "vcf_path", "mtime_ns", "size", "chunk", "column"]
+    FIELDS = ["gt", "gq", "dp", "ad"]
+
+    # Missing values; for GT, `ABSENT` marks the second allele of haploid calls
+    MISSING = -1
+    ABSENT = -2
+
+    # Alternative allele of sites from reference-only records
+    REF_ALT = "."
+
+    # Filtering on export, as in `VariantMerger`
+    DEPTH_MIN = 50
+
+    def __init__(self, store_dir: str, bed_path: str = None):
+        self.store_dir = produce_dir(store_dir)
+        self.chunk_dir = produce_dir(store_dir, "chunks")
+        self.bed_path = bed_path
+
+        self.sites_df = pd.DataFrame(columns=self.SITE_COLUMNS)
+        self.samples_df = pd.DataFrame(columns=self.SAMPLE_COLUMNS)
+        self.contigs_df = pd.DataFrame(columns=["contig", "length"])
+        self.site_lookup = {}
+
+        self._chunks = {}
+
+        self.load()
+
+    def load(self) -> None:
+        """Load the site, sample and contig indexes, if they exist"""
+
+        sites_csv = f"{self.store_dir}/sites.csv"
+        if os.path.exists(sites_csv):
+            self.sites_df = pd.read_csv(sites_csv, dtype={"chrom": str, "amplicon": str})
+            self.samples_df = pd.read_csv(
+                f"{self.store_dir}/samples.csv", dtype={"sample": str}
+            ).reindex(columns=self.SAMPLE_COLUMNS)
+            self.contigs_df = pd.read_csv(f"{self.store_dir}/contigs.csv")
+
+            # Follow any change to the .bed file
+            if self.bed_path is not None:
+                amplicons = self._assign_amplicons(self.sites_df)
+                if not amplicons.fillna("").equals(self.sites_df["amplicon"].fillna("")):
+                    self.sites_df["amplicon"] = amplicons
+                    self.save()
+
+        self.site_lookup = {
+            key: ix
+            for ix, key in enumerate(
+                self.sites_df[["chrom", "pos", "ref", "alt"]].itertuples(index=False, name=None)
+            )
+        }
+
+    def save(self) -> None:
+        """Write the site, sample and contig indexes"""
+
+        self.sites_df.to_csv(f"{self.store_dir}/sites.csv", index=False)
+        self.samples_df.to_csv(f"{self.store_dir}/samples.csv", index=False)
+        self.contigs_df.to_csv(f"{self.store_dir}/contigs.csv", index=False)
+
+    @property
+    def n_sites(self) -> int:
+        return self.sites_df.shape[0]
+
+    @property
+    def samples(self) -> List[str]:
+        """Samples in the store; if a sample was re-added, its latest entry is used"""
+
+        return self.samples_df.drop_duplicates("sample", keep="last")["sample"].tolist()
+
+    def get_samples(self, vcf_paths: List[str]) -> List[str]:
+        """Samples whose latest entry is from one of `vcf_paths`, in their order"""
+
+        order = {vcf_path: ix for ix, vcf_path in enumerate(vcf_paths)}
+        latest_df = self.samples_df.drop_duplicates("sample", keep="last")
+        latest_df = latest_df.assign(order=latest_df["vcf_path"].map(order)).dropna(
+            subset=["order"]
+        )
+
+        return latest_df.sort_values("order", kind="stable")["sample"].tolist()
+
+    def _get_chunk_path(self, chunk: int) -> str:
+        return f"{self.chunk_dir}/chunk.{chunk:04d}.npz"
+
+    def _load_chunk(self, chunk: int) -> Dict[str, np.ndarray]:
+        """Load the arrays of a chunk, padded with missing values to all sites"""
+
+        if chunk not in self._chunks:
+            with np.load(self._get_chunk_path(chunk)) as npz:
+                self._chunks[chunk] = {field: npz[field] for field in self.FIELDS}
+
+        arrays = self._chunks[chunk]
+        n_new = self.n_sites - arrays["dp"].shape[0]
+        if n_new > 0:
+            arrays = {
+                field: np.concatenate(
+                    [arr, np.full((n_new,) + arr.shape[1:], self.MISSING, arr.dtype)]
+                )
+                for field, arr in arrays.items()
+            }
+            self._chunks[chunk] = arrays
+
+        return arrays
+
+    def _is_current(self, vcf_path: str) -> bool:
+        """Check if the samples of `vcf_path` are in the store and up-to-date"""
+
+        entries = self.samples_df.query("vcf_path == @vcf_path")
+        if entries.shape[0] == 0:
+            return False
+
+        latest = entries[["mtime_ns", "size"]].iloc[-1]
+
+        return tuple(latest) == get_file_signature(vcf_path)
+
+    def _get_site_ix(self, chrom: str, pos: int, ref: str, alt: str, qual: float) -> int:
+        """Get the index of a site, adding it if new"""
+
+        key = (chrom, pos, ref, alt)
+        if key not in self.site_lookup:
+            self.site_lookup[key] = len(self.site_lookup)
+            self._new_sites.append(
+                {"chrom": chrom, "pos": pos, "ref": ref, "alt": alt, "qual": qual}
+            )
+        elif qual is not None:
+            self._site_quals[self.site_lookup[key]] = max(
+                qual, self._site_quals.get(self.site_lookup[key], qual)
+            )
+
+        return self.site_lookup[key]
+
+    def _read_vcf(self, vcf_path: str):
+        """
+        Read the calls of every sample at the SNVs and reference-only
+        records of `vcf_path`
+
+        returns
+            samples: List[str]
+            calls: List[tuple]
+                (site_ix, sample_ix, gt, gq, dp, ad) for each call.
+
+        """
+
+        calls = []
+        with pysam.VariantFile(vcf_path) as vcf:
+            samples = list(vcf.header.samples)
+            for contig in vcf.header.contigs.values():
+                if contig.name not in self.contigs_df["contig"].values:
+                    self.contigs_df.loc[self.contigs_df.shape[0]] = [contig.name, contig.length]
+            for record in vcf:
+                if len(record.ref) != 1:
+                    continue
+                if record.alts is None:
+                    alt = self.REF_ALT
+                elif all(len(a) == 1 and a in "ACGT" for a in record.alts):
+                    alt = ",".join(record.alts)
+                else:
+                    continue
+                site_ix = self._get_site_ix(
+                    record.chrom, record.pos, record.ref, alt, record.qual
+                )
+                for sample_ix, call in enumerate(record.samples.values()):
+                    calls.append(
+                        (
+                            site_ix,
+                            sample_ix,
+                            call.get("GT"),
+                            call.get("GQ"),
+                            call.get("DP"),
+                            call.get("AD"),
+                        )
+                    )
+
+        return samples, calls
+
+    def _assign_amplicons(self, sites_df: pd.DataFrame) -> pd.Series:
+        """Assign each site to the first amplicon of `self.bed_path` containing it"""
+
+        amplicons = pd.Series(None, index=sites_df.index, dtype=object)
+        if self.bed_path is None:
+            return amplicons
+
+        for chrom, start, end, amplicon in load_bed(self.bed_path, with_name=True).itertuples(
+            index=False
+        ):
+            is_within = (
+                (sites_df["chrom"] == chrom)
+                & (sites_df["pos"] > start)
+                & (sites_df["pos"] <= end)
+                & amplicons.isna()
+            )
+            amplicons[is_within] = str(amplicon)
+
+        return amplicons
+
+    def add_vcfs(self, vcf_paths: List[str], force: bool = False) -> List[str]:
+        """
+        Append the samples of each .vcf file in `vcf_paths` to the store,
+        as a single new chunk; files whose samples are already in the store,
+        and have not been modified since, are skipped unless `force`
+
+        returns
+            added: List[str]
+                Names of the samples added.
+
+        """
+
+        vcf_paths = [v for v in vcf_paths if force or not self._is_current(v)]
+        if not vcf_paths:
+            return []
+
+        self._new_sites = []
+        self._site_quals = {}
+
+        # Read calls, extending the site index
+        sample_entries = []
+        sample_calls = []
+        for vcf_path in vcf_paths:
+            samples, calls = self._read_vcf(vcf_path)
+            column_offset = len(sample_entries)
+            for sample in samples:
+                sample_entries.append((sample, vcf_path, *get_file_signature(vcf_path)))
+            sample_calls.extend(
+                (site_ix, column_offset + sample_ix, *values)
+                for site_ix, sample_ix, *values in calls
+            )
+
+        # Update site index
+        if self._new_sites:
+            new_sites_df = pd.DataFrame(self._new_sites)
+            new_sites_df.index = range(self.n_sites, self.n_sites + new_sites_df.shape[0])
+            new_sites_df["amplicon"] = self._assign_amplicons(new_sites_df)
+            self.sites_df = pd.concat(
+                [self.sites_df, new_sites_df[self.SITE_COLUMNS]]
+            ).astype({"pos": "int64", "qual": "float64"})
+            self.sites_df.index = range(self.n_sites)
+        for site_ix, qual in self._site_quals.items():
+            if pd.isna(self.sites_df.at[site_ix, "qual"]) or qual > self.sites_df.at[site_ix, "qual"]:
+                self.sites_df.at[site_ix, "qual"] = qual
+
+        # Fill arrays of the new chunk
+        shape = (self.n_sites, len(sample_entries))
+        arrays = {
+            "gt": np.full(shape + (2,), self.MISSING, "int8"),
+            "gq": np.full(shape, self.MISSING, "int32"),
+            "dp": np.full(shape, self.MISSING, "int32"),
+            "ad": np.full(shape + (2,), self.MISSING, "int32"),
+        }
+        for site_ix, column, gt, gq, dp, ad in sample_calls:
+            if gt is not None:
+                alleles = [self.MISSING if a is None else a for a in gt[:2]]
+                alleles += [self.ABSENT] * (2 - len(alleles))
+                arrays["gt"][site_ix, column] = alleles
+            if gq is not None:
+                arrays["gq"][site_ix, column] = gq
+            if dp is not None:
+                arrays["dp"][site_ix, column] = dp
+            if ad is not None:
+                ad = [self.MISSING if a is None else a for a in ad[:2]]
+                arrays["ad"][site_ix, column] = ad + [0] * (2 - len(ad))
+
+        chunk = len(glob.glob(f"{self.chunk_dir}/chunk.*.npz"))
+        np.savez_compressed(self._get_chunk_path(chunk), **arrays)
+        self._chunks[chunk] = arrays
+
+        # Update sample index
+        new_samples_df = pd.DataFrame(
+            [
+                (sample, vcf_path, mtime_ns, size, chunk, column)
+                for column, (sample, vcf_path, mtime_ns, size) in enumerate(sample_entries)
+            ],
+            columns=self.SAMPLE_COLUMNS,
+        )
+        self.samples_df = pd.concat([self.samples_df, new_samples_df], ignore_index=True)
+        self.save()
+
+        return new_samples_df["sample"].tolist()
+
+    def _get_site_ixs(self, amplicon: str = None) -> np.ndarray:
+        """Get the indices of SNV sites, i.e. excluding reference sites"""
+
+        is_snv = self.sites_df["alt"] != self.REF_ALT
+        if amplicon is not None:
+            is_snv &= self.sites_df["amplicon"] == amplicon
+        return np.flatnonzero(is_snv)
+
+    def _get_ref_site_ixs(self, site_ixs: np.ndarray) -> np.ndarray:
+        """Get the index of the reference site at the position of each site, or -1"""
+
+        ref_ixs = np.flatnonzero(self.sites_df["alt"] == self.REF_ALT)
+        ref_df = self.sites_df.iloc[ref_ixs]
+        ref_lookup = dict(zip(zip(ref_df["chrom"], ref_df["pos"]), ref_ixs))
+        sites_df = self.sites_df.iloc[site_ixs]
+        positions = zip(sites_df["chrom"], sites_df["pos"])
+
+        return np.array([ref_lookup.get(key, -1) for key in positions], dtype="int64")
+
+    def get_arrays(
+        self, samples: List[str] = None, amplicon: str = None, fill_reference: bool = True
+    ):
+        """
+        Get GT, GQ, DP and AD arrays for a subset of `samples`, at
+        the SNV sites of an `amplicon`; only the chunks of the
+        requested samples are read
+
+        Unless not `fill_reference`, calls missing at a site are taken from
+        a reference-only record of the sample at the same position, if any,
+        as in `bcftools merge`.
+
+        returns
+            sites_df: DataFrame
+                The selected sites.
+            arrays: Dict[str, ndarray]
+                Arrays of shape (n_sites, n_samples[, 2]); missing values are -1.
+
+        """
+
+        latest_df = self.samples_df.drop_duplicates("sample", keep="last").set_index("sample")
+        if samples is None:
+            samples = latest_df.index.tolist()
+        missing = set(samples) - set(latest_df.index)
+        if missing:
+            raise ValueError(f"Samples not found in store: {', '.join(sorted(missing))}.")
+
+        site_ixs = self._get_site_ixs(amplicon)
+        ref_ixs = self._get_ref_site_ixs(site_ixs)
+        columns = {field: [] for field in self.FIELDS}
+        for sample in samples:
+            chunk, column = latest_df.loc[sample, ["chunk", "column"]]
+            chunk_arrays = self._load_chunk(int(chunk))
+            values = {
+                field: chunk_arrays[field][site_ixs, int(column)] for field in self.FIELDS
+            }
+
+            # Fill from reference-only records
+            if not fill_reference:
+                for field in self.FIELDS:
+                    columns[field].append(values[field])
+                continue
+            ref_values = {
+                field: chunk_arrays[field][ref_ixs, int(column)] for field in self.FIELDS
+            }
+            is_filled = (
+                (ref_ixs >= 0)
+                & (values["gt"] == self.MISSING).all(axis=1)
+                & (ref_values["gt"] != self.MISSING).any(axis=1)
+            )
+            for field in self.FIELDS:
+                values[field][is_filled] = ref_values[field][is_filled]
+                columns[field].append(values[field])
+
+        arrays = {
+            field: np.stack(columns[field], axis=1)
+            if columns[field]
+            else np.full((len(site_ixs), 0), self.MISSING)
+            for field in self.FIELDS
+        }
+
+        return self.sites_df.iloc[site_ixs], arrays
+
+    @classmethod
+    def calc_wsaf(cls, dp: np.ndarray, ad: np.ndarray) -> np.ndarray:
+        """
+        Compute WSAF from allelic depths, as in `VariantAnnotator`;
+        missing where depth is missing or zero
+
+        """
+
+        is_known = (dp > 0) & (ad[..., 0] >= 0)
+        wsaf = np.full(dp.shape, np.nan)
+        wsaf[is_known] = 1 - ad[..., 0][is_known] / dp[is_known]
+
+        return wsaf
+
+    @classmethod
+    def format_genotypes(cls, gt: np.ndarray) -> np.ndarray:
+        """Format GT arrays of shape (..., 2) as strings, e.g. 0/1"""
+
+        alleles = np.where(gt == cls.MISSING, ".", gt.astype(str)).astype(object)
+        is_haploid = gt[..., 1] == cls.ABSENT
+
+        return np.where(is_haploid, alleles[..., 0], alleles[..., 0] + "/" + alleles[..., 1])
+
+    def to_long_df(self, samples: List[str] = None, amplicon: str = None) -> pd.DataFrame:
+        """
+        Get calls in long format, one row per (sample, site), with
+        the columns of `VariantAnnotator.convert_to_tsv()` that are
+        held in the store
+
+        """
+
+        sites_df, arrays = self.get_arrays(samples, amplicon)
+        if samples is None:
+            samples = self.samples
+        n_sites, n_samples = arrays["dp"].shape
+
+        # Sample-major order
+        def flatten(arr):
+            return arr.swapaxes(0, 1).reshape((n_sites * n_samples,) + arr.shape[2:])
+
+        dp = arrays["dp"]
+        long_df = pd.concat([sites_df.reset_index(drop=True)] * n_samples, ignore_index=True)
+        long_df.insert(0, "sample", np.repeat(samples, n_sites))
+        long_df["gt"] = flatten(self.format_genotypes(arrays["gt"]))
+        long_df["gq"] = flatten(np.where(arrays["gq"] >= 0, arrays["gq"], np.nan))
+        long_df["dp"] = flatten(np.where(dp >= 0, dp, np.nan))
+        long_df["wsaf"] = flatten(self.calc_wsaf(dp, arrays["ad"]))
+
+        return long_df
+
+    def export_vcf(
+        self, output_vcf: str, samples: List[str] = None, min_depth: int = DEPTH_MIN
+    ) -> None:
+        """
+        Export the `samples` of the store to a .vcf file, as by `VariantMerger`
+        for their .vcf files: sites are kept only if called in any of `samples`,
+        with a maximum depth of at least `min_depth`, and with a single
+        alternative allele across `samples`, i.e. excluding positions of
+        multi-allelic records; genotypes with a depth below `min_depth`
+        are set to missing
+
+        """
+
+        sites_df, arrays = self.get_arrays(samples)
+        if samples is None:
+            samples = self.samples
+
+        # Sites with a record in any of `samples`
+        _, called = self.get_arrays(samples, fill_reference=False)
+        is_called = ((called["dp"] >= 0) | (called["gt"][..., 0] >= 0)).any(axis=1)
+        is_multiallelic = np.zeros(sites_df.shape[0], dtype=bool)
+        is_multiallelic[is_called] = sites_df.loc[is_called].duplicated(
+            ["chrom", "pos"], keep=False
+        ).values | sites_df.loc[is_called, "alt"].str.contains(",", regex=False).values
+
+        # Filter sites
+        dp = arrays["dp"]
+        is_kept = (
+            is_called
+            & (dp.max(axis=1, initial=self.MISSING) >= min_depth)
+            & ~is_multiallelic
+        )
+        contig_order = {c: i for i, c in enumerate(self.contigs_df["contig"])}
+        order = (
+            sites_df.assign(ix=np.arange(sites_df.shape[0]), o=sites_df["chrom"].map(contig_order))
+            .loc[is_kept]
+            .sort_values(["o", "pos"])["ix"]
+            .values
+        )
+
+        # Header
+        header = pysam.VariantHeader()
+        for contig, length in self.contigs_df.itertuples(index=False):
+            header.contigs.add(contig, length=None if pd.isna(length) else int(length))
+        header.formats.add("GT", 1, "String", "Genotype")
+        header.formats.add("GQ", 1, "Integer", "Phred-scaled Genotype Quality")
+        header.formats.add("DP", 1, "Integer", "Number of high-quality bases")
+        header.formats.add("AD", "R", "Integer", "Allelic depths (high-quality bases)")
+        for sample in samples:
+            header.add_sample(sample)
+
+        with pysam.VariantFile(output_vcf, "wz", header=header) as vcf:
+            for ix in order:
+                site = sites_df.iloc[ix]
+                record = vcf.new_record(
+                    contig=site["chrom"],
+                    start=int(site["pos"]) - 1,
+                    alleles=(site["ref"], site["alt"]),
+                    qual=None if pd.isna(site["qual"]) else float(site["qual"]),
+                    filter="PASS",
+                )
+                for j, sample in enumerate(samples):
+                    call = record.samples[sample]
+                    gt = arrays["gt"][ix, j]
+                    alleles = [None if a == self.MISSING else int(a) for a in gt if a != self.ABSENT]
+                    if dp[ix, j] < min_depth:
+                        alleles = [None] * len(alleles)
+                    call["GT"] = tuple(alleles)
+                    if arrays["gq"][ix, j] >= 0:
+                        call["GQ"] = int(arrays["gq"][ix, j])
+                    if dp[ix, j] >= 0:
+                        call["DP"] = int(dp[ix, j])
+                    if (arrays["ad"][ix, j] >= 0).all():
+                        call["AD"] = tuple(int(a) for a in arrays["ad"][ix, j])
+                vcf.write(record)
@@ -3,15 +3,49 @@ import subprocess
 
 from nomadic.lib.generic import print_header, print_footer
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.process_bams import samtools_index
 from nomadic.lib.references import (
     PlasmodiumFalciparum3D7,
     HomoSapiens,
 )
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 from nomadic.pipeline.map.mappers import MAPPER_COLLECTION
 
 
+# ================================================================
+# Remap a single barcode
+#
+# ================================================================
+
+
+def remap_barcode(barcode, params, script_dir, pf_reference, hs_reference, algorithm):
+    """
+    Remap the reads of a single barcode that failed to map to
+    `pf_reference` to `hs_reference`
+
+    """
+
+    # Define input and output bams
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}/{script_dir}"
+    input_bam = f"{barcode_dir}/{barcode}.{pf_reference.name}.final.sorted.bam"
+    output_bam = f"{barcode_dir}/{barcode}.{hs_reference.name}.final.sorted.bam"
+
+    # Instantiate mapper
+    mapper = MAPPER_COLLECTION[algorithm](hs_reference)
+
+    # Remap
+    print("Remapping to H.s...")
+    mapper.remap_from_bam(input_bam)
+    mapper.run(output_bam)
+
+    # Index
+    print("Indexing...")
+    samtools_index(input_bam=output_bam)
+    print("Done.")
+    print("")
+
+
 # ================================================================
 # Main script, run from `cli.py`
 #
@@ -21,6 +55,7 @@ from nomadic.pipeline.map.mappers import MAPPER_COLLECTION
 @click.command(short_help="Map unmapped reads to H.s.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "-a",
     "--algorithm",
@@ -28,7 +63,7 @@ from nomadic.pipeline.map.mappers import MAPPER_COLLECTION
     default="minimap2",
     help="Algorithm used to map reads."
 )
-def remap(expt_dir, config, barcode, algorithm):
+def remap(expt_dir, config, barcode, jobs, algorithm):
     """
     Remap all reads that failed to map to P.f. referece genome
     to human referece genome
@@ -51,27 +86,11 @@ def remap(expt_dir, config, barcode, algorithm):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # Define input and output bams
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}/{script_dir}"
-        input_bam = f"{barcode_dir}/{barcode}.{pf_reference.name}.final.sorted.bam"
-        output_bam = f"{barcode_dir}/{barcode}.{hs_reference.name}.final.sorted.bam"
-
-        # Instantiate mapper
-        mapper = MAPPER_COLLECTION[algorithm](hs_reference)
-
-        # Remap
-        print("Remapping to H.s...")
-        mapper.remap_from_bam(input_bam)
-        mapper.run(output_bam)
-
-        # Index
-        print("Indexing...")
-        samtools_index(input_bam=output_bam)
-        print("Done.")
-        print("")
+    run_barcodes(
+        remap_barcode,
+        params["barcodes"],
+        args=(params, script_dir, pf_reference, hs_reference, algorithm),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/remap",
+    )
     print_footer(t0)
@@ -1,19 +1,14 @@
-import os
 import pandas as pd
 
 import click
-from nomadic.pipeline.cli import experiment_options, barcode_option
+from nomadic.pipeline.cli import experiment_options, barcode_option, jobs_option
 
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.parsing import build_parameter_dict
+from nomadic.lib.parallel import run_barcodes
 from nomadic.lib.references import PlasmodiumFalciparum3D7
-from nomadic.lib.process_bams import (
-    samtools_view,
-    samtools_index,
-    bedtools_intersect,
-    summarise_bam_stats,
-)
-from .extraction import TargetFactory, write_bed_from_targets
+from .extraction import TargetFactory
+from .router import TargetReadRouter
 from .plot import plot_dataframe_heat, BalancePlotter
 from nomadic.pipeline.qcbams.commands import combine_barcode_dataframes
 
@@ -21,10 +16,11 @@ from nomadic.pipeline.qcbams.commands import combine_barcode_dataframes
 @click.command(short_help="Analyse amplicon targets.")
 @experiment_options
 @barcode_option
+@jobs_option
 @click.option(
     "--overview", is_flag=True, help="Produce an overview across all barcodes."
 )
-def targets(expt_dir, config, barcode, overview):
+def targets(expt_dir, config, barcode, jobs, overview):
     """
     Analyse reads overlapping a specific set of targets
 
@@ -32,7 +28,7 @@ def targets(expt_dir, config, barcode, overview):
     if overview:
         target_extraction_overview(expt_dir, config)
     else:
-        target_extraction(expt_dir, config, barcode)
+        target_extraction(expt_dir, config, barcode, jobs)
 
 
 def target_extraction_overview(expt_dir, config):
@@ -96,7 +92,46 @@ def target_extraction_overview(expt_dir, config):
     print_footer(t0)
 
 
-def target_extraction(expt_dir, config, barcode):
+def target_extraction_barcode(barcode, params, script_dir, reference, targets):
+    """
+    Extract reads overlapping a set of target genes
+    for a single barcode
+
+    """
+
+    # Prepare to compute per-barcode results
+    barcode_results = []
+
+    # Create output directory
+    barcode_dir = f"{params['barcodes_dir']}/{barcode}"
+    input_dir = f"{barcode_dir}/bams"
+    output_dir = produce_dir(barcode_dir, script_dir)
+
+    # Define input bam
+    input_bam_path = f"{input_dir}/{barcode}.{reference.name}.final.sorted.bam"
+
+    # Route mapped reads to every target they overlap, in a single pass
+    print("  Routing reads to targets...")
+    for target in targets:
+        print(f"\t{target.ID}\t{target.name}")
+    router = TargetReadRouter(targets=targets, output_dir=output_dir)
+    router.run(input_bam_path)
+    for dt in router.get_summaries():
+        dt["barcode"] = barcode
+        barcode_results.append(dt)
+    print("  Done.")
+    print("")
+
+    # Write barcode summary
+    print("Writing summary table...")
+    barcode_output_path = f"{output_dir}/table.extraction.summary.csv"
+    print(f"  to: {barcode_output_path}")
+    pd.DataFrame(barcode_results).to_csv(barcode_output_path, index=False)
+    print("  Done.")
+    print("")
+
+
+def target_extraction(expt_dir, config, barcode, jobs=1):
     """
     Extract reads overlapping a set of target genes,
     store summary statistics and write as new .bam files
@@ -124,89 +159,13 @@ def target_extraction(expt_dir, config, barcode):
 
     # ITERATE
     print("Iterating over barcodes...")
-    for barcode in params["barcodes"]:
-        print("." * 80)
-        print(f"Barcode: {barcode}")
-        print("." * 80)
-
-        # Prepare to compute per-barcode results
-        barcode_results = []
-
-        # Create output directory
-        barcode_dir = f"{params['barcodes_dir']}/{barcode}"
-        input_dir = f"{barcode_dir}/bams"
-        output_dir = produce_dir(barcode_dir, script_dir)
-
-        # Define input bam
-        input_bam_path = f"{input_dir}/{barcode}.{reference.name}.final.sorted.bam"
-
-        # Get mapped reads
-        mapped_bam_path = f"{output_dir}/reads.mapped.bam"
-        samtools_view(input_bam_path, "-F 0x904", mapped_bam_path)
-        samtools_index(mapped_bam_path)
-
-        print("  Iterating over targets...")
-        for target in targets:
-            print(f"\t{target.ID}\t{target.name}")
-
-            target_bam_path = f"{output_dir}/reads.target.{target.name}.bam"
-
-            print(f"\tFinding any overlapping reads...")
-            # Any overlap >=2000bp --> removed this to allow for short read overlapping
-            samtools_view(mapped_bam_path, f"{target.region}", target_bam_path) # "-m 2000"; can filter by size here
-            samtools_index(target_bam_path)
-
-            # Compute summary statistics
-            dt = summarise_bam_stats(target_bam_path)
-            dt.update(
-                {
-                    "barcode": barcode,
-                    "gene_id": target.ID,
-                    "gene_name": target.name,
-                    "overlap": "any",
-                }
-            )
-            barcode_results.append(dt)
-
-            # Write a temporary .bed file
-            temp_bed_path = target_bam_path.replace(".bam", ".bed")
-            write_bed_from_targets(targets=[target], bed_path=temp_bed_path)
-
-            # Find completely overlapping reads
-            print(f"\tFinding completely overlapping reads...")
-            complete_bam_path = target_bam_path.replace(".bam", ".complete.bam")
-            bedtools_intersect(
-                input_a=target_bam_path,
-                input_b=temp_bed_path,
-                args="-F 1.0",
-                output=complete_bam_path,
-            )
-            samtools_index(complete_bam_path)
-
-            # Remove .bed
-            os.remove(temp_bed_path)
-
-            # Compute summary statistics
-            dt = summarise_bam_stats(complete_bam_path)
-            dt.update(
-                {
-                    "barcode": barcode,
-                    "gene_id": target.ID,
-                    "gene_name": target.name,
-                    "overlap": "complete",
-                }
-            )
-            barcode_results.append(dt)
-            print("    Done.")
-            print("")
-
-        # Write barcode summary
-        print("Writing summary table...")
-        barcode_output_path = f"{output_dir}/table.extraction.summary.csv"
-        print(f"  to: {barcode_output_path}")
-        pd.DataFrame(barcode_results).to_csv(barcode_output_path, index=False)
-        print("  Done.")
-        print("")
+    run_barcodes(
+        target_extraction_barcode,
+        params["barcodes"],
+        args=(params, script_dir, reference, targets),
+        jobs=jobs,
+        log_dir=f"{params['nomadic_dir']}/logs/targets",
+    )
     print("Done.")
     print("")
     print_footer(t0)
@@ -84,7 +84,7 @@ class TargetFactory:
 
         # Reduce to `target_id` rows
         target_df = self.cds_df.loc[
-            [ID.startswith(target_id) for ID in self.cds_df["ID"]]
+            self.cds_df["ID"].str.startswith(target_id, na=False)
         ]
         assert target_df.shape[0] > 0, f"No CDS found for {target_id}."
 
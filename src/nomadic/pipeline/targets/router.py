@@ -0,0 +1,210 @@
+import pysam
+import numpy as np
+from typing import List
+from nomadic.lib.process_bams import samtools_index
+from .extraction import Target
+
+
+# ================================================================
+# Accumulate the summary statistics of `samtools stats`
+#
+# ================================================================
+
+
+class BamStatsAccumulator:
+    """
+    Accumulate, read by read, the statistics reported by
+    `summarise_bam_stats()` for a .bam containing only primary,
+    mapped reads
+
+    Values are rounded as they are printed by `samtools stats`.
+
+    """
+
+    def __init__(self):
+        self.n_reads = 0
+        self.bases_total = 0
+        self.bases_mapped = 0
+        self.sum_qual = 0
+        self.mismatches = 0
+
+    def add(self, query_length, bases_mapped, sum_qual, mismatches):
+        self.n_reads += 1
+        self.bases_total += query_length
+        self.bases_mapped += bases_mapped
+        self.sum_qual += sum_qual
+        self.mismatches += mismatches
+
+    def summarise(self):
+        """Return summary statistics as a dictionary"""
+
+        # `samtools stats` computes ratios in single precision
+        def ratio(numerator, denominator):
+            if not denominator:
+                return 0.0
+            return float(np.float32(numerator) / np.float32(denominator))
+
+        mean_read_length = ratio(self.bases_total, self.n_reads)
+        mean_read_qual = ratio(self.sum_qual, self.bases_total)
+        error_rate = ratio(self.mismatches, self.bases_mapped)
+
+        return {
+            "reads_total": float(self.n_reads),
+            "reads_mapped": float(self.n_reads),
+            "bases_total": float(self.bases_total),
+            "bases_mapped": float(self.bases_mapped),
+            "mean_read_length": float(f"{mean_read_length:.0f}"),
+            "mean_read_qual": float(f"{mean_read_qual:.1f}"),
+            "mismatches": float(self.mismatches),
+            "error_rate": float(f"{error_rate:e}"),
+        }
+
+
+# ================================================================
+# Route reads to all of the targets they overlap
+#
+# ================================================================
+
+
+class TargetReadRouter:
+    """
+    Route the primary, mapped reads of a .bam file to the .bam files
+    of every target they overlap, in a single pass
+
+    For each target, two .bam files are written:
+    - `reads.target.<name>.bam`, containing reads with any overlap,
+       equivalent to `samtools view <region>`;
+    - `reads.target.<name>.complete.bam`, containing reads spanning the
+       whole target, equivalent to `bedtools intersect -F 1.0` with the
+       BED written by `write_bed_from_targets()`.
+
+    Summary statistics for each are accumulated as reads are routed.
+
+    """
+
+    OVERLAP_TYPES = ["any", "complete"]
+    EXCLUDE_FLAGS = 0x904  # unmapped, secondary, supplementary
+    CIGAR_MAPPED_OPS = [0, 1, 7, 8]  # M, I, =, X
+
+    def __init__(self, targets: List[Target], output_dir: str):
+        self.targets = targets
+        self.output_dir = output_dir
+        self.bam_paths = {
+            (target.name, overlap): self._get_bam_path(target, overlap)
+            for target in targets
+            for overlap in self.OVERLAP_TYPES
+        }
+        self.stats = {key: BamStatsAccumulator() for key in self.bam_paths}
+        self._prepare_intervals()
+
+    def _get_bam_path(self, target, overlap):
+        suffix = ".complete.bam" if overlap == "complete" else ".bam"
+        return f"{self.output_dir}/reads.target.{target.name}{suffix}"
+
+    def _prepare_intervals(self):
+        """
+        Prepare arrays of target intervals for each chromosome, as
+        0-based, half-open coordinates
+
+        """
+
+        self.intervals = {}
+        for chrom in set(target.chrom for target in self.targets):
+            ixs = np.array([j for j, t in enumerate(self.targets) if t.chrom == chrom])
+            starts = np.array([self.targets[j].start for j in ixs])
+            ends = np.array([self.targets[j].end for j in ixs])
+            self.intervals[chrom] = {
+                "ixs": ixs,
+                "any_start": starts - 1,  # 1-based region string
+                "any_end": ends,
+                "complete_start": starts,  # written directly as BED start
+                "complete_end": ends,
+                "min_start": (starts - 1).min(),
+                "max_end": ends.max(),
+            }
+
+    def _get_read_stats(self, segment):
+        """Statistics of a single read, as counted by `samtools stats`"""
+
+        cigar_counts = segment.get_cigar_stats()[0]
+        qualities = segment.query_qualities
+
+        return (
+            segment.query_length,
+            sum(cigar_counts[op] for op in self.CIGAR_MAPPED_OPS),
+            int(np.frombuffer(qualities, "uint8").sum()) if qualities else 0,
+            segment.get_tag("NM") if segment.has_tag("NM") else 0,
+        )
+
+    def run(self, input_bam: str, index: bool = True) -> None:
+        """
+        Route reads from `input_bam`, which must be coordinate sorted,
+        and optionally index the outputs
+
+        """
+
+        with pysam.AlignmentFile(input_bam, "rb") as bam:
+            writers = {
+                key: pysam.AlignmentFile(path, "wb", template=bam)
+                for key, path in self.bam_paths.items()
+            }
+            try:
+                for chrom, intervals in self.intervals.items():
+                    if chrom not in bam.references:
+                        continue
+                    for segment in bam.fetch(
+                        chrom, intervals["min_start"], intervals["max_end"]
+                    ):
+                        if segment.flag & self.EXCLUDE_FLAGS:
+                            continue
+                        self._route(segment, intervals, writers)
+            finally:
+                for writer in writers.values():
+                    writer.close()
+
+        if index:
+            for path in self.bam_paths.values():
+                samtools_index(path)
+
+    def _route(self, segment, intervals, writers):
+        """Write `segment` to every target it overlaps, and store statistics"""
+
+        start = segment.reference_start
+        end = segment.reference_end
+
+        overlaps = {
+            "any": (start < intervals["any_end"]) & (end > intervals["any_start"]),
+            "complete": (start <= intervals["complete_start"])
+            & (end >= intervals["complete_end"]),
+        }
+        if not overlaps["any"].any():
+            return
+
+        read_stats = self._get_read_stats(segment)
+        for overlap, hits in overlaps.items():
+            for j in intervals["ixs"][hits]:
+                key = (self.targets[j].name, overlap)
+                writers[key].write(segment)
+                self.stats[key].add(*read_stats)
+
+    def get_summaries(self):
+        """
+        Return a list of summary statistic dictionaries, one for each target
+        and overlap type, in the format of `table.extraction.summary.csv`
+
+        """
+
+        summaries = []
+        for target in self.targets:
+            for overlap in self.OVERLAP_TYPES:
+                dt = self.stats[(target.name, overlap)].summarise()
+                dt.update(
+                    {
+                        "gene_id": target.ID,
+                        "gene_name": target.name,
+                        "overlap": overlap,
+                    }
+                )
+                summaries.append(dt)
+
+        return summaries
@@ -1,6 +1,7 @@
 import pandas as pd
 from collections import namedtuple
 from src.nomadic.lib.process_gffs import load_gff, add_gff_fields
+from src.nomadic.lib.intervals import IntervalIndex
 
 
 class SNPAnnotator:
@@ -20,6 +21,9 @@ class SNPAnnotator:
         
         self.genome_df = None    
         self.amplicon_df = None
+
+        self.genome_index = None
+        self.amplicon_index = None
         
         self.cds_sizes = None
         self.amplicon_sizes = None
@@ -61,6 +65,7 @@ class SNPAnnotator:
         # Filter to key features
         keep_features = ["CDS", "five_prime_UTR", "three_prime_UTR"]
         self.genome_df = df.query("feature in @keep_features")
+        self.genome_index = IntervalIndex.from_dataframe(self.genome_df)
         self._get_annotation_sizes()
 
         return None
@@ -98,6 +103,9 @@ class SNPAnnotator:
 
         # Save as dataframe
         self.amplicon_df = pd.DataFrame(amplicons)
+        self.amplicon_index = IntervalIndex.from_dataframe(
+            self.amplicon_df, chrom_col="seqname"
+        )
         #self._get_annotation_sizes()
 
         return None
@@ -128,21 +136,27 @@ class SNPAnnotator:
         return None
 
     
-    def _find_annotation(self, df, chrom, pos, annot_field="feature"):
-        """ Find annotations in a dataframe `df` """
-        
-        search = df.query(
-            "seqid == @chrom and start <= @pos <= end"
-        )
+    def _find_annotations(self, df, index, chroms, positions, annot_field="feature"):
+        """ 
+        Find annotations in a dataframe `df`, indexed by `index`, 
+        for a batch of SNPs
         
-        if search.shape[0] == 1:
-            annot = search.iloc[0][annot_field]
-        elif search.shape[0] == 0:
-            annot = "None"
-        else:
+        """
+
+        counts = index.count(chroms, positions)
+        if (counts > 1).any():
             raise Warning("More than one annotation found for this SNP!")
-            
-        return annot
+
+        first = index.find_first(chroms, positions)
+        values = df[annot_field].values
+
+        return [values[ix] if ix >= 0 else "None" for ix in first]
+
+
+    def _find_annotation(self, df, index, chrom, pos, annot_field="feature"):
+        """ Find annotations in a dataframe `df` """
+        
+        return self._find_annotations(df, index, [chrom], [pos], annot_field)[0]
         
     
     def annotate_snp_by_genome(self, chrom, pos, annot_field="feature"):
@@ -152,8 +166,19 @@ class SNPAnnotator:
         
         """
         
-        return self._find_annotation(self.genome_df, 
+        return self._find_annotation(self.genome_df, self.genome_index,
                                      chrom, pos, annot_field)
+
+
+    def annotate_snps_by_genome(self, chroms, positions, annot_field="feature"):
+        """ 
+        Annotate where a batch of SNPs are within the genome
+        based on their chromosomes and positions
+        
+        """
+        
+        return self._find_annotations(self.genome_df, self.genome_index,
+                                      chroms, positions, annot_field)
     
     
     def annotate_snp_by_amplicon(self, chrom, pos):
@@ -163,6 +188,18 @@ class SNPAnnotator:
         
         """
         
-        return self._find_annotation(self.amplicon_df, 
+        return self._find_annotation(self.amplicon_df, self.amplicon_index,
                                      chrom, pos, 
-                                     annot_field="name")
\ No newline at end of file
+                                     annot_field="name")
+
+
+    def annotate_snps_by_amplicon(self, chroms, positions):
+        """ 
+        Annotate whether a batch of SNPs are inside an amplicion 
+        based on their chromosomes and positions
+        
+        """
+        
+        return self._find_annotations(self.amplicon_df, self.amplicon_index,
+                                      chroms, positions, 
+                                      annot_field="name")
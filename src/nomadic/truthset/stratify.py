@@ -1,11 +1,13 @@
 import click
 import re
 import os
+import numpy as np
 import pandas as pd
 from collections import namedtuple
 
 from nomadic.lib.generic import print_header, print_footer, produce_dir
 from nomadic.lib.process_gffs import load_gff, add_gff_fields
+from nomadic.lib.statistics import get_run_lengths
 from nomadic.lib.references import (
     PlasmodiumFalciparum3D7,
     PlasmodiumFalciparumDd2,
@@ -66,26 +68,12 @@ def get_homopolymer_intervals(seq):
 
     """
 
-    # Storage
-    intervals = []
-
-    # Init
-    p = seq[0]
-    start = 0
-    stop = 1
-
-    # Iterate
-    for c in seq[1:]:
-        if c != p:
-            intervals.append(SeqInterval(start=start, stop=stop, label=stop - start))
-            start = stop
-            p = c
-        stop += 1
-
-    # Terminate
-    intervals.append(SeqInterval(start=start, stop=stop, label=stop - start))
+    starts, lengths = get_run_lengths(seq)
 
-    return intervals
+    return [
+        SeqInterval(start=start, stop=start + length, label=length)
+        for start, length in zip(starts.tolist(), lengths.tolist())
+    ]
 
 
 def collapse_adjacent_intervals(intervals):
@@ -126,32 +114,37 @@ def get_homopolymer_bed_df(chrom,
     """
 
     # Compute intervals
-    intervals = get_homopolymer_intervals(seq)
-    
+    starts, lengths = get_run_lengths(seq)
+    stops = starts + lengths
+    labels = lengths
+
     if bins is not None:
         # Bin the labels
-        df = pd.DataFrame(intervals)
-        df["binned_label"] = pd.cut(df["label"], bins=bins)
-
-        # hap.py doesn't handle spaces in Subsets
-        df["binned_label"] = [str(h).replace(", ", "_") for h in df["binned_label"]]
-        
-        # Change the intervals to carry the binned itervals
-        intervals = [
-            SeqInterval(start=row["start"], 
-                        stop=row["stop"],
-                        label=row["binned_label"]
-                       )
-            for _, row in df.iterrows()
-        ]
-
-    # Collapse based on intervals 
-    collapsed_intervals = collapse_adjacent_intervals(intervals)
+        binned = pd.cut(pd.Series(lengths), bins=bins)
+
+        # Format each bin once, from a series with one interval per bin;
+        # keeps the formatting pandas gives when iterating all of them
+        codes, first_ixs = np.unique(binned.cat.codes, return_index=True)
+        bin_labels = np.array(
+            # hap.py doesn't handle spaces in Subsets
+            [str(h).replace(", ", "_") for h in binned.iloc[first_ixs]],
+            dtype=object,
+        )
+        labels = bin_labels[np.searchsorted(codes, binned.cat.codes)]
+
+    # Collapse adjacent intervals with the same label
+    is_first = np.r_[True, labels[1:] != labels[:-1]]
+    collapsed_starts = starts[is_first]
 
     # Convert to dataframe
-    df = pd.DataFrame(collapsed_intervals)
-    df.insert(0, "chrom", chrom)
-    df.rename({"label": "hp_length"}, axis=1, inplace=True)
+    df = pd.DataFrame(
+        {
+            "chrom": chrom,
+            "start": collapsed_starts,
+            "stop": np.r_[collapsed_starts[1:], stops[-1]],
+            "hp_length": labels[is_first],
+        }
+    )
     
     # Add starting position
     df["start"] += start
@@ -0,0 +1,186 @@
+import pysam
+import pytest
+from nomadic.pipeline.quickcall.annotator import VariantAnnotator
+from nomadic.pipeline.quickcall.consequences import PanelConsequenceTable
+
+
+# ================================================================
+# A small reference, with one gene on each strand
+#
+# ================================================================
+
+
+CHROM = "chr1"
+
+# G1, + strand; CDS 51-62 and 81-98, i.e. codons 1-4 and 5-10
+G1_EXON1 = "ATGGCTAATTGG"
+G1_EXON2 = "CCCAAAGGGTTTCACTAA"
+
+# G2, - strand; CDS 201-230, given here on the coding strand
+G2_CODING = "ATGAATGAAGAATGGCCCAAAGGGTTTTAA"
+
+
+def reverse_complement(seq):
+    return seq.translate(str.maketrans("ACGT", "TGCA"))[::-1]
+
+
+@pytest.fixture
+def reference(tmp_path):
+    seq = ["C"] * 300
+    seq[50:62] = G1_EXON1
+    seq[62:80] = "GTAAGTTTTTTTTTTTAG"
+    seq[80:98] = G1_EXON2
+    seq[200:230] = reverse_complement(G2_CODING)
+
+    fasta_path = f"{tmp_path}/ref.fasta"
+    with open(fasta_path, "w") as fasta:
+        fasta.write(f">{CHROM}\n{''.join(seq)}\n")
+    pysam.faidx(fasta_path)
+
+    # As written by `_standardise_gff()`
+    rows = [
+        ("gene", 51, 98, "+", "ID=G1;Name=g1"),
+        ("transcript", 51, 98, "+", "ID=G1.1;Parent=G1"),
+        ("exon", 51, 62, "+", "ID=G1.1-E1;Parent=G1.1"),
+        ("CDS", 51, 62, "+", "ID=G1.1-CDS1;Parent=G1.1"),
+        ("exon", 81, 98, "+", "ID=G1.1-E2;Parent=G1.1"),
+        ("CDS", 81, 98, "+", "ID=G1.1-CDS2;Parent=G1.1"),
+        ("gene", 201, 230, "-", "ID=G2;Name=g2"),
+        ("transcript", 201, 230, "-", "ID=G2.1;Parent=G2"),
+        ("exon", 201, 230, "-", "ID=G2.1-E1;Parent=G2.1"),
+        ("CDS", 201, 230, "-", "ID=G2.1-CDS1;Parent=G2.1"),
+    ]
+    gff_path = f"{tmp_path}/ref.standardised.gff"
+    with open(gff_path, "w") as gff:
+        for feature, start, end, strand, attributes in rows:
+            fields = [CHROM, "test", feature, start, end, ".", strand, ".", attributes]
+            gff.write("\t".join(str(f) for f in fields) + "\n")
+
+    bed_path = f"{tmp_path}/panel.bed"
+    with open(bed_path, "w") as bed:
+        bed.write(f"{CHROM}\t10\t120\tamp1\n{CHROM}\t190\t240\tamp2\n")
+
+    return bed_path, gff_path, fasta_path
+
+
+@pytest.fixture
+def table(reference, tmp_path):
+    bed_path, gff_path, fasta_path = reference
+    return PanelConsequenceTable(
+        bed_path, gff_path, fasta_path, cache_path=f"{tmp_path}/consequences.pkl"
+    ).build()
+
+
+def lookup(table, pos, alt):
+    return table.lookup([CHROM], [pos], [alt])[0]
+
+
+# ================================================================
+# Tests
+#
+# ================================================================
+
+
+@pytest.mark.parametrize(
+    "pos, alt, expected",
+    [
+        # As output by `bcftools csq` for a lone SNV
+        (52, "C", "start_lost|g1|G1.1|protein_coding|+|1M>1T|52T>C"),
+        (55, "A", "missense|g1|G1.1|protein_coding|+|2A>2D|55C>A"),
+        (56, "C", "synonymous|g1|G1.1|protein_coding|+|2A|56T>C"),
+        (84, "T", "stop_gained|g1|G1.1|protein_coding|+|6K>6*|84A>T"),
+        (96, "C", "stop_lost|g1|G1.1|protein_coding|+|10*>10Q|96T>C"),
+        (227, "C", "missense|g2|G2.1|protein_coding|-|2N>2D|227T>C"),
+        (201, "C", "stop_retained|g2|G2.1|protein_coding|-|10*|201T>C"),
+        # Intergenic
+        (20, "A", "."),
+        # Splice region, intron, or outside the panel; left to `bcftools csq`
+        (61, "A", None),
+        (83, "A", None),
+        (70, "A", None),
+        (150, "A", None),
+    ],
+)
+def test_lookup(table, pos, alt, expected):
+    assert lookup(table, pos, alt) == expected
+
+
+def test_codons(table):
+    codons = table.get_codons([CHROM] * 4, [57, 59, 60, 70], [57, 59, 62, 72])
+
+    assert codons[0] == codons[1] == {"G1.1:3"}
+    assert codons[2] == {"G1.1:4"}
+    assert codons[3] == set()
+
+
+def test_cache(reference, table, tmp_path):
+    bed_path, gff_path, fasta_path = reference
+    table.save()
+
+    cached = PanelConsequenceTable(
+        bed_path, gff_path, fasta_path, cache_path=f"{tmp_path}/consequences.pkl"
+    )
+    assert cached.load()
+    assert cached.table_df.equals(table.table_df)
+
+    # Editing the panel invalidates the cache
+    with open(bed_path, "a") as bed:
+        bed.write(f"{CHROM}\t250\t260\tamp3\n")
+    assert not cached.load()
+
+
+def test_annotator_fallback(reference, table, tmp_path, monkeypatch):
+    """
+    Variants sharing a codon, and those not in the table, are left to
+    `bcftools csq`; the rest are annotated from the table alone
+
+    """
+    bed_path, gff_path, fasta_path = reference
+
+    header = pysam.VariantHeader()
+    header.contigs.add(CHROM, length=300)
+    header.formats.add("GT", 1, "String", "Genotype")
+    header.formats.add("DP", 1, "Integer", "Depth")
+    header.formats.add("AD", "R", "Integer", "Allelic depths")
+    header.add_sample("s1")
+
+    # crt N75E-like; AAT>GAA is two SNVs in codon 3 of G1
+    variants = [
+        (55, "C", "A"),
+        (57, "A", "G"),
+        (59, "T", "A"),
+        (70, "T", "A"),
+        (90, "G", "GA"),
+        (227, "T", "C"),
+    ]
+    vcf_path = f"{tmp_path}/calls.vcf.gz"
+    with pysam.VariantFile(vcf_path, "wz", header=header) as vcf:
+        for pos, ref, alt in variants:
+            record = vcf.new_record(contig=CHROM, start=pos - 1, alleles=(ref, alt))
+            record.samples["s1"]["GT"] = (1,)
+            record.samples["s1"]["DP"] = 100
+            record.samples["s1"]["AD"] = (20, 80)
+            vcf.write(record)
+
+    class Reference:
+        name = "test"
+
+    fallback_positions = []
+
+    def run_csq_fallback(self, records, header):
+        fallback_positions.extend(r.pos for r in records)
+        return {}
+
+    monkeypatch.setattr(VariantAnnotator, "_run_csq_fallback", run_csq_fallback)
+    annotator = VariantAnnotator(
+        vcf_path, bed_path, Reference(), f"{tmp_path}/output", consequence_table=table
+    )
+    annotator.run()
+
+    assert fallback_positions == [57, 59, 70, 90]
+    with pysam.VariantFile(annotator.output_vcf) as vcf:
+        records = {r.pos: r for r in vcf}
+    assert records[55].info["BCSQ"] == (lookup(table, 55, "A"),)
+    assert records[227].info["BCSQ"] == (lookup(table, 227, "C"),)
+    assert records[227].info["AMP_ID"] == "amp2"
+    assert records[55].samples["s1"]["WSAF"] == pytest.approx((0.8, 0.2))
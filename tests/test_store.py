@@ -0,0 +1,220 @@
+import pysam
+import pytest
+from nomadic.pipeline.quickcall.store import CohortStore
+
+
+# ================================================================
+# Single-sample .vcf files, as output by `quickcall`
+#
+# ================================================================
+
+
+CHROM = "chr1"
+
+# (pos, ref, alt, GT, DP, AD) of the calls of each sample; an alt of `.`
+# is a reference-only record, and alts joined by `,` are multi-allelic
+CALLS = {
+    "s1": [
+        (100, "A", "G", (1,), 80, (10, 70)),
+        (200, "C", "T", (0, 1), 60, (30, 30)),
+        (300, "G", "A", (1,), 20, (0, 20)),  # low depth in every sample
+        (400, "A", "C", (1,), 90, (0, 90)),  # multiallelic across samples
+        (500, "AT", "A", (1,), 90, (0, 90)),  # not an SNV
+    ],
+    "s2": [
+        (100, "A", "G", (1,), 30, (5, 25)),  # low depth genotype
+        (400, "A", "T", (1,), 90, (0, 90)),
+        (600, "T", "G", (1,), 100, (10, 90)),
+    ],
+}
+
+
+def write_vcf(vcf_path, sample, calls):
+    lines = [
+        "##fileformat=VCFv4.2",
+        f"##contig=<ID={CHROM},length=1000>",
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+        '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Phred-scaled Genotype Quality">',
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Number of high-quality bases">',
+        '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths (high-quality bases)">',
+        "\t".join(
+            ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", sample]
+        ),
+    ]
+    # Written as text, as pysam pads AD of a reference-only record to two values
+    for pos, ref, alt, gt, dp, ad in calls:
+        call = [
+            "/".join(str(a) for a in gt),
+            "40",
+            str(dp),
+            ",".join(str(a) for a in ad),
+        ]
+        fields = [CHROM, pos, ".", ref, alt, 30, "PASS", ".", "GT:GQ:DP:AD", ":".join(call)]
+        lines.append("\t".join(str(f) for f in fields))
+
+    with open(vcf_path[:-3], "w") as vcf:
+        vcf.write("\n".join(lines) + "\n")
+    pysam.tabix_compress(vcf_path[:-3], vcf_path, force=True)
+
+
+@pytest.fixture
+def vcf_paths(tmp_path):
+    vcf_paths = []
+    for sample, calls in CALLS.items():
+        vcf_path = f"{tmp_path}/{sample}.vcf.gz"
+        write_vcf(vcf_path, sample, calls)
+        vcf_paths.append(vcf_path)
+    return vcf_paths
+
+
+@pytest.fixture
+def bed_path(tmp_path):
+    bed_path = f"{tmp_path}/panel.bed"
+    with open(bed_path, "w") as bed:
+        bed.write(f"{CHROM}\t0\t250\tamp1\n{CHROM}\t250\t1000\tamp2\n")
+    return bed_path
+
+
+def read_genotypes(vcf_path):
+    with pysam.VariantFile(vcf_path) as vcf:
+        return {
+            record.pos: {sample: call["GT"] for sample, call in record.samples.items()}
+            for record in vcf
+        }
+
+
+# ================================================================
+# Tests
+#
+# ================================================================
+
+
+def test_export(vcf_paths, bed_path, tmp_path):
+    """
+    Export matches `VariantMerger`, i.e. `bcftools merge` of the .vcf files,
+    keeping biallelic SNVs with a maximum depth of at least 50, and setting
+    genotypes with a depth below 50 to missing
+
+    """
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    assert store.add_vcfs(vcf_paths) == ["s1", "s2"]
+
+    output_vcf = f"{tmp_path}/merged.vcf.gz"
+    store.export_vcf(output_vcf)
+    genotypes = read_genotypes(output_vcf)
+
+    assert list(genotypes) == [100, 200, 600]
+    assert genotypes[100] == {"s1": (1,), "s2": (None,)}
+    assert genotypes[200]["s1"] == (0, 1)
+    assert set(genotypes[200]["s2"]) == {None}
+    assert set(genotypes[600]["s1"]) == {None}
+    assert genotypes[600]["s2"] == (1,)
+
+
+def test_add_current(vcf_paths, bed_path, tmp_path):
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    store.add_vcfs(vcf_paths)
+
+    # Unchanged files are skipped, also after a round trip through disk
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    assert store.add_vcfs(vcf_paths) == []
+
+    # Modified files are re-added
+    write_vcf(vcf_paths[0], "s1", CALLS["s1"][:2])
+    assert store.add_vcfs(vcf_paths) == ["s1"]
+    assert store.samples == ["s2", "s1"]
+
+
+def test_export_samples(vcf_paths, bed_path, tmp_path):
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    store.add_vcfs(vcf_paths)
+
+    samples = store.get_samples(vcf_paths[1:])
+    assert samples == ["s2"]
+
+    output_vcf = f"{tmp_path}/merged.vcf.gz"
+    store.export_vcf(output_vcf, samples=samples)
+    with pysam.VariantFile(output_vcf) as vcf:
+        assert list(vcf.header.samples) == ["s2"]
+        # 400 is biallelic within s2
+        assert [record.pos for record in vcf] == [400, 600]
+
+
+def test_amplicons(vcf_paths, bed_path, tmp_path):
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    store.add_vcfs(vcf_paths)
+    assert store.sites_df.set_index("pos")["amplicon"].to_dict() == {
+        100: "amp1",
+        200: "amp1",
+        300: "amp2",
+        400: "amp2",
+        600: "amp2",
+    }
+
+    # Amplicons follow changes to the .bed file
+    with open(bed_path, "w") as bed:
+        bed.write(f"{CHROM}\t150\t350\tamp3\n")
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    assert store.sites_df.set_index("pos")["amplicon"].dropna().to_dict() == {
+        200: "amp3",
+        300: "amp3",
+    }
+
+
+@pytest.mark.parametrize("order", [["ref", "alt"], ["alt", "ref"]])
+def test_reference_calls(order, bed_path, tmp_path):
+    """
+    As in `bcftools merge`, a reference-only record provides the call of
+    its sample at an SNV of another sample, whichever is added first
+
+    """
+    calls = {
+        "ref": [(700, "A", ".", (0,), 90, (90,))],
+        "alt": [(700, "A", "G", (1,), 80, (10, 70))],
+    }
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    for sample in order:
+        vcf_path = f"{tmp_path}/{sample}.vcf.gz"
+        write_vcf(vcf_path, sample, calls[sample])
+        store.add_vcfs([vcf_path])
+
+    output_vcf = f"{tmp_path}/merged.vcf.gz"
+    store.export_vcf(output_vcf, samples=["ref", "alt"])
+    with pysam.VariantFile(output_vcf) as vcf:
+        records = list(vcf)
+    assert [(r.pos, r.ref, r.alts) for r in records] == [(700, "A", ("G",))]
+    call = records[0].samples["ref"]
+    assert call["GT"] == (0,)
+    assert call["DP"] == 90
+    assert call["AD"] == (90, 0)
+
+    long_df = store.to_long_df(samples=["ref", "alt"]).set_index("sample")
+    assert long_df.loc["ref", "wsaf"] == 0
+    assert long_df.loc["alt", "wsaf"] == pytest.approx(0.875)
+
+
+def test_multiallelic(bed_path, tmp_path):
+    """
+    A position with a multi-allelic record in any sample is excluded,
+    as by `--max-alleles 2` after `bcftools merge`
+
+    """
+    calls = {
+        "s1": [(800, "A", "C,G", (1,), 90, (0, 60, 30))],
+        "s2": [(800, "A", "C", (1,), 90, (0, 90))],
+    }
+    vcf_paths = []
+    for sample, sample_calls in calls.items():
+        vcf_path = f"{tmp_path}/{sample}.vcf.gz"
+        write_vcf(vcf_path, sample, sample_calls)
+        vcf_paths.append(vcf_path)
+    store = CohortStore(f"{tmp_path}/cohort", bed_path)
+    store.add_vcfs(vcf_paths)
+
+    output_vcf = f"{tmp_path}/merged.vcf.gz"
+    store.export_vcf(output_vcf)
+    assert read_genotypes(output_vcf) == {}
+
+    # Without the multi-allelic sample, the site is kept
+    store.export_vcf(output_vcf, samples=["s2"])
+    assert read_genotypes(output_vcf) == {800: {"s2": (1,)}}